@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+MAP_SCRIPTS_DIR = os.path.join(BENCHMARK_DIR, "..", "Map Scripts")
+DEFAULT_BUDGET_FILE = os.path.join(BENCHMARK_DIR, "results", "import_time_budgets.json")
+
+# Modules to import and the heavy libraries that must not be loaded by just importing them
+# (they're imported inside the functions that need them)
+MAP_LIBRARIES = ["folium", "branca", "altair"]
+GEO_LIBRARIES = ["geopandas", "shapely", "pyproj"]
+IMPORT_CHECKS = {"Digitraffic_To_SQLite_functions": MAP_LIBRARIES + GEO_LIBRARIES,
+                 "update_meta":                     MAP_LIBRARIES + GEO_LIBRARIES,
+                 "Draw_Map_functions":              MAP_LIBRARIES + GEO_LIBRARIES,
+                 "update_locations":                MAP_LIBRARIES + GEO_LIBRARIES}
+
+#############################
+#        Measurements       #
+#############################
+
+def measure_import(module):
+    '''Import a module in a fresh interpreter, returns the import time (ms) and loaded top-level modules'''
+    code = f"import sys, json; import {module}; print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             cwd=MAP_SCRIPTS_DIR, capture_output=True, text=True, check=True)
+
+    # -X importtime writes "import time: self [us] | cumulative | imported package" lines to stderr
+    cumulative_us = None
+    for line in process.stderr.splitlines():
+        if(not line.startswith("import time:")):
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if(fields[2] == module):
+            cumulative_us = int(fields[1])
+
+    loaded_modules = json.loads(process.stdout.strip().splitlines()[-1])
+    return cumulative_us/1000, loaded_modules
+
+def check_imports(repeats, budget_file, tolerance, update):
+    '''Measure import times, check for eagerly loaded heavy libraries and compare times to the budgets'''
+
+    budgets = {}
+    if(os.path.exists(budget_file)):
+        with open(budget_file, "r") as file:
+            budgets = json.load(file)
+
+    failures = []
+    measured = {}
+    for module, forbidden in IMPORT_CHECKS.items():
+        # Best of several runs, the rest is mostly noise from the OS
+        results = [measure_import(module) for _ in range(repeats)]
+        import_ms = min(result[0] for result in results)
+        loaded_modules = results[0][1]
+        measured[module] = round(import_ms, 1)
+
+        line = f"{module:35} {import_ms:8.1f} ms"
+        if(module in budgets):
+            line += f"   (budget {budgets[module]:.1f} ms)"
+        print(line)
+
+        eager = [library for library in forbidden if library in loaded_modules]
+        if(eager):
+            failures.append(f"{module} imports {', '.join(eager)} at module load")
+
+        if(not update and module in budgets and import_ms > budgets[module]*(1 + tolerance)):
+            failures.append(f"{module} import took {import_ms:.1f} ms, over {budgets[module]:.1f} ms + {tolerance:.0%}")
+
+    if(update):
+        os.makedirs(os.path.dirname(budget_file), exist_ok=True)
+        with open(budget_file, "w") as file:
+            json.dump(measured, file, indent=4)
+        print(f"Saved budgets to {budget_file}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    return len(failures) == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import times of the map scripts (python -X importtime)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--budgets", default=DEFAULT_BUDGET_FILE,
+                        help="JSON of allowed import times per module in ms (machine specific, create with --update)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the budget, 0.25 = 25%%")
+    parser.add_argument("--update", action="store_true", help="Save the measured times as the new budgets")
+    args = parser.parse_args()
+
+    if(not check_imports(args.repeats, args.budgets, args.tolerance, args.update)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# python "./AIS Map/Benchmarks/benchmark_imports.py" --update   (once per machine)
+# python "./AIS Map/Benchmarks/benchmark_imports.py"            (exits with 1 on regressions)
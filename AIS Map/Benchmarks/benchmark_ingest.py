@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+
+from urllib3.util.retry import Retry
+
+from benchmark_map_build import get_commit, get_peak_rss_mb
+from digitraffic_replay_server import add_replay_arguments, create_state, start_server
+
+import Digitraffic_To_SQLite_functions
+from Digitraffic_To_SQLite_functions import (create_connection, collect_ships_locations,
+                                             collect_specific_ships_locations, collect_ships_meta,
+                                             update_meta_table, append_table, delete_duplicate_rows)
+from Metrics_functions import start_run, get_run
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+MAP_SCRIPTS_DIR = os.path.join(BENCHMARK_DIR, "..", "Map Scripts")
+DEFAULT_RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results", "ingest_results.jsonl")
+
+# Needed by analyze_destinations() in update_meta_table(), without it only collect_ships_meta() is timed
+PORT_CODES_FILE = os.path.join(MAP_SCRIPTS_DIR, "..", "Map Data", "Ports", "code-list_csv.csv")
+
+#############################
+#          Stages           #
+#############################
+
+def ingest_locations(db_connection):
+    '''Like update_locations.py without the map'''
+    locations_df = collect_ships_locations(60, 20, 700, 0)
+    append_table(db_connection, locations_df, "locations")
+    delete_duplicate_rows(db_connection, "locations", ", ".join(list(locations_df.columns)))
+    return len(locations_df)
+
+def ingest_specific_locations(db_connection, mmsi_list):
+    '''Like update_threats.py without the map'''
+    locations_df = collect_specific_ships_locations(mmsi_list)
+    append_table(db_connection, locations_df, "locations")
+    delete_duplicate_rows(db_connection, "locations", ", ".join(list(locations_df.columns)))
+    return len(locations_df)
+
+def ingest_meta(db_connection):
+    '''Like update_meta.py (initial load)'''
+    if(os.path.exists(PORT_CODES_FILE)):
+        update_meta_table(db_connection, 0)
+        return db_connection.execute("SELECT COUNT(*) FROM meta").fetchone()[0]
+    return len(collect_ships_meta(0))
+
+def run_ingest(args):
+    '''Run the ingest stages against the replay server, returns a result dict'''
+
+    state = create_state(args)
+    server, host = start_server(state)
+    Digitraffic_To_SQLite_functions.HOST = host
+    if(args.backoff_factor is not None):
+        # Sessions are created on first use, so this applies to all calls below
+        Digitraffic_To_SQLite_functions.RETRY = Retry(total=3, backoff_factor=args.backoff_factor,
+                                                      status_forcelist=[429, 500, 502, 503, 504],
+                                                      allowed_methods=["GET"], raise_on_status=False)
+
+    # The map scripts use paths relative to their own directory
+    os.chdir(MAP_SCRIPTS_DIR)
+    data_dir = tempfile.mkdtemp(prefix="ais_ingest_")
+    db_connection = create_connection(os.path.join(data_dir, "AIS.sqlite"))
+
+    mmsi_list = list(state.features_by_mmsi)[:args.specific_ships]
+    stages = [("locations",          lambda: ingest_locations(db_connection)),
+              ("specific_locations", lambda: ingest_specific_locations(db_connection, mmsi_list)),
+              ("meta",               lambda: ingest_meta(db_connection))]
+
+    results = {}
+    start_run("benchmark_ingest")
+    for stage, function in stages:
+        requests_before, errors_before = state.counts["requests"], state.counts["errors"]
+        start = time.perf_counter()
+        try:
+            rows = function()
+            error = None
+        except Exception as e:
+            # E.g. all retries failed, still report the other stages
+            rows, error = 0, repr(e)
+        duration = time.perf_counter() - start
+
+        results[stage] = {"seconds":         round(duration, 4),
+                          "rows":            rows,
+                          "rows_per_s":      round(rows/duration, 1) if duration > 0 else None,
+                          "http_requests":   state.counts["requests"] - requests_before,
+                          "injected_errors": state.counts["errors"] - errors_before,
+                          "error":           error}
+        print(f"{stage:20} {duration:8.3f} s {rows:8} rows   requests {results[stage]['http_requests']:5}, "
+              f"injected errors {results[stage]['injected_errors']:4}" + (f"   FAILED: {error}" if error else ""), flush=True)
+
+    run_metrics, _ = get_run()
+    db_connection.close()
+    server.shutdown()
+    shutil.rmtree(data_dir)
+
+    return {"commit":       None,
+            "timestamp":    datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            "replay":       {"ships": state.ships, "scale": args.scale, "recordings": args.recordings,
+                             "latency": args.latency, "latency_jitter": args.latency_jitter,
+                             "error_rate": args.error_rate, "error_status": args.error_status, "seed": args.seed},
+            "meta_analyzed": os.path.exists(PORT_CODES_FILE),
+            "stages":       results,
+            "durations_s":  {stage: round(duration, 4) for stage, duration in run_metrics["durations"].items()},
+            "sizes_bytes":  run_metrics["sizes"],
+            "peak_rss_mb":  get_peak_rss_mb()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the Digitraffic ingest against the local replay server")
+    add_replay_arguments(parser)
+    parser.add_argument("--specific-ships", type=int, default=50, help="Ships fetched one by one like update_threats.py")
+    parser.add_argument("--backoff-factor", type=float, default=None, help="Override the retry backoff, e.g. 0 for quick runs with errors")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+    args = parser.parse_args()
+
+    result = run_ingest(args)
+    result["commit"], result["dirty"] = get_commit()
+
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as file:
+        file.write(json.dumps(result) + "\n")
+
+    if(any(stage["error"] for stage in result["stages"].values())):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# python "./AIS Map/Benchmarks/benchmark_ingest.py" --synthetic-ships 5000 --scale 4
+# python "./AIS Map/Benchmarks/benchmark_ingest.py" --recordings "./AIS Map/Benchmarks/recordings" --latency 0.1 --error-rate 0.1 --backoff-factor 0
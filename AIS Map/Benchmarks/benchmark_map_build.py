@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+import itertools
+import subprocess
+from math import floor
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results", "map_build_results.jsonl")
+
+# Functions timed inside draw_map, (module name, function name)
+# Calls are summed if a function runs more than once per build
+TIMED_FUNCTIONS = [("Draw_Map_functions", "load_data"),
+                   ("Draw_Map_functions", "load_glider_data"),
+                   ("Draw_Map_functions", "process_ship_data"),
+                   ("Draw_Map_functions", "process_no_gliders_ship_data"),
+                   ("Draw_Map_functions", "classify_ships"),
+                   ("Draw_Map_functions", "save_dangerous_ship_data"),
+                   ("Draw_Map_functions", "add_glider_markers"),
+                   ("Draw_Map_functions", "add_ship_markers"),
+                   ("Draw_Map_functions", "draw_map")]
+
+#############################
+#       Measurements        #
+#############################
+
+def get_commit():
+    '''Get the current git commit and whether the tree has uncommitted changes'''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCHMARK_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+def get_peak_rss_mb():
+    '''Peak resident set size of this process in megabytes'''
+    if(resource is None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if(sys.platform == "darwin"):
+        return round(peak/1024**2, 1)
+    return round(peak/1024, 1)
+
+def time_module_functions(stage_times, prefix):
+    '''Wrap the functions in TIMED_FUNCTIONS so their durations are summed into stage_times'''
+    originals = []
+    for module_name, function_name in TIMED_FUNCTIONS:
+        module = sys.modules[module_name]
+        function = getattr(module, function_name)
+        originals.append((module, function_name, function))
+
+        def timed(*args, __function=function, __stage=f"{prefix}{function_name}", **kwargs):
+            start = time.perf_counter()
+            try:
+                return __function(*args, **kwargs)
+            finally:
+                stage_times[__stage] = stage_times.get(__stage, 0) + time.perf_counter() - start
+
+        setattr(module, function_name, timed)
+
+    return originals
+
+def restore_module_functions(originals):
+    '''Undo time_module_functions'''
+    for module, function_name, function in originals:
+        setattr(module, function_name, function)
+
+#############################
+#        Benchmarking       #
+#############################
+
+def run_one(num_ships, num_gliders, history_hours, report_interval_min, keep_dir=None):
+    '''Generate data for one scale and time the map build stages, returns a result dict'''
+
+    stages = {}
+    root = keep_dir or tempfile.mkdtemp(prefix="ais_benchmark_")
+
+    start = time.perf_counter()
+    from synthetic_ais import build_benchmark_tree
+    database = build_benchmark_tree(root, num_ships, num_gliders, history_hours, report_interval_min)
+    stages["generate_data"] = time.perf_counter() - start
+
+    # The map scripts use paths relative to their own directory
+    os.chdir(os.path.join(root, "Map Scripts"))
+
+    start = time.perf_counter()
+    import Draw_Map_functions
+    stages["import_draw_map"] = time.perf_counter() - start
+
+    db_connection = Draw_Map_functions.create_connection(database)
+    location_rows = db_connection.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+
+    since = datetime.now() - timedelta(hours=1, minutes=5)
+    since = floor(since.timestamp()*1000)
+    map_center = [59.837, 23.29]
+    vip_ships = [230000000]
+    html_file = os.path.join(root, "Map Data", "AIS_map.html")
+
+    # First build has nothing cached, second reuses the unchanged ships
+    for run in ["cold", "warm"]:
+        originals = time_module_functions(stages, f"{run}_")
+
+        ships_df = Draw_Map_functions.load_data(db_connection, since)
+        num_drawn_ships = len(ships_df)
+        map = Draw_Map_functions.draw_map(map_center, ships_df, vip_ships, db_connection)
+
+        start = time.perf_counter()
+        map.save(html_file)
+        stages[f"{run}_map_save"] = time.perf_counter() - start
+
+        restore_module_functions(originals)
+
+    db_connection.close()
+    html_bytes = os.path.getsize(html_file)
+
+    if(keep_dir is None):
+        os.chdir(BENCHMARK_DIR)
+        shutil.rmtree(root)
+
+    return {"commit":        None,
+            "timestamp":     datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            "scale":         {"ships": num_ships, "gliders": num_gliders,
+                              "history_hours": history_hours, "report_interval_min": report_interval_min},
+            "rows":          {"locations": location_rows, "drawn_ships": num_drawn_ships},
+            "stages":        {stage: round(duration, 4) for stage, duration in stages.items()},
+            "peak_rss_mb":   get_peak_rss_mb(),
+            "html_bytes":    html_bytes,
+            "data_dir":      root if keep_dir else None}
+
+def run_scales(ship_counts, glider_counts, history_hours_list, report_interval_min, results_file):
+    '''Run each scale in its own interpreter so imports and peak memory don't carry over'''
+
+    commit, dirty = get_commit()
+
+    for num_ships, num_gliders, history_hours in itertools.product(ship_counts, glider_counts, history_hours_list):
+        print(f"ships={num_ships} gliders={num_gliders} history_hours={history_hours}", flush=True)
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "run-one",
+                                  "--ships", str(num_ships), "--gliders", str(num_gliders),
+                                  "--history-hours", str(history_hours),
+                                  "--report-interval", str(report_interval_min)],
+                                 cwd=BENCHMARK_DIR, capture_output=True, text=True)
+        if(process.returncode != 0):
+            print(process.stderr)
+            continue
+
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result["commit"] = commit
+        result["dirty"] = dirty
+
+        print(f"    {json.dumps(result['stages'])}")
+        print(f"    peak RSS {result['peak_rss_mb']} MB, HTML {result['html_bytes']} bytes")
+
+        os.makedirs(os.path.dirname(results_file), exist_ok=True)
+        with open(results_file, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+def compare_results(results_file, commits):
+    '''Print stage durations of the latest result per scale for the given commits side by side'''
+
+    with open(results_file, "r") as file:
+        results = [json.loads(line) for line in file if line.strip()]
+
+    if(not commits):
+        # Default to the last two commits benchmarked
+        commits = list(dict.fromkeys(result["commit"] for result in reversed(results)))[:2][::-1]
+
+    latest = {}
+    for result in results:
+        if(result["commit"] in commits):
+            scale = tuple(result["scale"].items())
+            latest[(scale, result["commit"])] = result
+
+    for scale in sorted({scale for scale, _ in latest}):
+        print(", ".join(f"{name}={value}" for name, value in scale))
+        scale_results = [latest.get((scale, commit)) for commit in commits]
+        stages = list(dict.fromkeys(stage for result in scale_results if result for stage in result["stages"]))
+        # Results of benchmark_processing.py have no HTML
+        totals = [total for total in ["peak_rss_mb", "html_bytes"] if any(result and total in result for result in scale_results)]
+        print(f"    {'stage':40}" + "".join(f"{str(commit):>14}" for commit in commits))
+        for stage in stages + totals:
+            values = []
+            for result in scale_results:
+                if(result is None):
+                    values.append("-")
+                elif(stage in result["stages"]):
+                    values.append(f"{result['stages'][stage]:.4f}")
+                else:
+                    values.append(str(result.get(stage, "-")))
+            print(f"    {stage:40}" + "".join(f"{value:>14}" for value in values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AIS map build with synthetic data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Benchmark every combination of the given scales")
+    run_parser.add_argument("--ships", type=int, nargs="+", default=[1000, 5000])
+    run_parser.add_argument("--gliders", type=int, nargs="+", default=[1])
+    run_parser.add_argument("--history-hours", type=float, nargs="+", default=[3])
+    run_parser.add_argument("--report-interval", type=float, default=10,
+                            help="Minutes between location reports of a ship")
+    run_parser.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+
+    one_parser = subparsers.add_parser("run-one", help="Benchmark a single scale and print the result as JSON")
+    one_parser.add_argument("--ships", type=int, required=True)
+    one_parser.add_argument("--gliders", type=int, required=True)
+    one_parser.add_argument("--history-hours", type=float, required=True)
+    one_parser.add_argument("--report-interval", type=float, default=10)
+    one_parser.add_argument("--keep-dir", default=None, help="Generate the data here and keep it")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare stored results between commits")
+    compare_parser.add_argument("commits", nargs="*")
+    compare_parser.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+
+    args = parser.parse_args()
+
+    if(args.command == "run"):
+        run_scales(args.ships, args.gliders, args.history_hours, args.report_interval, args.results)
+    elif(args.command == "run-one"):
+        result = run_one(args.ships, args.gliders, args.history_hours, args.report_interval, args.keep_dir)
+        print(json.dumps(result))
+    elif(args.command == "compare"):
+        compare_results(args.results, args.commits)
+
+if __name__ == "__main__":
+    main()
+
+# python "./AIS Map/Benchmarks/benchmark_map_build.py" run --ships 1000 10000 50000 --gliders 1 5 --history-hours 3 336
+# python "./AIS Map/Benchmarks/benchmark_map_build.py" compare
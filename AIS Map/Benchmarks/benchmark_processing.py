@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results", "processing_results.jsonl")
+
+# The map scripts aren't a package, they're imported from their own directory
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "Map Scripts"))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "Glider Data Processing"))
+
+from synthetic_ais import (generate_ships, generate_locations, generate_meta, generate_threats, generate_classification_inputs,
+                           generate_locations_payload, generate_meta_payload, streamed, generate_surfacings, write_network_log,
+                           write_goto_file)
+from benchmark_map_build import get_commit, get_peak_rss_mb, compare_results
+
+from Digitraffic_To_SQLite_functions import (etas_to_datetimes, collect_ships_locations, collect_ships_meta, create_connection,
+                                             append_unique)
+from Draw_Map_functions import classify_ships, load_glider_sensors, THREATS_KEY
+from parse2 import parse_glider_data, find_new_logs
+from glider_plans import read_plans, find_new_plans, save_plans, plan_at
+from glider_positions import write_positions, append_positions, read_positions
+from glider_forecast import update_forecast
+from glider_database import sync_database
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+START = datetime(2023, 11, 9)
+INTERESTING_SENSORS = ["m_battery", "m_coulomb_amphr_total", "m_digifin_leakdetect_reading", "m_lithium_battery_relative_charge"]
+
+#############################
+#        Measurements       #
+#############################
+
+def best_time(function, repeats):
+    '''Best time of repeats in seconds'''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def time_eta_decoding(data_dir, args):
+    '''etas_to_datetimes() for every ship's ETA'''
+    etas = pd.Series(np.random.default_rng(0).integers(0, 2**20, args.ships))
+    return {"etas_to_datetimes": best_time(lambda: etas_to_datetimes(etas), args.repeats)}
+
+def time_response_parsing(data_dir, args):
+    '''Streamed parsing of the /locations and /vessels responses'''
+    locations_payload = generate_locations_payload(args.ships)
+    meta_payload = generate_meta_payload(args.ships)
+    return {"collect_ships_locations": best_time(lambda: streamed(lambda: collect_ships_locations(59.837, 23.29, 700, 0), locations_payload), args.repeats),
+            "collect_ships_meta":      best_time(lambda: streamed(lambda: collect_ships_meta(0), meta_payload), args.repeats)}
+
+def time_threat_writes(data_dir, args):
+    '''A batch of 500 threat rows, half of them already saved, appended to the threats table'''
+    rng = np.random.default_rng(0)
+    now = int(START.timestamp()*1000)
+    ships = generate_ships(args.ships, 1, rng)
+    locations_df = generate_locations(ships, 24, 10, 30, now, rng)
+    threats_df = generate_threats(locations_df, generate_meta(ships, now, rng), args.threat_rows + 500*args.repeats, rng)
+    db_connection = create_connection(os.path.join(data_dir, "AIS.sqlite"))
+    append_unique(db_connection, threats_df.iloc[:args.threat_rows], "threats", THREATS_KEY)
+    batches = iter([threats_df.iloc[args.threat_rows + 500*repeat - 250:args.threat_rows + 500*repeat + 250] for repeat in range(args.repeats)])
+    seconds = best_time(lambda: append_unique(db_connection, next(batches), "threats", THREATS_KEY), args.repeats)
+    db_connection.close()
+    return {"append_unique": seconds}
+
+def time_classification(data_dir, args):
+    '''classify_ships() for every ship and glider'''
+    classification_inputs = generate_classification_inputs(args.ships, args.gliders, np.random.default_rng(0))
+    return {"classify_ships": best_time(lambda: classify_ships(*classification_inputs), args.repeats)}
+
+def write_logs(log_dir, count):
+    '''Network logs of a mission, one every 20 minutes, returns their filenames'''
+    os.makedirs(log_dir)
+    filenames = [f"koskelo_{START + timedelta(minutes=20*index):%Y%m%dT%H%M%S}_network_net_0.log" for index in range(count)]
+    for index, filename in enumerate(filenames):
+        write_network_log(log_dir + filename, "koskelo", generate_surfacings("koskelo", START + timedelta(minutes=20*index), 3, seed=index))
+    return filenames
+
+def time_log_parsing(data_dir, args):
+    '''Parsing every network log of the mission'''
+    log_dir = os.path.join(data_dir, "logs") + "/"
+    filenames = write_logs(log_dir, args.logs)
+
+    def parse_logs():
+        for filename in filenames:
+            with open(log_dir + filename, "r") as file:
+                parse_glider_data(file)
+
+    return {"parse_glider_data": best_time(parse_logs, args.repeats)}
+
+def write_store(positions_dir, args):
+    '''Stores --history surfacings of each glider, returns every glider's surfacings with 3 more per repeat (and 3 extra) to append'''
+    surfacings = {}
+    for number in range(args.gliders):
+        surfacings[number] = generate_surfacings(f"glider{number}", START, args.history + 3*(args.repeats + 1), seed=number)
+        write_positions(positions_dir, f"glider{number}", surfacings[number][:args.history])
+    return surfacings
+
+def day_before(surfacing):
+    '''Datetime string 24 hours before a surfacing, the start of the map's last 24 hours'''
+    return (datetime.strptime(surfacing["datetime"], DATETIME_FORMAT) - timedelta(hours=24)).strftime(DATETIME_FORMAT)
+
+def time_position_store(data_dir, args):
+    '''Appending new surfacings to a long mission and reading it back, whole and the last 24 hours'''
+    positions_dir = os.path.join(data_dir, "positions")
+    surfacings = write_store(positions_dir, args)[0]
+    times = {}
+
+    # Three new surfacings per run
+    batches = iter([surfacings[index:index + 3] for index in range(args.history, args.history + 3*args.repeats, 3)])
+    times["append_positions"] = best_time(lambda: append_positions(positions_dir, "glider0", next(batches)), args.repeats)
+    times["read_positions"] = best_time(lambda: read_positions(positions_dir, "glider0"), args.repeats)
+    start = day_before(surfacings[args.history - 1])
+    times["read_positions_24h"] = best_time(lambda: read_positions(positions_dir, "glider0", start=start), args.repeats)
+    return times
+
+def time_log_discovery(data_dir, args):
+    '''Finding the one new log among the mission's logs'''
+    log_dir = os.path.join(data_dir, "logs") + "/"
+    filenames = write_logs(log_dir, args.logs)
+    processed_logs = find_new_logs(log_dir, {}, "20231108")
+    del processed_logs[filenames[-1]]
+    return {"find_new_logs": best_time(lambda: find_new_logs(log_dir, processed_logs, "20231108"), args.repeats)}
+
+def time_goto_plans(data_dir, args):
+    '''Checking an unchanged archive for new goto files and finding the plan in force at a time'''
+    goto_dir = os.path.join(data_dir, "archive")
+    plans_dir = os.path.join(data_dir, "plans")
+    os.makedirs(goto_dir)
+    for index in range(args.gotos):
+        sent = START + timedelta(hours=6*index)
+        write_goto_file(f"{goto_dir}/{sent:%Y%m%dT%H%M%S}_goto_l10.ma", [[23.228, 59.736 + index/10000], [23.234, 59.745]])
+        with open(f"{goto_dir}/{sent:%Y%m%dT%H%M%S}_yo_l10.ma", "w") as file:
+            file.write("behavior_name=yo\n")
+    new_plans, files = find_new_plans(goto_dir, read_plans(plans_dir, "koskelo"))
+    save_plans(plans_dir, "koskelo", new_plans, files)
+
+    middle = START + timedelta(hours=3*args.gotos)
+    return {"find_new_plans": best_time(lambda: find_new_plans(goto_dir, read_plans(plans_dir, "koskelo")), args.repeats),
+            "plan_at":        best_time(lambda: plan_at(plans_dir, "koskelo", middle), args.repeats)}
+
+def time_glider_sensors(data_dir, args):
+    '''The map's glider sensors of every glider, the first load writes the column files'''
+    positions_dir = os.path.join(data_dir, "Map Data", "Gliders", "JSONs", "positions")
+    os.makedirs(os.path.join(data_dir, "Map Scripts"))
+    start = day_before(write_store(positions_dir, args)[0][args.history - 1])
+    times = {}
+
+    # The glider data is read relative to the Map Scripts folder
+    working_dir = os.getcwd()
+    os.chdir(os.path.join(data_dir, "Map Scripts"))
+    try:
+        times["load_glider_sensors_first"] = best_time(lambda: load_glider_sensors(INTERESTING_SENSORS), 1)
+        times["load_glider_sensors"] = best_time(lambda: load_glider_sensors(INTERESTING_SENSORS), args.repeats)
+        times["load_glider_sensors_24h"] = best_time(lambda: load_glider_sensors(INTERESTING_SENSORS, start), args.repeats)
+    finally:
+        os.chdir(working_dir)
+    return times
+
+def time_battery_forecast(data_dir, args):
+    '''Updating a glider's battery forecast with three new surfacings'''
+    positions_dir = os.path.join(data_dir, "positions")
+    forecasts_dir = os.path.join(data_dir, "forecasts")
+    surfacings = write_store(positions_dir, args)[0]
+    update_forecast(positions_dir, forecasts_dir, "glider0")
+    append_positions(positions_dir, "glider0", surfacings[args.history:args.history + 3])
+    return {"update_forecast": best_time(lambda: update_forecast(positions_dir, forecasts_dir, "glider0"), 1)}
+
+def time_glider_database(data_dir, args):
+    '''Syncing the glider tables with the position store, first every stored surfacing and then three new ones'''
+    positions_dir = os.path.join(data_dir, "positions")
+    database = os.path.join(data_dir, "AIS.sqlite")
+    surfacings = write_store(positions_dir, args)[0]
+    times = {"sync_database_first": best_time(lambda: sync_database(database, positions_dir), 1)}
+    append_positions(positions_dir, "glider0", surfacings[args.history:args.history + 3])
+    times["sync_database"] = best_time(lambda: sync_database(database, positions_dir), 1)
+    return times
+
+STAGES = {"eta_decoding":     time_eta_decoding,
+          "response_parsing": time_response_parsing,
+          "threat_writes":    time_threat_writes,
+          "classification":   time_classification,
+          "log_parsing":      time_log_parsing,
+          "position_store":   time_position_store,
+          "log_discovery":    time_log_discovery,
+          "goto_plans":       time_goto_plans,
+          "glider_sensors":   time_glider_sensors,
+          "battery_forecast": time_battery_forecast,
+          "glider_database":  time_glider_database}
+
+def run(args):
+    '''Time the stages at one scale, print them and append them to the results'''
+    scale = {name: value for name, value in vars(args).items() if name not in ["command", "stages", "repeats", "results"]}
+    print(f"{json.dumps(scale)} (best of {args.repeats})")
+
+    stages = {}
+    for name in args.stages:
+        data_dir = tempfile.mkdtemp(prefix=f"benchmark_{name}_")
+        try:
+            for stage, seconds in STAGES[name](data_dir, args).items():
+                stages[stage] = round(seconds, 5)
+                print(f"    {stage:28} {seconds*1000:9.2f} ms", flush=True)
+        finally:
+            shutil.rmtree(data_dir)
+
+    commit, dirty = get_commit()
+    result = {"time":        datetime.now().isoformat(timespec="seconds"),
+              "commit":      commit,
+              "dirty":       dirty,
+              "scale":       scale,
+              "stages":      stages,
+              "peak_rss_mb": get_peak_rss_mb()}
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as file:
+        file.write(json.dumps(result) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the ship and glider data processing stages on synthetic data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Time the stages at one scale")
+    run_parser.add_argument("--ships", type=int, default=20000)
+    run_parser.add_argument("--gliders", type=int, default=3)
+    run_parser.add_argument("--history", type=int, default=10000, help="Stored surfacings per glider")
+    run_parser.add_argument("--logs", type=int, default=1000, help="Network logs of the mission")
+    run_parser.add_argument("--gotos", type=int, default=1000, help="Goto files in the archive")
+    run_parser.add_argument("--threat-rows", type=int, default=100000, help="Rows in the threats table")
+    run_parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    run_parser.add_argument("--repeats", type=int, default=3)
+    run_parser.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare stored results between commits")
+    compare_parser.add_argument("commits", nargs="*")
+    compare_parser.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+
+    args = parser.parse_args()
+
+    if(args.command == "run"):
+        run(args)
+    elif(args.command == "compare"):
+        compare_results(args.results, args.commits)
+
+if __name__ == "__main__":
+    main()
+
+# python "./AIS Map/Benchmarks/benchmark_processing.py" run
+# python "./AIS Map/Benchmarks/benchmark_processing.py" run --stages glider_sensors battery_forecast --history 50000
+# python "./AIS Map/Benchmarks/benchmark_processing.py" compare
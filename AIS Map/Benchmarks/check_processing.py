@@ -0,0 +1,551 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import traceback
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+# The map scripts aren't a package, they're imported from their own directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Map Scripts"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Glider Data Processing"))
+
+from synthetic_ais import (generate_ships, generate_locations, generate_meta, generate_threats, generate_classification_inputs,
+                           generate_locations_payload, generate_meta_payload, streamed, generate_surfacings, write_network_log,
+                           write_goto_file)
+
+import Digitraffic_To_SQLite_functions
+from Digitraffic_To_SQLite_functions import (eta_to_datetime, etas_to_datetimes, collect_ships_locations, collect_ships_meta,
+                                             new_columns, append_location_feature, format_ships_locations, format_ships_meta,
+                                             create_connection, append_unique, LOCATION_COLUMN_TYPES)
+from Draw_Map_functions import classify_ships, haversine_distance, load_glider_sensors, THREATS_KEY
+from parse2 import parse_glider_data, find_new_logs, read_processed_logs, write_processed_logs
+from glider_plans import parse_goto, read_plans, find_new_plans, save_plans, plan_at
+from glider_positions import (write_positions, append_positions, read_positions, read_appended_positions, tail_positions,
+                              remove_positions_until, read_index)
+from glider_forecast import update_forecast, empty_forecast, add_surfacings, forecast, FORECAST_SENSORS, GRADIENT_HOURS
+from glider_database import sync_database
+
+GLIDERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Map Data", "Gliders")
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+START = datetime(2023, 11, 9)
+
+# DDmm.mmm has a thousandth of a minute, rounded again to 5 decimals when parsed
+DDMM_TOLERANCE = 2e-5
+
+#############################
+#        Ship checks        #
+#############################
+
+class FixedDatetime(datetime):
+    '''datetime with a settable now() for running eta_to_datetime() on other dates'''
+    fixed_now = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fixed_now
+
+def check_eta_decoding(data_dir):
+    '''etas_to_datetimes() (collect_ships_meta) gives the same datetimes as eta_to_datetime() for every 20 bit ETA,
+    on dates where the rollover to next year matters (incl. February 29th)'''
+    failures = []
+    # Every combination of month, day, hour and minute bits (incl. invalid and default values)
+    etas = pd.Series(np.arange(2**20, dtype=np.int64))
+    for now in [datetime(2023, 6, 15), datetime(2027, 12, 20), datetime(2028, 8, 30, 12, 0), datetime(2028, 3, 1)]:
+        FixedDatetime.fixed_now = FixedDatetime.fromtimestamp(now.timestamp())
+        Digitraffic_To_SQLite_functions.datetime = FixedDatetime
+        try:
+            expected = pd.to_datetime(etas.apply(eta_to_datetime))
+        finally:
+            Digitraffic_To_SQLite_functions.datetime = datetime
+
+        result = etas_to_datetimes(etas, now)
+        mismatches = ~((result == expected) | (result.isna() & expected.isna()))
+        if(mismatches.any()):
+            failures.append(f"{mismatches.sum()} ETAs decoded differently on {now:%Y-%m-%d}, e.g. {list(etas[mismatches].head(5))}")
+    return failures
+
+def frame_difference(expected, result):
+    '''Difference of dataframes as a string, None if equal'''
+    try:
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+    except AssertionError as e:
+        return str(e)
+    return None
+
+def check_response_parsing(data_dir):
+    '''Streamed collect_ships_locations() and collect_ships_meta() give the same dataframes as decoding the whole response
+    like collect_specific_ships_locations() and collect_specific_ships_meta(), also with chunks splitting items and
+    multi-byte characters, and a null in an integer field is NaN'''
+    failures = []
+
+    locations_payload = generate_locations_payload(5000)
+    features = json.loads(locations_payload)["features"]
+    columns = new_columns(LOCATION_COLUMN_TYPES)
+    for feature in features:
+        append_location_feature(columns, feature)
+    expected_locations = format_ships_locations(columns, 0).drop(columns="locAPICallTimestamp")
+
+    meta_payload = generate_meta_payload(5000)
+    meta_df = pd.DataFrame.from_dict(json.loads(meta_payload))
+    meta_df["metaAPICallTimestamp"] = 0
+    expected_meta = format_ships_meta(meta_df).drop(columns="metaAPICallTimestamp")
+
+    for chunk_size in [2**16, 7]:
+        locations = streamed(lambda: collect_ships_locations(59.837, 23.29, 700, 0), locations_payload, chunk_size)
+        difference = frame_difference(expected_locations, locations.drop(columns="locAPICallTimestamp"))
+        if(difference is not None):
+            failures.append(f"streamed locations in {chunk_size} byte chunks differ from the whole response:\n{difference}")
+
+        meta = streamed(lambda: collect_ships_meta(0), meta_payload, chunk_size)
+        difference = frame_difference(expected_meta, meta.drop(columns="metaAPICallTimestamp"))
+        if(difference is not None):
+            failures.append(f"streamed meta in {chunk_size} byte chunks differs from the whole response:\n{difference}")
+
+    # The payload has nulls in integer fields now and then
+    properties = pd.DataFrame([feature["properties"] for feature in features])
+    for field, column in [("mmsi", "mmsi"), ("navStat", "navStat"), ("posAcc", "posAcc"), ("timestampExternal", "locUpdateTimestamp")]:
+        if(not (locations[column].isna().to_numpy() == properties[field].isna().to_numpy()).all()):
+            failures.append(f"null {field} values aren't NaN in the locations")
+    return failures
+
+def check_threat_writes(data_dir):
+    '''append_unique() saves overlapping batches of threat rows like pandas would save them without the rows already in the table
+    (one per THREATS_KEY), and rows appended with commit=False are gone after a rollback'''
+    failures = []
+    rng = np.random.default_rng(0)
+    now = int(START.timestamp()*1000)
+    ships = generate_ships(300, 1, rng)
+    locations_df = generate_locations(ships, 3, 10, 30, now, rng)
+    threats_df = generate_threats(locations_df, generate_meta(ships, now, rng), 1000, rng)
+    batches = [threats_df.iloc[:600], threats_df.iloc[400:], threats_df.iloc[500:700]]
+
+    db_connection = create_connection(os.path.join(data_dir, "AIS.sqlite"))
+    for batch in batches:
+        append_unique(db_connection, batch, "threats", THREATS_KEY)
+    saved = pd.read_sql("SELECT * FROM threats", db_connection)
+
+    expected_connection = sqlite3.connect(os.path.join(data_dir, "expected.sqlite"))
+    pd.concat(batches).drop_duplicates(THREATS_KEY).to_sql("threats", expected_connection, index=False)
+    expected = pd.read_sql("SELECT * FROM threats", expected_connection)
+    expected_connection.close()
+
+    difference = frame_difference(expected.sort_values(THREATS_KEY), saved.sort_values(THREATS_KEY))
+    if(difference is not None):
+        failures.append(f"saved threats differ from the unique rows of the batches:\n{difference}")
+
+    later = threats_df.iloc[:100].copy()
+    later["locAPICallTimestamp"] += 1
+    append_unique(db_connection, later, "threats", THREATS_KEY, commit=False)
+    db_connection.rollback()
+    if(db_connection.execute("SELECT COUNT(*) FROM threats").fetchone()[0] != len(saved)):
+        failures.append("rows appended with commit=False were saved after a rollback")
+    db_connection.close()
+    return failures
+
+def check_classification(data_dir):
+    '''classify_ships() gives every glider the same classes and distances as classifying for it alone, the distances
+    are haversine_distance() and the last rules win (VIP ships 99, ships within 10 km 5, stationary ships 4)'''
+    failures = []
+    rng = np.random.default_rng(0)
+    ships_df, ship_ranges, vip_ships, latest_locs, regions_list, wpt_lines = generate_classification_inputs(5000, 6, rng)
+    threat_classes, distances = classify_ships(ships_df, ship_ranges, vip_ships, latest_locs, regions_list, wpt_lines)
+
+    for number in range(len(latest_locs)):
+        classes_alone, distances_alone = classify_ships(ships_df, ship_ranges, vip_ships, latest_locs[number:number + 1],
+                                                        regions_list[number:number + 1], wpt_lines[number:number + 1])
+        if(not np.array_equal(threat_classes[:, number], classes_alone[:, 0])):
+            failures.append(f"glider {number} classified differently alone for {np.sum(threat_classes[:, number] != classes_alone[:, 0])} ships")
+        if(not np.array_equal(distances[:, number], distances_alone[:, 0])):
+            failures.append(f"glider {number} distances differ alone")
+
+    expected_distances = np.array([[haversine_distance([latitude, longitude], latest_loc) for latest_loc in latest_locs]
+                                   for latitude, longitude in zip(ships_df["latitude"], ships_df["longitude"])])
+    if(not np.allclose(distances, expected_distances, rtol=1e-12, atol=0)):
+        failures.append(f"distances differ from haversine_distance() by up to {np.max(np.abs(distances - expected_distances))} km")
+
+    vip = ships_df["mmsi"].isin(vip_ships).to_numpy()[:, np.newaxis]
+    near = distances < 10
+    stationary = (ships_df["sog"] == 0).to_numpy()[:, np.newaxis]
+    for name, rule, expected_class in [("VIP", vip & np.ones_like(near), 99),
+                                       ("within 10 km", near & ~vip, 5),
+                                       ("stationary", stationary & ~near & ~vip, 4)]:
+        if(not (threat_classes[rule] == expected_class).all()):
+            failures.append(f"{np.sum(threat_classes[rule] != expected_class)} {name} ship/glider pairs aren't class {expected_class}")
+    return failures
+
+#############################
+#       Glider checks       #
+#############################
+
+def check_log_parsing(data_dir):
+    '''parse_glider_data() reads back the surfacings written into a network log, skipping the ones whose DR location line
+    was cut, and parses the logs in ../Map Data/Gliders/<glider>/logs'''
+    failures = []
+    surfacings = generate_surfacings("koskelo", START, 60)
+    cut_locations = {5, 17}
+    filename = os.path.join(data_dir, "koskelo_20231109T000000_network_net_0.log")
+    write_network_log(filename, "koskelo", surfacings, cut_locations)
+
+    with open(filename, "r") as file:
+        glider, log_data = parse_glider_data(file)
+    expected = [surfacing for index, surfacing in enumerate(surfacings) if index not in cut_locations]
+    if(glider != "koskelo"):
+        failures.append(f"vehicle name {glider} instead of koskelo")
+    if(len(log_data) != len(expected)):
+        failures.append(f"{len(log_data)} surfacings parsed instead of {len(expected)}")
+    for surfacing, expected_surfacing in zip(log_data, expected):
+        location, expected_location = surfacing.pop("location"), expected_surfacing["location"]
+        if(surfacing != {key: value for key, value in expected_surfacing.items() if key != "location"} or
+           any(abs(location[key] - expected_location[key]) > DDMM_TOLERANCE for key in ["latitude", "longitude"])):
+            failures.append(f"surfacing at {expected_surfacing['datetime']} parsed differently")
+            break
+
+    for filename in sorted(os.listdir(GLIDERS_DIR)) if os.path.isdir(GLIDERS_DIR) else []:
+        log_dir = os.path.join(GLIDERS_DIR, filename, "logs")
+        for log in sorted(os.listdir(log_dir)) if os.path.isdir(log_dir) else []:
+            try:
+                with open(os.path.join(log_dir, log), "r") as file:
+                    parse_glider_data(file)
+            except Exception as e:
+                failures.append(f"{log} couldn't be parsed: {e}")
+    return failures
+
+def check_position_store(data_dir):
+    '''The position store returns what was stored: appended surfacings, older ones inserted once, the surfacings in a
+    datetime range, the latest ones, the ones appended after an offset and what's left after removing a mission's start'''
+    failures = []
+    positions_dir = os.path.join(data_dir, "positions")
+    surfacings = generate_surfacings("koskelo", START, 500)
+    older = generate_surfacings("koskelo", START - timedelta(days=30), 3, seed=1)
+
+    write_positions(positions_dir, "koskelo", surfacings[:300])
+    added = [append_positions(positions_dir, "koskelo", surfacings[300:400]),
+             # Overlaps the stored ones
+             append_positions(positions_dir, "koskelo", surfacings[390:450]),
+             append_positions(positions_dir, "koskelo", older),
+             append_positions(positions_dir, "koskelo", older)]
+    if(added != [100, 50, 3, 0]):
+        failures.append(f"{added} surfacings added instead of [100, 50, 3, 0]")
+    stored = older + surfacings[:450]
+    if(read_positions(positions_dir, "koskelo") != stored):
+        failures.append("stored surfacings differ from the appended ones")
+
+    if(read_positions(positions_dir, "koskelo", start=stored[100]["datetime"], end=stored[200]["datetime"]) != stored[100:201]):
+        failures.append("surfacings in a datetime range differ")
+    if(tail_positions(positions_dir, "koskelo", 10) != stored[-10:]):
+        failures.append("latest surfacings differ")
+
+    entry = read_index(positions_dir)["koskelo"]
+    append_positions(positions_dir, "koskelo", surfacings[450:])
+    stored += surfacings[450:]
+    appended, _ = read_appended_positions(positions_dir, "koskelo", entry["file_id"], entry["bytes"])
+    if(appended != surfacings[450:]):
+        failures.append("surfacings appended after an offset differ")
+
+    removed = remove_positions_until(positions_dir, "koskelo", stored[49]["datetime"])
+    if(removed != 50 or read_positions(positions_dir, "koskelo") != stored[50:]):
+        failures.append(f"{removed} surfacings removed instead of 50, or the wrong ones")
+    return failures
+
+def check_log_discovery(data_dir):
+    '''find_new_logs() finds the mission's logs not in the processed log index (made from the old log_list.txt), and
+    processed logs that were appended to or replaced with an older modification time'''
+    failures = []
+    log_dir = os.path.join(data_dir, "logs") + "/"
+    os.makedirs(log_dir)
+    old = time.time() - 2*24*3600
+    filenames = [f"koskelo_{START + timedelta(minutes=20*index):%Y%m%dT%H%M%S}_network_net_0.log" for index in range(50)]
+    # From before the mission start
+    earlier = f"koskelo_{START - timedelta(days=10):%Y%m%dT%H%M%S}_network_net_0.log"
+    for index, filename in enumerate([earlier] + filenames):
+        write_network_log(log_dir + filename, "koskelo", generate_surfacings("koskelo", START, 3, seed=index))
+        os.utime(log_dir + filename, (old, old))
+
+    log_list_file = os.path.join(data_dir, "log_list.txt")
+    with open(log_list_file, "w") as file:
+        file.writelines(filename + "\n" for filename in filenames[:-1])
+    processed_logs_file = os.path.join(data_dir, "processed_logs.json")
+    processed_logs = read_processed_logs(processed_logs_file, log_list_file, log_dir)
+
+    start_mission = f"{START - timedelta(days=1):%Y%m%d}"
+    new_logs = find_new_logs(log_dir, processed_logs, start_mission)
+    if(sorted(new_logs) != filenames[-1:]):
+        failures.append(f"found {sorted(new_logs)} instead of the new log {filenames[-1]}")
+
+    processed_logs.update(new_logs)
+    write_processed_logs(processed_logs_file, processed_logs)
+    with open(log_dir + filenames[3], "a") as file:
+        file.write("Curr Time: Thu Nov  9 11:39:09 2023 MT:    9412\n")
+    os.utime(log_dir + filenames[3], (old, old))
+    # Same size, older modification time
+    os.utime(log_dir + filenames[7], (old - 3600, old - 3600))
+    new_logs = find_new_logs(log_dir, read_processed_logs(processed_logs_file, log_list_file, log_dir), start_mission)
+    if(sorted(new_logs) != [filenames[3], filenames[7]]):
+        failures.append(f"found {sorted(new_logs)} instead of the changed logs {filenames[3]} and {filenames[7]}")
+    return failures
+
+def check_goto_plans(data_dir):
+    '''parse_goto() reads back the waypoints written into goto files (looped or not) and the ones in
+    ../Map Data/Gliders/<glider>/archive, find_new_plans() finds nothing new in an unchanged or touched archive
+    and an edited goto file as a new plan, and plan_at() gives the latest plan at or before a time'''
+    failures = []
+    goto_dir = os.path.join(data_dir, "archive")
+    plans_dir = os.path.join(data_dir, "plans")
+    os.makedirs(goto_dir)
+    generator = random.Random(0)
+    written = {}
+    for index in range(40):
+        sent = START + timedelta(hours=6*index)
+        waypoints = [[round(generator.uniform(21, 25), 5), round(generator.uniform(59, 61), 5)] for _ in range(generator.randint(1, 6))]
+        loop = index % 3 != 0
+        write_goto_file(f"{goto_dir}/{sent:%Y%m%dT%H%M%S}_goto_l10.ma", waypoints, loop)
+        with open(f"{goto_dir}/{sent:%Y%m%dT%H%M%S}_yo_l10.ma", "w") as file:
+            file.write("behavior_name=yo\n")
+        written[f"{sent:%Y%m%dT%H%M%S}_goto_l10.ma"] = (sent, waypoints + waypoints[:1] if loop else waypoints)
+
+    def same_waypoints(waypoints, expected):
+        return (len(waypoints) == len(expected) and
+                all(abs(value - expected_value) <= DDMM_TOLERANCE
+                    for waypoint, expected_waypoint in zip(waypoints, expected) for value, expected_value in zip(waypoint, expected_waypoint)))
+
+    new_plans, files = find_new_plans(goto_dir, read_plans(plans_dir, "koskelo"))
+    if(sorted(plan["file"] for plan in new_plans) != sorted(written)):
+        failures.append(f"{len(new_plans)} plans found instead of {len(written)}")
+    for plan in new_plans:
+        sent, waypoints = written[plan["file"]]
+        if(plan["time"] != sent.strftime(DATETIME_FORMAT) or not same_waypoints(plan["waypoints"], waypoints)):
+            failures.append(f"{plan['file']} parsed as {plan['time']} {plan['waypoints']}")
+            break
+    save_plans(plans_dir, "koskelo", new_plans, files)
+
+    for name in list(written)[:5]:
+        os.utime(f"{goto_dir}/{name}")
+    new_plans, files = find_new_plans(goto_dir, read_plans(plans_dir, "koskelo"))
+    save_plans(plans_dir, "koskelo", new_plans, files)
+    if(len(new_plans) > 0 or len(find_new_plans(goto_dir, read_plans(plans_dir, "koskelo"))[0]) > 0):
+        failures.append("unchanged or touched goto files found as new plans")
+
+    if(plan_at(plans_dir, "koskelo", START - timedelta(seconds=1)) is not None):
+        failures.append("a plan in force before the first goto file")
+    for name, (sent, _) in list(written.items())[::7]:
+        for at in [sent, sent + timedelta(hours=3)]:
+            plan = plan_at(plans_dir, "koskelo", at)
+            if(plan is None or plan["file"] != name):
+                failures.append(f"plan in force at {at} is {plan and plan['file']} instead of {name}")
+
+    latest = list(written)[-1]
+    with open(f"{goto_dir}/{latest}", "a") as file:
+        file.write("# edited\n")
+    new_plans, files = find_new_plans(goto_dir, read_plans(plans_dir, "koskelo"))
+    save_plans(plans_dir, "koskelo", new_plans, files)
+    if([plan["file"] for plan in new_plans] != [latest]):
+        failures.append(f"found {[plan['file'] for plan in new_plans]} instead of the edited {latest}")
+    elif(plan_at(plans_dir, "koskelo", datetime.now(timezone.utc))["time"] != new_plans[0]["time"]):
+        failures.append("the edited goto file isn't the plan in force now")
+
+    for filename in sorted(os.listdir(GLIDERS_DIR)) if os.path.isdir(GLIDERS_DIR) else []:
+        archive_dir = os.path.join(GLIDERS_DIR, filename, "archive")
+        for goto in sorted(os.listdir(archive_dir)) if os.path.isdir(archive_dir) else []:
+            if("goto" not in goto):
+                continue
+            with open(os.path.join(archive_dir, goto), "r") as file:
+                contents = file.read()
+            waypoint_lines = contents.split("<start:waypoints>")[1].split("<end:waypoints>")[0]
+            expected = len([line for line in waypoint_lines.splitlines() if line[:1].isdigit()])
+            if("num_legs_to_run(nodim)   -1" in contents or "num_legs_to_run(nodim) -1" in contents):
+                expected += 1
+            if(len(parse_goto(contents)) != expected):
+                failures.append(f"{goto} has {len(parse_goto(contents))} waypoints instead of {expected}")
+    return failures
+
+def expected_sensors_frame(stored, glider_names, sensors, start=None, end=None):
+    '''Glider dataframe of the map built straight from the stored surfacings'''
+    rows = [(glider_name, surfacing) for glider_name in glider_names for surfacing in stored[glider_name]
+            if (start is None or surfacing["datetime"] >= start) and (end is None or surfacing["datetime"] <= end)]
+    gliders_df = pd.DataFrame({"mission_name": [surfacing["mission_name"] for _, surfacing in rows],
+                               "mission_num":  [surfacing["mission_num"] for _, surfacing in rows],
+                               "datetime":     pd.to_datetime([surfacing["datetime"] for _, surfacing in rows], format=DATETIME_FORMAT),
+                               "glider_name":  [str.capitalize(glider_name) for glider_name, _ in rows],
+                               "latitude":     [surfacing["location"]["latitude"] for _, surfacing in rows],
+                               "longitude":    [surfacing["location"]["longitude"] for _, surfacing in rows]})
+    for sensor in sensors:
+        gliders_df[sensor] = np.array([surfacing["sensors"].get(sensor, np.nan) for _, surfacing in rows], dtype=float)
+    return gliders_df
+
+def check_glider_sensors(data_dir):
+    '''load_glider_sensors() gives the map every glider's stored surfacings with the interesting sensors some glider has as
+    columns (missing values NaN), also in a datetime range and after appends, inserts and removals in the position store'''
+    failures = []
+    sensors = ["m_battery", "m_coulomb_amphr_total", "m_digifin_leakdetect_reading", "m_lithium_battery_relative_charge", "m_vacuum"]
+    positions_dir = os.path.join(data_dir, "Map Data", "Gliders", "JSONs", "positions")
+    os.makedirs(os.path.join(data_dir, "Map Scripts"))
+    stored = {f"glider{number}": generate_surfacings(f"glider{number}", START, 300, seed=number) for number in range(3)}
+    for glider_name, surfacings in stored.items():
+        write_positions(positions_dir, glider_name, surfacings)
+
+    def compare(name, start=None, end=None):
+        glider_names, gliders_df, interesting_sensors = load_glider_sensors(sensors, start, end)
+        if(sorted(glider_names) != sorted(stored) or interesting_sensors != sensors[:-1]):
+            failures.append(f"{name}: gliders {glider_names} and sensors {interesting_sensors}")
+            return
+        difference = frame_difference(expected_sensors_frame(stored, glider_names, sensors[:-1], start, end), gliders_df)
+        if(difference is not None):
+            failures.append(f"{name}: glider data differs from the position store:\n{difference}")
+
+    # The glider data is read relative to the Map Scripts folder
+    working_dir = os.getcwd()
+    os.chdir(os.path.join(data_dir, "Map Scripts"))
+    try:
+        compare("first load")
+        compare("later load")
+        compare("datetime range", stored["glider0"][100]["datetime"], stored["glider0"][200]["datetime"])
+
+        new = generate_surfacings("glider0", datetime.strptime(stored["glider0"][-1]["datetime"], DATETIME_FORMAT), 5, seed=10)
+        append_positions(positions_dir, "glider0", new)
+        stored["glider0"] += new
+        compare("after appending")
+
+        older = generate_surfacings("glider1", START - timedelta(days=1), 1, seed=11)
+        append_positions(positions_dir, "glider1", older)
+        stored["glider1"] = older + stored["glider1"]
+        compare("after adding an older surfacing")
+
+        remove_positions_until(positions_dir, "glider2", stored["glider2"][149]["datetime"])
+        stored["glider2"] = stored["glider2"][150:]
+        compare("after removing a mission's start")
+    finally:
+        os.chdir(working_dir)
+    return failures
+
+def check_battery_forecast(data_dir):
+    '''update_forecast() gives the same state with surfacings added in batches as with all at once, and forecast() extrapolates
+    from the latest value with the time weighted gradient of the changes between surfacings with values in the last 12 hours'''
+    failures = []
+    positions_dir = os.path.join(data_dir, "positions")
+    forecasts_dir = os.path.join(data_dir, "forecasts")
+    surfacings = generate_surfacings("glider", START, 600)
+    write_positions(positions_dir, "glider", surfacings[:500])
+    update_forecast(positions_dir, forecasts_dir, "glider")
+    for index in range(500, 600, 7):
+        append_positions(positions_dir, "glider", surfacings[index:index + 7])
+        state = update_forecast(positions_dir, forecasts_dir, "glider")
+
+    full_state = empty_forecast(state["file_id"], FORECAST_SENSORS)
+    add_surfacings(full_state, surfacings)
+    full_state["bytes"] = state["bytes"]
+    if(full_state != state):
+        failures.append("forecast state updated in batches differs from one built from all surfacings")
+
+    for sensor, target in [("m_battery", 10), ("m_coulomb_amphr_total", 160), ("m_lithium_battery_relative_charge", 10)]:
+        values = [(datetime.strptime(surfacing["datetime"], DATETIME_FORMAT).replace(tzinfo=timezone.utc).timestamp(),
+                   surfacing["sensors"].get(sensor)) for surfacing in surfacings]
+        last_seconds, last_value = [value for value in values if value[1] is not None][-1]
+        changes = [(value - previous_value, seconds - previous_seconds)
+                   for (previous_seconds, previous_value), (seconds, value) in zip(values, values[1:])
+                   if previous_value is not None and value is not None and seconds > last_seconds - GRADIENT_HOURS*3600]
+        gradient = sum(change for change, _ in changes)/sum(seconds for _, seconds in changes)
+        last_datetime = datetime.fromtimestamp(last_seconds, timezone.utc).replace(tzinfo=None)
+        target_datetime = last_datetime + timedelta(seconds=math.ceil((target - last_value)/gradient))
+
+        result = forecast(state, sensor, target)
+        if(result is None or result["last_datetime"] != last_datetime or result["last_value"] != last_value or
+           not math.isclose(result["gradient"], gradient, rel_tol=1e-9) or
+           abs((result["target_datetime"] - target_datetime).total_seconds()) > 1):
+            failures.append(f"{sensor} forecast {result} instead of gradient {gradient} reaching {target} at {target_datetime}")
+    return failures
+
+def table_surfacings(db_connection, glider):
+    '''Surfacings of a glider from the glider tables, like in the position store'''
+    surfacings = {}
+    for row in db_connection.execute("SELECT datetime, mission_name, mission_num, latitude, longitude FROM glider_surfacings "
+                                      "WHERE glider_name = ? ORDER BY datetime", (str.capitalize(glider),)):
+        surfacings[row[0]] = {"mission_name": row[1], "mission_num": row[2], "datetime": row[0],
+                              "location": {"latitude": row[3], "longitude": row[4]}, "sensors": {}}
+    for datetime_string, sensor, value in db_connection.execute("SELECT datetime, sensor, value FROM glider_sensors WHERE glider_name = ?",
+                                                                (str.capitalize(glider),)):
+        surfacings[datetime_string]["sensors"][sensor] = value
+    return list(surfacings.values())
+
+def check_glider_database(data_dir):
+    '''The glider tables have the surfacings and sensors of the position store, a sync after an append inserts only the new
+    surfacings, and rewrites of the store (an older surfacing added, mission end cleanup) neither duplicate nor remove rows'''
+    failures = []
+    positions_dir = os.path.join(data_dir, "positions")
+    database = os.path.join(data_dir, "AIS.sqlite")
+    surfacings = generate_surfacings("glider", START, 500)
+    older = generate_surfacings("glider", START - timedelta(days=1), 1, seed=1)
+
+    write_positions(positions_dir, "glider", surfacings[:497])
+    sync_database(database, positions_dir)
+    append_positions(positions_dir, "glider", surfacings[497:])
+    inserted = sync_database(database, positions_dir)
+    if(inserted != {"glider": 3}):
+        failures.append(f"{inserted} inserted instead of the 3 appended surfacings")
+
+    db_connection = sqlite3.connect(database)
+    if(table_surfacings(db_connection, "glider") != read_positions(positions_dir, "glider")):
+        failures.append("glider tables differ from the position store")
+
+    append_positions(positions_dir, "glider", older)
+    sync_database(database, positions_dir)
+    remove_positions_until(positions_dir, "glider", surfacings[249]["datetime"])
+    sync_database(database, positions_dir)
+    if(table_surfacings(db_connection, "glider") != older + surfacings):
+        failures.append("glider tables don't have every surfacing stored after rewrites of the store")
+    db_connection.close()
+    return failures
+
+#############################
+#          Running          #
+#############################
+
+CHECKS = {"eta_decoding":     check_eta_decoding,
+          "response_parsing": check_response_parsing,
+          "threat_writes":    check_threat_writes,
+          "classification":   check_classification,
+          "log_parsing":      check_log_parsing,
+          "position_store":   check_position_store,
+          "log_discovery":    check_log_discovery,
+          "goto_plans":       check_goto_plans,
+          "glider_sensors":   check_glider_sensors,
+          "battery_forecast": check_battery_forecast,
+          "glider_database":  check_glider_database}
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the map scripts and glider data processing on synthetic inputs with known results")
+    parser.add_argument("checks", nargs="*", help=f"Checks to run (all by default): {', '.join(CHECKS)}")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if(unknown):
+        parser.error(f"unknown checks {unknown}")
+
+    ok = True
+    for name in args.checks or list(CHECKS):
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix=f"check_{name}_") as data_dir:
+            try:
+                failures = CHECKS[name](data_dir)
+            except Exception:
+                failures = [traceback.format_exc()]
+        print(f"{name:20} {'ok' if not failures else 'FAIL'} ({time.perf_counter() - start:.1f} s)", flush=True)
+        for failure in failures:
+            print(f"    {failure}")
+        ok &= not failures
+
+    if(not ok):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# python "./AIS Map/Benchmarks/check_processing.py"
+# python "./AIS Map/Benchmarks/check_processing.py" goto_plans glider_sensors
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+from synthetic_ais import generate_locations_payload, generate_meta_payload
+
+# Same paths as meri.digitraffic.fi, point the map scripts here with
+# DIGITRAFFIC_API_HOST=http://localhost:<port>/api/ais/v1/
+API_PATH = "/api/ais/v1/"
+LOCATIONS_FILE = "locations.json"
+VESSELS_FILE   = "vessels.json"
+
+#############################
+#        Recordings         #
+#############################
+
+def record(output_dir, latitude, longitude, distance, since_hrs):
+    '''Save live /locations and /vessels responses for replaying'''
+    os.makedirs(output_dir, exist_ok=True)
+    since = int((time.time() - since_hrs*3600)*1000)
+    headers = {'Digitraffic-User': 'Foo/Bar'}
+
+    host = "https://meri.digitraffic.fi/api/ais/v1/"
+    urls = {LOCATIONS_FILE: f"{host}locations?from={since}&radius={distance}&latitude={latitude}&longitude={longitude}",
+            VESSELS_FILE:   f"{host}vessels?from={since}"}
+
+    for filename, url in urls.items():
+        response = requests.get(url, headers=headers)
+        response.raise_for_status()
+        with open(os.path.join(output_dir, filename), "wb") as file:
+            file.write(response.content)
+        print(f"Saved {url} ({len(response.content)/1024**2:.1f} MB) to {filename}")
+
+def load_recordings(recording_dir, synthetic_ships):
+    '''Recorded /locations and /vessels responses, or synthetic ones if no directory given'''
+    if(recording_dir is None):
+        return json.loads(generate_locations_payload(synthetic_ships)), json.loads(generate_meta_payload(synthetic_ships))
+
+    with open(os.path.join(recording_dir, LOCATIONS_FILE), "r", encoding="utf-8") as file:
+        locations = json.load(file)
+    with open(os.path.join(recording_dir, VESSELS_FILE), "r", encoding="utf-8") as file:
+        vessels = json.load(file)
+    return locations, vessels
+
+def shift_timestamps(locations, vessels, now_ms):
+    '''Move the timestamps so the latest update is now, so old recordings pass the since filters (nulls stay null)'''
+    for items, field in [([feature["properties"] for feature in locations["features"]], "timestampExternal"),
+                         (vessels, "timestamp")]:
+        timestamps = [item[field] for item in items if item[field] is not None]
+        if(len(timestamps) > 0):
+            offset = now_ms - max(timestamps)
+            for item in items:
+                if(item[field] is not None):
+                    item[field] += offset
+
+def scale_up(locations, vessels, scale, seed):
+    '''Synthesize scale times the ships: copies with new mmsis and slightly moved positions'''
+    rng = random.Random(seed)
+    features = locations["features"]
+    original_features = list(features)
+    original_vessels = list(vessels)
+
+    for copy in range(1, scale):
+        # mmsis are 9 digits, so the copies can't collide with real ones
+        mmsi_offset = copy*10**9
+        for feature in original_features:
+            new_feature = json.loads(json.dumps(feature))
+            new_feature["mmsi"] = feature["mmsi"] + mmsi_offset
+            if(feature["properties"]["mmsi"] is not None):
+                new_feature["properties"]["mmsi"] = feature["properties"]["mmsi"] + mmsi_offset
+            coordinates = new_feature["geometry"]["coordinates"]
+            coordinates[0] = round(coordinates[0] + rng.uniform(-0.05, 0.05), 6)
+            coordinates[1] = round(coordinates[1] + rng.uniform(-0.05, 0.05), 6)
+            features.append(new_feature)
+
+        for vessel in original_vessels:
+            vessels.append(dict(vessel, mmsi=vessel["mmsi"] + mmsi_offset if vessel["mmsi"] is not None else None))
+
+#############################
+#          Server           #
+#############################
+
+class ReplayState:
+    '''Responses to replay, injected latency/errors and request counters'''
+
+    def __init__(self, locations, vessels, latency=0, latency_jitter=0, error_rate=0, error_status=503, seed=0):
+        self.locations_payload = json.dumps(locations).encode("utf-8")
+        self.vessels_payload = json.dumps(vessels, ensure_ascii=False).encode("utf-8")
+        self.features_by_mmsi = {feature["properties"]["mmsi"]: feature for feature in locations["features"]}
+        self.vessels_by_mmsi = {vessel["mmsi"]: vessel for vessel in vessels}
+        self.ships = len(locations["features"])
+
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+        # Seeded and locked so the same requests get the same errors and delays on every run
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "bytes": 0}
+
+    def draw(self):
+        '''Decide delay and whether to fail the next request'''
+        with self.lock:
+            self.counts["requests"] += 1
+            delay = self.latency + self.rng.uniform(0, self.latency_jitter)
+            fail = self.rng.random() < self.error_rate
+            if(fail):
+                self.counts["errors"] += 1
+        return delay, fail
+
+    def response(self, path, query):
+        '''Status and body for an API path'''
+        if(path == "locations"):
+            if("mmsi" in query):
+                feature = self.features_by_mmsi.get(int(query["mmsi"][0]))
+                features = [] if feature is None else [feature]
+                return 200, json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+            return 200, self.locations_payload
+
+        if(path == "vessels"):
+            return 200, self.vessels_payload
+
+        if(path.startswith("vessels/")):
+            vessel = self.vessels_by_mmsi.get(int(path[len("vessels/"):]))
+            if(vessel is None):
+                return 404, json.dumps({"message": "Not found"}).encode("utf-8")
+            return 200, json.dumps(vessel, ensure_ascii=False).encode("utf-8")
+
+        return 404, json.dumps({"message": f"Unknown path {path}"}).encode("utf-8")
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    '''Serves the replayed API, state is in server.state'''
+    protocol_version = "HTTP/1.1" # Keep-alive like the real API
+    disable_nagle_algorithm = True # Headers and body are sent separately, avoid waiting for delayed ACKs
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+
+        delay, fail = state.draw()
+        time.sleep(delay)
+
+        if(fail):
+            status, body = state.error_status, json.dumps({"message": "Injected error"}).encode("utf-8")
+        elif(not url.path.startswith(API_PATH)):
+            status, body = 404, json.dumps({"message": "Not found"}).encode("utf-8")
+        else:
+            status, body = state.response(url.path[len(API_PATH):], parse_qs(url.query))
+
+        with state.lock:
+            state.counts["bytes"] += len(body)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if(self.server.verbose):
+            super().log_message(format, *args)
+
+def start_server(state, port=0, verbose=False):
+    '''Start serving in a background thread, returns the server and its API host URL'''
+    server = ThreadingHTTPServer(("127.0.0.1", port), ReplayHandler)
+    server.state = state
+    server.verbose = verbose
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{API_PATH}"
+
+def create_state(args):
+    '''Replay state from the common command line arguments'''
+    locations, vessels = load_recordings(args.recordings, args.synthetic_ships)
+    shift_timestamps(locations, vessels, int(time.time()*1000))
+    scale_up(locations, vessels, args.scale, args.seed)
+    return ReplayState(locations, vessels, args.latency, args.latency_jitter,
+                       args.error_rate, args.error_status, args.seed)
+
+def add_replay_arguments(parser):
+    '''Command line arguments of the replayed responses, shared with benchmark_ingest.py'''
+    parser.add_argument("--recordings", default=None, help=f"Directory with {LOCATIONS_FILE} and {VESSELS_FILE} (default: synthetic)")
+    parser.add_argument("--synthetic-ships", type=int, default=5000, help="Ships in the synthetic responses")
+    parser.add_argument("--scale", type=int, default=1, help="Serve scale times the ships")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds added to every response")
+    parser.add_argument("--latency-jitter", type=float, default=0, help="Up to this many random seconds added on top")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded (or synthetic) Digitraffic AIS responses locally")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Serve until interrupted")
+    add_replay_arguments(serve_parser)
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--verbose", action="store_true", help="Log every request")
+
+    record_parser = subparsers.add_parser("record", help="Save live responses for replaying")
+    record_parser.add_argument("output_dir")
+    record_parser.add_argument("--latitude", type=float, default=60)
+    record_parser.add_argument("--longitude", type=float, default=20)
+    record_parser.add_argument("--distance", type=int, default=700)
+    record_parser.add_argument("--since-hrs", type=float, default=1)
+
+    args = parser.parse_args()
+
+    if(args.command == "record"):
+        record(args.output_dir, args.latitude, args.longitude, args.distance, args.since_hrs)
+        return
+
+    state = create_state(args)
+    server, host = start_server(state, args.port, args.verbose)
+    print(f"Replaying {state.ships} ships at {host}")
+    print(f"    DIGITRAFFIC_API_HOST={host}")
+    try:
+        while(True):
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"Served: {state.counts}")
+
+if __name__ == "__main__":
+    main()
+
+# python "./AIS Map/Benchmarks/digitraffic_replay_server.py" record "./AIS Map/Benchmarks/recordings"
+# python "./AIS Map/Benchmarks/digitraffic_replay_server.py" serve --recordings "./AIS Map/Benchmarks/recordings" --scale 5 --latency 0.2 --error-rate 0.05
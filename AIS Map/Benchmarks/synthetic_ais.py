@@ -0,0 +1,480 @@
+import os
+import sys
+import json
+import random
+import shutil
+import sqlite3
+from math import floor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# The map scripts aren't a package, they're imported from their own directory
+MAP_SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Map Scripts")
+MAP_DATA_DIR    = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Map Data")
+sys.path.insert(0, MAP_SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Glider Data Processing"))
+
+import Digitraffic_To_SQLite_functions
+from Digitraffic_To_SQLite_functions import classify_regions
+from glider_positions import write_positions
+
+# Gliders are placed along the Finnish coast, ships are spread over the whole Baltic
+# with a share of them clustered around the gliders so that every threat class gets used
+GLIDER_LOCATIONS = [[59.74, 23.23], [60.20, 21.00], [61.10, 20.60], [59.60, 25.00], [63.50, 21.50]]
+BALTIC_BOUNDS    = {"latitude": [54.0, 65.5], "longitude": [10.0, 30.0]}
+NEAR_GLIDER_SHARE = 0.2
+
+REGIONS = ["Baltic Sea", "Bothnian Bay", "Bothnian Sea",
+           "Archipelago Sea", "Gulf of Finland", "Saimaa and Laatokka"]
+SHIP_TYPES = [30, 36, 37, 52, 60, 70, 71, 80, 90]
+
+#############################
+#      Ship generation      #
+#############################
+
+def generate_ships(num_ships, num_gliders, rng):
+    '''Generate the static properties and starting state of ships'''
+
+    ships = pd.DataFrame({"mmsi": 230000000 + np.arange(num_ships)})
+
+    ships["latitude"]  = rng.uniform(*BALTIC_BOUNDS["latitude"],  num_ships)
+    ships["longitude"] = rng.uniform(*BALTIC_BOUNDS["longitude"], num_ships)
+
+    # Cluster some ships around the gliders
+    near_glider = rng.random(num_ships) < NEAR_GLIDER_SHARE
+    glider_idx = rng.integers(0, num_gliders, num_ships)
+    glider_locs = np.array(GLIDER_LOCATIONS[:num_gliders])[glider_idx]
+    ships.loc[near_glider, "latitude"]  = glider_locs[near_glider, 0] + rng.normal(0, 0.15, near_glider.sum())
+    ships.loc[near_glider, "longitude"] = glider_locs[near_glider, 1] + rng.normal(0, 0.30, near_glider.sum())
+
+    ships["sog"] = rng.choice([0, 0.1, 5, 10, 12, 15, 20, 102.3], num_ships,
+                              p=[0.25, 0.05, 0.1, 0.2, 0.15, 0.15, 0.05, 0.05])
+    ships["cog"] = rng.uniform(0, 360, num_ships).round(1)
+    ships.loc[rng.random(num_ships) < 0.03, "cog"] = 360
+    ships["rot"] = rng.choice([0, 0, 0, -128, -5, 5, 20], num_ships)
+    ships["heading"] = ships["cog"].round().astype(int) % 360
+    ships["navStat"] = np.where(ships["sog"] == 0, 5, 0)
+
+    return ships
+
+def generate_locations(ships, history_hours, report_interval_min, api_interval_min, now, rng):
+    '''Generate the location history ("locations" table) of the given ships'''
+
+    num_reports = max(1, int(history_hours*60 // report_interval_min))
+    num_ships = len(ships)
+    interval_ms = report_interval_min*60*1000
+
+    # Each ship reports at its own phase within the interval
+    phase = rng.integers(0, interval_ms, num_ships)
+    report = np.arange(num_reports)
+
+    ship_idx = np.repeat(np.arange(num_ships), num_reports)
+    report_idx = np.tile(report, num_ships)
+    steps_back = num_reports - 1 - report_idx
+
+    loc_update = now - steps_back*interval_ms - phase[ship_idx]
+
+    # Move ships backwards along their course from their current location
+    sog = ships["sog"].to_numpy()[ship_idx]
+    speed = np.where(sog > 100, 0, sog)*1.852/3600/1000 # km per ms
+    distance = speed*(now - loc_update)
+    bearing = np.radians(ships["cog"].to_numpy()[ship_idx] % 360)
+    latitude  = ships["latitude"].to_numpy()[ship_idx] - distance*np.cos(bearing)/111.0
+    longitude = (ships["longitude"].to_numpy()[ship_idx] -
+                 distance*np.sin(bearing)/(111.0*np.cos(np.radians(latitude))))
+
+    # Rows are collected by API calls every api_interval_min
+    api_interval_ms = api_interval_min*60*1000
+    loc_api_call = (loc_update//api_interval_ms + 1)*api_interval_ms
+
+    locations_df = pd.DataFrame({"mmsi":      ships["mmsi"].to_numpy()[ship_idx],
+                                 "sog":       ships["sog"].to_numpy()[ship_idx],
+                                 "cog":       ships["cog"].to_numpy()[ship_idx],
+                                 "navStat":   ships["navStat"].to_numpy()[ship_idx],
+                                 "rot":       ships["rot"].to_numpy()[ship_idx],
+                                 "posAcc":    False,
+                                 "heading":   ships["heading"].to_numpy()[ship_idx],
+                                 "longitude": longitude.round(6),
+                                 "latitude":  latitude.round(6),
+                                 "locUpdateTimestamp":  loc_update,
+                                 "locAPICallTimestamp": loc_api_call})
+
+    # Replace default / not available values with NAs like collect_ships_locations
+    locations_df = locations_df.replace({'sog': 102.3,
+                                         'cog': 360,
+                                         'rot': -128,
+                                         'heading': 511}, np.nan)
+
+    locations_df = classify_regions(locations_df, "latitude", "longitude", "shipRegion")
+
+    return locations_df
+
+def generate_meta(ships, now, rng):
+    '''Generate metadata ("meta" table) for every ship'''
+
+    num_ships = len(ships)
+    eta = pd.Timestamp(now, unit="ms") + pd.to_timedelta(rng.integers(1, 14*24, num_ships), unit="h")
+
+    meta_df = pd.DataFrame({"name":                [f"SYNTHETIC {mmsi}" for mmsi in ships["mmsi"]],
+                            "metaUpdateTimestamp": now - rng.integers(0, 30*24*3600*1000, num_ships),
+                            "mmsi":                ships["mmsi"].to_numpy(),
+                            "callSign":            [f"OH{i:04d}" for i in range(num_ships)],
+                            "shipType":            rng.choice(SHIP_TYPES, num_ships),
+                            "draught":             rng.choice([np.nan, 40, 55, 80, 120], num_ships),
+                            "eta":                 eta.floor("min"),
+                            "destination":         rng.choice(["FI HEL", "SE STO", "EE TLL", "FI TKU", ""], num_ships),
+                            "metaAPICallTimestamp": now})
+
+    meta_df["destinationOne"]   = meta_df["destination"].str.replace(" ", "").replace("", pd.NA)
+    meta_df["destinationTwo"]   = pd.NA
+    meta_df["destinationThree"] = pd.NA
+
+    meta_df["destinationOneRegion"]   = rng.choice(REGIONS + [None], num_ships)
+    meta_df["destinationTwoRegion"]   = rng.choice(REGIONS + [None]*6, num_ships)
+    meta_df["destinationThreeRegion"] = None
+
+    return meta_df
+
+def generate_threats(locations_df, meta_df, num_threats, rng):
+    '''Generate old rows of ships classified as threats ("threats" table)'''
+    # Uses the same columns save_dangerous_ship_data would write
+
+    num_threats = min(num_threats, len(locations_df))
+    if(num_threats == 0):
+        return None
+
+    sample = locations_df.iloc[np.sort(rng.choice(len(locations_df), num_threats, replace=False))]
+    threats_df = sample.merge(meta_df, on="mmsi", how="left")
+
+    threats_df["metaUpdatetime"] = pd.to_datetime(threats_df.pop("metaUpdateTimestamp"), unit="ms")
+    threats_df["locUpdatetime"]  = pd.to_datetime(threats_df.pop("locUpdateTimestamp"),  unit="ms")
+    threats_df["shipTypeString"] = "Cargo"
+    threats_df["distance_from_glider"] = rng.uniform(0, 50, num_threats)
+    threats_df["class_colour"] = rng.choice(["orange", "red", "purple"], num_threats)
+    threats_df["glider_name"] = "Glider1"
+    threats_df["glider_latest_lat"] = GLIDER_LOCATIONS[0][0]
+    threats_df["glider_latest_lon"] = GLIDER_LOCATIONS[0][1]
+
+    return threats_df
+
+def generate_classification_inputs(num_ships, num_gliders, rng):
+    '''Arguments of classify_ships(): ships with ranges (some without) and destination regions (some missing), VIP ships,
+    and the latest locations, regions and waypoint lines (LonLat) of gliders, some with a single waypoint'''
+    import geopandas as gpd
+    from shapely.geometry import LineString, Point
+
+    region_type = pd.CategoricalDtype(REGIONS)
+    ships_df = pd.DataFrame({"mmsi":      230000000 + np.arange(num_ships),
+                             "latitude":  rng.uniform(57, 66, num_ships),
+                             "longitude": rng.uniform(17, 30, num_ships),
+                             "sog":       rng.choice([0, 0.1, 5.5, 12.3, np.nan], num_ships),
+                             "range":     rng.choice([0, 2000, 10000, 40000, np.nan], num_ships)})
+    for column in ["shipRegion", "destinationOneRegion", "destinationTwoRegion", "destinationThreeRegion"]:
+        regions = REGIONS if column == "shipRegion" else REGIONS + [None]
+        ships_df[column] = pd.Series(rng.choice(regions, num_ships), dtype=region_type)
+
+    # Like process_changed_ship_data()
+    ship_ranges = gpd.GeoDataFrame(ships_df, geometry=gpd.points_from_xy(ships_df.longitude, ships_df.latitude), crs="EPSG:4326")
+    ship_ranges = ship_ranges.to_crs("EPSG:32634").buffer(ships_df["range"]).to_crs("EPSG:4326")
+    vip_ships = list(ships_df["mmsi"].sample(5, random_state=0))
+
+    latest_locs, regions_list, wpt_lines = [], [], []
+    for glider_number in range(num_gliders):
+        latest_loc = [rng.uniform(58, 65), rng.uniform(19, 28)]
+        latest_locs.append(latest_loc)
+        regions_list.append(list(rng.choice(REGIONS, rng.integers(1, 3), replace=False)))
+        num_wpts = 1 if glider_number % 4 == 3 else 4
+        wpts = [[latest_loc[1] + rng.uniform(-0.5, 0.5), latest_loc[0] + rng.uniform(-0.3, 0.3)] for _ in range(num_wpts)]
+        wpt_lines.append(LineString(wpts) if num_wpts > 1 else Point(wpts))
+
+    return ships_df, ship_ranges, vip_ships, latest_locs, regions_list, wpt_lines
+
+def write_database(database, locations_df, meta_df, threats_df):
+    '''Write the synthetic tables into a new SQLite database'''
+
+    if(os.path.exists(database)):
+        os.remove(database)
+
+    db_connection = sqlite3.connect(database)
+    locations_df.to_sql("locations", db_connection, index=False, chunksize=100000)
+    meta_df.to_sql("meta", db_connection, index=False)
+    if(threats_df is not None):
+        threats_df.to_sql("threats", db_connection, index=False)
+    db_connection.close()
+
+#############################
+#     Glider generation     #
+#############################
+
+def generate_glider_jsons(json_dir, num_gliders, mission_hours, now, rng):
+    '''Generate the position store, deployment and last position and waypoint JSONs for gliders'''
+
+    current_positions = {}
+    waypoints = {}
+
+    surfacing_interval = timedelta(hours=1)
+    num_surfacings = max(2, int(timedelta(hours=mission_hours)/surfacing_interval))
+    now_dt = datetime.fromtimestamp(now/1000)
+
+    for i in range(num_gliders):
+        glider_name = f"glider{i+1}"
+        latitude, longitude = GLIDER_LOCATIONS[i % len(GLIDER_LOCATIONS)]
+
+        surfacings = []
+        for j in range(num_surfacings):
+            surfacing_time = now_dt - (num_surfacings - 1 - j)*surfacing_interval
+            progress = j/num_surfacings
+            surfacings.append({
+                "mission_name": "synthetic",
+                "mission_num": f"{glider_name}-{j}",
+                "datetime": surfacing_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "location": {"latitude":  round(latitude  + 0.05*progress + rng.normal(0, 0.002), 5),
+                             "longitude": round(longitude + 0.05*progress + rng.normal(0, 0.002), 5)},
+                "sensors": {"m_battery": 16.4 - 2*progress + rng.normal(0, 0.01),
+                            "m_coulomb_amphr_total": 0.2 + 40*progress,
+                            "m_digifin_leakdetect_reading": float(rng.integers(980, 1023)),
+                            "m_lithium_battery_relative_charge": 100 - 30*progress,
+                            "m_vacuum": 7.2 + rng.normal(0, 0.1)}})
+
+        current_positions[glider_name] = surfacings
+        waypoints[glider_name] = [[round(longitude + 0.1, 5), round(latitude - 0.05, 5)],
+                                  [round(longitude - 0.1, 5), round(latitude + 0.05, 5)],
+                                  [round(longitude + 0.1, 5), round(latitude - 0.05, 5)]]
+
+    deployment_positions = {glider: surfacings[0]  for glider, surfacings in current_positions.items()}
+    last_positions       = {glider: surfacings[-1] for glider, surfacings in current_positions.items()}
+
+    os.makedirs(json_dir, exist_ok=True)
+    for glider_name, surfacings in current_positions.items():
+        write_positions(os.path.join(json_dir, "positions"), glider_name, surfacings)
+
+    for filename, data in [("deployment_positions.json", deployment_positions),
+                           ("last_positions.json",       last_positions),
+                           ("glider_waypoints.json",     waypoints)]:
+        with open(os.path.join(json_dir, filename), "w") as file:
+            json.dump(data, file)
+
+#############################
+#     Response payloads     #
+#############################
+
+def generate_locations_payload(ships, seed=0):
+    '''/locations response with given number of ships, incl. not available and null values'''
+    rng = random.Random(seed)
+    features = []
+    for index in range(ships):
+        features.append({"mmsi": 230000000 + index,
+                         "type": "Feature",
+                         "geometry": {"type": "Point",
+                                      "coordinates": [round(rng.uniform(17, 30), 6), round(rng.uniform(57, 66), 6)]},
+                         "properties": {"mmsi": 230000000 + index,
+                                        "sog": rng.choice([round(rng.uniform(0, 25), 1), 102.3]),
+                                        "cog": rng.choice([round(rng.uniform(0, 359.9), 1), 360.0]),
+                                        "navStat": rng.randint(0, 15),
+                                        "rot": rng.choice([rng.randint(-127, 127), -128]),
+                                        "posAcc": rng.random() < 0.5,
+                                        "raim": False,
+                                        "heading": rng.choice([rng.randint(0, 359), 511]),
+                                        "timestamp": rng.randint(0, 59),
+                                        "timestampExternal": 1692345778776 + index}})
+    # Now and then a null in an integer field
+    for index in range(0, ships, 97):
+        features[index]["properties"][rng.choice(["mmsi", "navStat", "posAcc", "timestampExternal"])] = None
+    return json.dumps({"type": "FeatureCollection",
+                       "dataUpdatedTime": "2023-08-18T08:02:58Z",
+                       "features": features}).encode("utf-8")
+
+def generate_meta_payload(ships, seed=0):
+    '''/vessels response with given number of ships, incl. non-ASCII names and null values'''
+    rng = random.Random(seed)
+    now_ms = int(datetime.now().timestamp()*1000)
+    ships_meta = []
+    for index in range(ships):
+        ships_meta.append({"name": rng.choice(["JOHANNA HELENA", "VÄINÖ", "ÅLAND ÖSTRA", ""]) + f" {index}",
+                           "timestamp": now_ms - rng.randint(0, 60*24*3600*1000),
+                           "mmsi": 230000000 + index,
+                           "callSign": "5BMF5",
+                           "imo": 9372212,
+                           "shipType": rng.choice([0, 30, 52, 70, 80]),
+                           "draught": rng.choice([0, 55, 120]),
+                           "eta": rng.randint(0, 2**20 - 1),
+                           "posType": 1,
+                           "referencePointA": 96,
+                           "referencePointB": 19,
+                           "referencePointC": 8,
+                           "referencePointD": 8,
+                           "destination": rng.choice(["SE OXE", "FIHEL", "TALLINN", "Å"])})
+    for index in range(0, ships, 97):
+        ships_meta[index][rng.choice(["mmsi", "timestamp", "shipType", "eta"])] = None
+    return json.dumps(ships_meta, ensure_ascii=False).encode("utf-8")
+
+class FakeResponse:
+    '''Stands in for requests.Response, the payload is streamed in chunks of chunk_size'''
+
+    def __init__(self, payload, chunk_size):
+        self.content = payload
+        self.chunk_size = chunk_size
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=None):
+        for start in range(0, len(self.content), self.chunk_size):
+            yield self.content[start:start + self.chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class FakeSession:
+    '''Stands in for the requests session, every get returns the payload'''
+
+    def __init__(self, payload, chunk_size):
+        self.payload = payload
+        self.chunk_size = chunk_size
+
+    def get(self, url, stream=False):
+        return FakeResponse(self.payload, self.chunk_size)
+
+def streamed(collect, payload, chunk_size=2**16):
+    '''Run a collect function (e.g. collect_ships_meta) with the API returning the payload in chunks'''
+    original_get_session = Digitraffic_To_SQLite_functions.get_session
+    Digitraffic_To_SQLite_functions.get_session = lambda: FakeSession(payload, chunk_size)
+    try:
+        return collect()
+    finally:
+        Digitraffic_To_SQLite_functions.get_session = original_get_session
+
+#############################
+#       Glider files        #
+#############################
+
+# Sensors of a surfacing in a real network log, the ones drawn on the map and forecast are the last ones
+FILLER_SENSORS = [f"sensor_{number}" for number in range(23)]
+
+def generate_surfacings(glider, start, count, seed=0):
+    '''Surfacings every 2-40 minutes after start with 27 sensors like a real network log: a slowly draining, noisy battery
+    without a value in a tenth of the surfacings, the leak detector missing in every 7th and no sensors in the latest one'''
+    generator = random.Random(seed)
+    surfacings = []
+    time_now = start
+    latitude, longitude = 59.8, 23.2
+    battery, coulomb, charge = 15.5, 0.2, 100.0
+    for index in range(count):
+        time_now += timedelta(seconds=generator.randint(120, 2400))
+        latitude += generator.uniform(-1e-3, 1e-3)
+        longitude += generator.uniform(-1e-3, 1e-3)
+        battery -= generator.uniform(0, 2e-4)
+        coulomb += generator.uniform(0, 2e-2)
+        charge -= generator.uniform(0, 1e-3)
+
+        sensors = {sensor: 1000.0 + index + number for number, sensor in enumerate(FILLER_SENSORS)}
+        if(generator.random() > 0.1):
+            sensors["m_battery"] = battery + generator.gauss(0, 1e-4)
+        sensors["m_coulomb_amphr_total"] = coulomb
+        if(index % 7 != 0):
+            sensors["m_digifin_leakdetect_reading"] = 1023.0
+        sensors["m_lithium_battery_relative_charge"] = charge
+        if(index == count - 1):
+            sensors = {}
+
+        surfacings.append({"mission_name": "tvr20233",
+                           "mission_num": f"{glider}-2023-312-3-1",
+                           "datetime": time_now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                           "location": {"latitude": round(latitude, 5), "longitude": round(longitude, 5)},
+                           "sensors": sensors})
+    return surfacings
+
+def ddmm_mmm(degrees):
+    '''Decimal degrees as the DDmm.mmm of network logs and goto files'''
+    minutes = round((degrees - int(degrees))*60, 3)
+    return f"{int(degrees)*100 + minutes:.3f}"
+
+def write_network_log(filename, glider, surfacings, cut_locations=()):
+    '''Network log of the surfacings like the glider's (<glider>_<yyyymmddThhmmss>_network_net_0.log),
+    the DR location line of the surfacings at the indexes in cut_locations is cut by other output'''
+    lines = ["Connection Event: Carrier Detect found.  7946    Iridium console active and ready...\n",
+             f"Vehicle Name: {glider}\n"]
+    for index, surfacing in enumerate(surfacings):
+        time_now = datetime.strptime(surfacing["datetime"], "%Y-%m-%dT%H:%M:%SZ")
+        latitude, longitude = ddmm_mmm(surfacing["location"]["latitude"]), ddmm_mmm(surfacing["location"]["longitude"])
+        lines.append(f"Curr Time: {time_now:%a %b} {time_now.day:2d} {time_now:%H:%M:%S %Y} MT:    {7946 + index}\n")
+        if(index in cut_locations):
+            lines.append(f"DR  Location:  {latitude} N  2<dockserver command=\"dockzr -archive *\">\n")
+        else:
+            lines.append(f"DR  Location:  {latitude} N  {longitude} E measured    206.721 secs ago\n")
+        lines.append(f"GPS Location:  {latitude} N  {longitude} E measured    208.895 secs ago\n")
+        for sensor, value in surfacing["sensors"].items():
+            lines.append(f"   sensor:{sensor}(nodim)={value!r}        19.736 secs ago\n")
+        if(index == 0):
+            lines.append(f"MissionName:{surfacing['mission_name']}.mi MissionNum:{surfacing['mission_num']} (0169.0001)\n")
+    with open(filename, "w") as file:
+        file.writelines(lines)
+
+def write_goto_file(filename, waypoints, loop=True):
+    '''Goto file with waypoints ([[longitude, latitude], ...] in decimal degrees), looped or traversed once'''
+    lines = ["behavior_name=goto_list\n",
+             "# 2023-11-09 09:15  TVAR20233, synthetic\n",
+             "<start:b_arg>\n",
+             "b_arg: start_when(enum) 0 # 0-immediately, 1-stack idle 2-heading idle\n",
+             "b_arg: list_stop_when(enum) 7 # BAW_WHEN_WPT_DIST:007\n",
+             "b_arg: initial_wpt(enum)        -2   #! min = -2; max = 7\n",
+             f"b_arg: num_legs_to_run(nodim)   {-1 if loop else -2}   #  1-N    exactly this many waypoints\n",
+             "                                     # -1      loop forever\n",
+             f"b_arg: num_waypoints(nodim) {len(waypoints)}\n",
+             "<end:b_arg>\n",
+             "<start:waypoints>\n",
+             "#WPT FORMAT: (DDmm.mmm)\n",
+             "# longitude latitude # koodi nimi\n"]
+    for number, (longitude, latitude) in enumerate(waypoints):
+        lines.append(f"{ddmm_mmm(longitude)}  {ddmm_mmm(latitude)}  # wpt_{number}\n")
+    lines.append("<end:waypoints>\n")
+    with open(filename, "w") as file:
+        file.writelines(lines)
+
+#############################
+#     Benchmark directory   #
+#############################
+
+def build_benchmark_tree(root, num_ships, num_gliders, history_hours,
+                         report_interval_min=10, api_interval_min=30, threat_rows=None, seed=0):
+    '''Create a directory laid out like "AIS Map" with synthetic data in it
+
+       The map scripts use paths relative to "Map Scripts", so benchmarks should be run with
+       root/Map Scripts as the working directory. Returns the path to the database.'''
+
+    rng = np.random.default_rng(seed)
+    now = floor(datetime.now().timestamp()*1000)
+
+    scripts_dir = os.path.join(root, "Map Scripts")
+    data_dir    = os.path.join(root, "Map Data")
+    os.makedirs(scripts_dir, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+
+    # Aranda's plan is drawn on every map with gliders, use the real one
+    shutil.copy(os.path.join(MAP_DATA_DIR, "waterexchange.csv"), data_dir)
+
+    ships = generate_ships(num_ships, num_gliders, rng)
+    locations_df = generate_locations(ships, history_hours, report_interval_min, api_interval_min, now, rng)
+    meta_df = generate_meta(ships, now, rng)
+
+    if(threat_rows is None):
+        threat_rows = len(locations_df)//50
+    threats_df = generate_threats(locations_df, meta_df, threat_rows, rng)
+
+    database = os.path.join(data_dir, "AIS.sqlite")
+    write_database(database, locations_df, meta_df, threats_df)
+
+    generate_glider_jsons(os.path.join(data_dir, "Gliders", "JSONs"), num_gliders,
+                          max(history_hours, 24), now, rng)
+
+    return database
+
+if __name__ == "__main__":
+    # python synthetic_ais.py output_dir num_ships num_gliders history_hours
+    database = build_benchmark_tree(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]))
+    print(database)
@@ -1,6 +1,12 @@
 */5 * * * * sh "./AIS Map/Crontab/update_jsons.sh" > "./AIS Map/Crontab/Logs/update_jsons.log" 2>&1
+# Alternatively update the glider JSONs as soon as new logs arrive (see ../Glider Data Processing/readme.txt)
+# @reboot python "./AIS Map/Glider Data Processing/watch_gliders.py" "./AIS Map/Map Data/Gliders" 20231108 --database="./AIS Map/Map Data/AIS.sqlite" >> "./AIS Map/Crontab/Logs/watch_gliders.log" 2>&1
 
 # AIS map and data updating
 55 */6 * * * python "../AIS Map/Map Scripts/update_meta.py" "../AIS Map/Map Data/AIS.sqlite"  >> "./AIS Map/Crontab/Logs/crontab_logs_AIS_maps.log" 2>&1
+2-59/5 * * * * python "../AIS Map/Map Scripts/backfill_meta.py" "../AIS Map/Map Data/AIS.sqlite" 100  >> "./AIS Map/Crontab/Logs/crontab_logs_AIS_maps.log" 2>&1
 0,30 * * * * python "../AIS Map/Map Scripts/update_locations.py" 1 "../AIS Map/Map Data/AIS.sqlite" "../AIS Map/Map Data" AIS_map.html  >> "./AIS Map/Crontab/Logs/crontab_logs_AIS_maps.log" 2>&1
 10,20,40,50 * * * * python "../AIS Map/Map Scripts/update_threats.py" 1 "../AIS Map/Map Data/AIS.sqlite" 15 "../AIS Map/Map Data" AIS_map.html  >> "./AIS Map/Crontab/Logs/crontab_logs_AIS_maps.log" 2>&1
+
+# Alternatively run everything above in one resident process (see ../Service/readme.txt)
+# @reboot python "../AIS Map/Service/ais_service.py" "../AIS Map/Service/service_config.json" >> "./AIS Map/Crontab/Logs/ais_service.log" 2>&1
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+from glider_positions import read_appended_positions, read_index
+
+# Glider surfacings in the AIS database, so the map and analyses can join them with the locations and threats tables:
+#   glider_surfacings    (glider_name, datetime, timestamp, mission_name, mission_num, latitude, longitude)
+#   glider_sensors       (glider_name, datetime, sensor, value), one row per sensor of a surfacing
+#   glider_store_sync    (glider_name, file_id, bytes), how far into the glider's position store file the tables are
+# glider_name is capitalized like in the threats table, datetime is "2023-11-13T09:34:18Z" like in the position store
+# and timestamp is milliseconds like locUpdateTimestamp and locAPICallTimestamp.
+# Rows are only added: surfacings removed from the store (e.g. mission end cleanup) stay for analysis.
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Waiting for other writers of the AIS database (update_locations.py etc.)
+TIMEOUT_SECONDS = 60
+
+
+def create_glider_tables(db_connection):
+    '''Create the glider tables and their (glider_name, datetime) indexes if they don't exist'''
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("CREATE TABLE IF NOT EXISTS glider_surfacings "
+                       "(glider_name TEXT, datetime TEXT, timestamp INTEGER, mission_name TEXT, mission_num TEXT, "
+                       "latitude REAL, longitude REAL, PRIMARY KEY (glider_name, datetime)) WITHOUT ROWID")
+    sql_cursor.execute("CREATE INDEX IF NOT EXISTS glider_surfacings_glider_timestamp ON glider_surfacings (glider_name, timestamp)")
+    sql_cursor.execute("CREATE TABLE IF NOT EXISTS glider_sensors "
+                       "(glider_name TEXT, datetime TEXT, sensor TEXT, value REAL, "
+                       "PRIMARY KEY (glider_name, datetime, sensor)) WITHOUT ROWID")
+    sql_cursor.execute("CREATE TABLE IF NOT EXISTS glider_store_sync "
+                       "(glider_name TEXT PRIMARY KEY, file_id TEXT, bytes INTEGER)")
+    db_connection.commit()
+
+
+def datetime_timestamp(datetime_string):
+    return int(datetime.strptime(datetime_string, DATETIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()*1000)
+
+
+def insert_surfacings(db_connection, glider, surfacings):
+    '''Insert surfacings of a glider, ones already in the tables are skipped. Doesn't commit, returns the number inserted'''
+    glider_name = str.capitalize(glider)
+    sql_cursor = db_connection.cursor()
+    sql_cursor.executemany("INSERT OR IGNORE INTO glider_surfacings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(glider_name, surfacing['datetime'], datetime_timestamp(surfacing['datetime']),
+                             surfacing['mission_name'], surfacing['mission_num'],
+                             surfacing['location']['latitude'], surfacing['location']['longitude'])
+                            for surfacing in surfacings])
+    inserted = sql_cursor.rowcount
+    sql_cursor.executemany("INSERT OR IGNORE INTO glider_sensors VALUES (?, ?, ?, ?)",
+                           [(glider_name, surfacing['datetime'], sensor, value)
+                            for surfacing in surfacings for sensor, value in surfacing['sensors'].items()])
+    return inserted
+
+
+def sync_glider_tables(db_connection, positions_dir, glider):
+    '''Insert a glider's surfacings stored since the last sync into the glider tables, returns the number inserted
+
+    A rewritten store file (older surfacing added, mission end cleanup) is read from the start.
+    The inserts and the new sync position are committed together.'''
+    create_glider_tables(db_connection)
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("SELECT file_id, bytes FROM glider_store_sync WHERE glider_name = ?", (str.capitalize(glider),))
+    file_id, offset = sql_cursor.fetchone() or (None, 0)
+
+    surfacings, entry = read_appended_positions(positions_dir, glider, file_id, offset)
+    if(entry is None):
+        return 0
+    while(surfacings is None):
+        surfacings, entry = read_appended_positions(positions_dir, glider, entry.get('file_id'), 0)
+
+    if(len(surfacings) == 0 and entry.get('file_id') == file_id and entry['bytes'] == offset):
+        return 0
+
+    try:
+        inserted = insert_surfacings(db_connection, glider, surfacings)
+        sql_cursor.execute("INSERT OR REPLACE INTO glider_store_sync VALUES (?, ?, ?)",
+                           (str.capitalize(glider), entry.get('file_id'), entry['bytes']))
+        db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+
+    return inserted
+
+
+def sync_database(database, positions_dir, gliders=None):
+    '''Sync the glider tables of a database with the position store (all gliders in it or the given ones),
+    returns {glider: surfacings inserted}'''
+    if(gliders is None):
+        gliders = list(read_index(positions_dir).keys())
+
+    db_connection = sqlite3.connect(database, timeout=TIMEOUT_SECONDS)
+    try:
+        return {glider: sync_glider_tables(db_connection, positions_dir, glider) for glider in gliders}
+    finally:
+        db_connection.close()
+
+
+def main():
+    '''Fill the glider tables of the AIS database from the position store, e.g. for surfacings stored before the tables'''
+
+    positions_dir = sys.argv[1]
+    database = sys.argv[2]
+    gliders = sys.argv[3:] if len(sys.argv) > 3 else None
+    for glider, inserted in sync_database(database, positions_dir, gliders).items():
+        print(glider, inserted, 'surfacings inserted')
+
+if __name__ == "__main__":
+    main()
+
+    # python "./AIS Map/Glider Data Processing/glider_database.py" "./AIS Map/Map Data/Gliders/JSONs/positions" "./AIS Map/Map Data/AIS.sqlite"
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from glider_positions import read_appended_positions
+from shared_files import read_json_file, write_json_file
+
+# Battery and coulomb forecasts of each glider, kept up to date from the position store:
+#   <forecasts_dir>/<glider>.json    {"file_id": <store file id>, "bytes": <read up to>,
+#                                     "variables": {"<sensor>": {"previous": [<seconds>, <value or None>],
+#                                                                "last": [<seconds>, <value>],
+#                                                                "window": [[<seconds>, <change>, <seconds since previous>], ...]}}}
+# "window" has the changes between consecutive surfacings (both with a value) during GRADIENT_HOURS before the latest
+# value. The gradient is their time weighted average, sum(changes)/sum(seconds), so appended surfacings only add to
+# the window and drop old changes from it. A rewritten store file (e.g. mission end cleanup) is read from the start.
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+GRADIENT_HOURS = 12
+FORECAST_SENSORS = ['m_battery', 'm_lithium_battery_relative_charge', 'm_coulomb_amphr_total']
+
+
+def forecast_file(forecasts_dir, glider):
+    return '{}/{}.json'.format(forecasts_dir, glider)
+
+
+def datetime_seconds(datetime_string):
+    return int(datetime.strptime(datetime_string, DATETIME_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+
+
+def empty_forecast(file_id, sensors):
+    return {'file_id': file_id,
+            'bytes': 0,
+            'variables': {sensor: {'previous': None, 'last': None, 'window': []} for sensor in sensors}}
+
+
+def add_surfacings(state, surfacings):
+    '''Add surfacings (sorted by datetime, after the ones already added) to the forecast state'''
+    for surfacing in surfacings:
+        seconds = datetime_seconds(surfacing['datetime'])
+        for sensor, variable in state['variables'].items():
+            value = surfacing['sensors'].get(sensor)
+            previous = variable['previous']
+            variable['previous'] = [seconds, value]
+            if(value is None):
+                continue
+            if(previous is not None and previous[1] is not None):
+                variable['window'].append([seconds, value - previous[1], seconds - previous[0]])
+            variable['last'] = [seconds, value]
+
+    for variable in state['variables'].values():
+        if(variable['last'] is not None):
+            window_start = variable['last'][0] - GRADIENT_HOURS*3600
+            variable['window'] = [change for change in variable['window'] if change[0] > window_start]
+
+
+def update_forecast(positions_dir, forecasts_dir, glider, sensors=FORECAST_SENSORS):
+    '''Add surfacings stored since the last update to the glider's forecast state, returns the state
+
+    The state is saved only if it changed.'''
+    filename = forecast_file(forecasts_dir, glider)
+    state = read_json_file(filename)
+    if(state is None or not set(sensors).issubset(state['variables'])):
+        state = empty_forecast(None, sensors)
+
+    surfacings, entry = read_appended_positions(positions_dir, glider, state['file_id'], state['bytes'])
+    if(entry is None):
+        return empty_forecast(None, sensors)
+    while(surfacings is None):
+        # Rewritten file, read from the start
+        state = empty_forecast(entry.get('file_id'), sensors)
+        surfacings, entry = read_appended_positions(positions_dir, glider, state['file_id'], 0)
+
+    if(len(surfacings) > 0):
+        add_surfacings(state, surfacings)
+        state['bytes'] = entry['bytes']
+        try:
+            os.makedirs(forecasts_dir, exist_ok=True)
+            write_json_file(filename, state)
+        except OSError as e:
+            # Forecast is still returned, e.g. from a read-only copy of the store
+            print(glider, 'forecast not saved', e)
+
+    return state
+
+
+def forecast(state, sensor, target):
+    '''Linear forecast of a sensor reaching target from the latest value, None if it isn't heading towards the target
+
+    Returns {"last_datetime", "last_value", "gradient" (per second), "target_datetime", "target_value"},
+    the datetimes are UTC datetimes without a timezone like the map's glider data.'''
+    variable = state['variables'].get(sensor)
+    if(variable is None or variable['last'] is None):
+        return None
+
+    change = sum(change[1] for change in variable['window'])
+    seconds = sum(change[2] for change in variable['window'])
+    if(seconds == 0):
+        return None
+    gradient = change/seconds
+
+    last_seconds, last_value = variable['last']
+    if(gradient*(target - last_value) <= 0): # Gradient == 0 or different sign from expected gradient
+        return None
+
+    seconds_to_target = math.ceil((target - last_value)/gradient)
+    last_datetime = datetime.fromtimestamp(last_seconds, timezone.utc).replace(tzinfo=None)
+
+    return {'last_datetime': last_datetime,
+            'last_value': last_value,
+            'gradient': gradient,
+            'target_datetime': last_datetime + timedelta(seconds=seconds_to_target),
+            'target_value': last_value + seconds_to_target*gradient}
+
+
+def main():
+    '''Update and print the forecasts of a glider's sensors reaching the given targets'''
+
+    positions_dir = sys.argv[1]
+    forecasts_dir = sys.argv[2]
+    glider = sys.argv[3]
+    targets = {sensor: float(target) for sensor, target in zip(sys.argv[4::2], sys.argv[5::2])}
+
+    state = update_forecast(positions_dir, forecasts_dir, glider, sorted(set(FORECAST_SENSORS) | set(targets)))
+    for sensor, target in targets.items():
+        print(sensor, target, forecast(state, sensor, target))
+
+if __name__ == "__main__":
+    main()
+
+    # python "./AIS Map/Glider Data Processing/glider_forecast.py" "./AIS Map/Map Data/Gliders/JSONs/positions" "./AIS Map/Map Data/Gliders/JSONs/forecasts" koskelo m_lithium_battery_relative_charge 10 m_coulomb_amphr_total 160
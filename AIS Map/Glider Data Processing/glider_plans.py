@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import bisect
+import hashlib
+import os
+import re
+import sys
+from datetime import datetime, timezone
+
+from shared_files import locked, read_json_file, write_json_file
+
+# Every version of a glider's goto files (waypoint plans), one JSON file per glider:
+#   <plans_dir>/<glider>.json    {"files": {"<goto file>": {"size": bytes, "mtime": seconds, "sha256": hash}},
+#                                 "plans": [{"file": "<goto file>", "sha256": hash, "time": <datetime>, "waypoints": [[lon, lat], ...]}]}
+# Plans are sorted by time, a plan is in force from its time until the next one's. The first version of a goto file
+# is timed by its name (e.g. 20231113T093418_goto_l10.ma), later versions (edited file, same name) by their modification time.
+# Files are hashed only if their size or modification time changed, and parsed only if the hash changed.
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Waypoint lines (longitude latitude in DDmm.mmm) and the looping of goto files
+WAYPOINT_PATTERN = re.compile(r"^(\d[\d\.]*)[ \t]+(\d[\d\.]*)", re.MULTILINE)
+LEGS_TO_RUN_PATTERN = re.compile(r"num_legs_to_run\(nodim\)\s*([-\d]+)")
+
+
+def convert_coordinates_ddmm_to_dddd(coord):
+    '''Convert coordinates from degrees+minutes to degrees+decimals'''
+
+    degs = coord//100
+    mins = coord % 100
+
+    return round(degs + mins/60, 5)
+
+
+def parse_goto(goto):
+    '''Waypoints ([[longitude, latitude], ...] in decimal degrees) of a goto file's contents,
+    the first waypoint is repeated at the end if the glider loops them'''
+    glider_waypoints = [[convert_coordinates_ddmm_to_dddd(float(longitude)), convert_coordinates_ddmm_to_dddd(float(latitude))]
+                        for longitude, latitude in WAYPOINT_PATTERN.findall(goto)]
+
+    # Check if waypoints loop, append first element to the end if they do
+    if(LEGS_TO_RUN_PATTERN.search(goto).group(1) == "-1"):
+        glider_waypoints.append(glider_waypoints[0])
+
+    return glider_waypoints
+
+
+def plans_file(plans_dir, glider):
+    return '{}/{}.json'.format(plans_dir, glider)
+
+
+def read_plans(plans_dir, glider):
+    '''Read the plans and hashed goto files of a glider, empty if there are none yet'''
+    return read_json_file(plans_file(plans_dir, glider), {'files': {}, 'plans': []})
+
+
+def name_time(filename):
+    '''Datetime in a goto file's name (e.g. 20231113T093418_goto_l10.ma), None if it has none'''
+    try:
+        return datetime.strptime(filename.split('_')[0], '%Y%m%dT%H%M%S').strftime(DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def find_new_plans(goto_dir, plans):
+    '''Read goto files that are new or changed since plans (from read_plans()) was saved, returns (new plans, updated files)
+
+    Nothing is written, so gliders can be read in parallel. Save them with save_plans().'''
+    files = dict(plans['files'])
+    new_plans = []
+
+    with os.scandir(goto_dir) as entries:
+        for entry in entries:
+            if('goto' not in entry.name or not entry.is_file()):
+                continue
+            stat = entry.stat()
+            previous = files.get(entry.name)
+            if(previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime):
+                continue
+
+            with open(entry.path, 'rb') as file:
+                contents = file.read()
+            sha256 = hashlib.sha256(contents).hexdigest()
+            files[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+            # Same contents (e.g. only touched), an edit back to an older version is a new plan
+            if(previous is not None and previous['sha256'] == sha256):
+                continue
+
+            try:
+                waypoints = parse_goto(contents.decode('utf-8', errors='replace'))
+            except Exception as e:
+                # Read again when the file changes
+                print(entry.name, 'goto parse error', e)
+                continue
+
+            first_version = previous is None and all(plan['file'] != entry.name for plan in plans['plans'])
+            time = name_time(entry.name) if first_version else None
+            if(time is None):
+                time = datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime(DATETIME_FORMAT)
+
+            new_plans.append({'file': entry.name, 'sha256': sha256, 'time': time, 'waypoints': waypoints})
+
+    return sorted(new_plans, key=lambda x: (x['time'], x['file'])), files
+
+
+def save_plans(plans_dir, glider, new_plans, files):
+    '''Add new plans and the hashed goto files of a glider to its plans file'''
+    os.makedirs(plans_dir, exist_ok=True)
+    with locked(plans_dir):
+        plans = read_plans(plans_dir, glider)
+        known = {(plan['file'], plan['sha256'], plan['time']) for plan in plans['plans']}
+        plans['plans'] += [plan for plan in new_plans if (plan['file'], plan['sha256'], plan['time']) not in known]
+        plans['plans'].sort(key=lambda x: (x['time'], x['file']))
+        plans['files'].update(files)
+        write_json_file(plans_file(plans_dir, glider), plans)
+
+
+# Plans read by plan_at(): {plans file: ((mtime, size), plans, plan times)}, read again when the file changes
+loaded_plans = {}
+
+
+def plan_at(plans_dir, glider, time):
+    '''Plan of a glider in force at given time (datetime or "2023-11-13T09:34:18Z"), None if there's none before it
+
+    The plans are kept in memory between calls (e.g. replaying threats over a mission) until the file changes.'''
+    if(isinstance(time, datetime)):
+        if(time.tzinfo is not None):
+            time = time.astimezone(timezone.utc)
+        time = time.strftime(DATETIME_FORMAT)
+
+    filename = plans_file(plans_dir, glider)
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    if(filename not in loaded_plans or loaded_plans[filename][0] != version):
+        plans = read_plans(plans_dir, glider)['plans']
+        loaded_plans[filename] = (version, plans, [plan['time'] for plan in plans])
+    _, plans, times = loaded_plans[filename]
+
+    index = bisect.bisect_right(times, time)
+    return plans[index - 1] if index > 0 else None
+
+
+def remove_plans_until(plans_dir, glider, until):
+    '''Remove plans of a glider with time <= until (e.g. after the mission ended), returns the number removed'''
+    with locked(plans_dir):
+        plans = read_plans(plans_dir, glider)
+        kept = [plan for plan in plans['plans'] if plan['time'] > until]
+        removed = len(plans['plans']) - len(kept)
+        if(removed > 0):
+            plans['plans'] = kept
+            # Hashes of removed files aren't needed anymore
+            plans['files'] = {name: entry for name, entry in plans['files'].items()
+                              if any(plan['file'] == name for plan in kept)}
+            write_json_file(plans_file(plans_dir, glider), plans)
+    return removed
+
+
+def main():
+    '''Print the plan of a glider in force at given time'''
+
+    plans_dir = sys.argv[1]
+    glider = sys.argv[2]
+    time = sys.argv[3] if len(sys.argv) > 3 else datetime.now(timezone.utc).strftime(DATETIME_FORMAT)
+    print(plan_at(plans_dir, glider, time))
+
+if __name__ == "__main__":
+    main()
+
+    # python "./AIS Map/Glider Data Processing/glider_plans.py" "./AIS Map/Map Data/Gliders/JSONs/plans" koskelo 2023-11-12T00:00:00Z
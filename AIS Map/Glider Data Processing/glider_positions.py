@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import os
+import sys
+import uuid
+
+from shared_files import locked, read_json_file, write_json_file
+
+# Glider surfacings are kept as one JSON Lines file per glider, sorted by datetime, and an index of the stored range:
+#   <positions_dir>/<glider>.jsonl
+#   <positions_dir>/index.json    {"<glider>": {"first": <datetime>, "latest": <datetime>, "count": <surfacings>, "bytes": <file size>,
+#                                                "file_id": <changes when the file is rewritten instead of appended to>}}
+# The index is written after the surfacings, so anything past "bytes" is an unfinished append and is dropped.
+# Changes hold the lock of positions_dir, so processes updating different gliders don't lose each other's index entries.
+# Reads hold it shared, so the index entry and the file read are from the same change (a rewrite replaces the file).
+INDEX_FILE = 'index.json'
+
+# Columns of some sensors of each glider (e.g. the ones the map plots), read from the first "bytes" of the surfacings file:
+#   <positions_dir>/columns/<glider>.json    {"file_id": <file_id>, "bytes": <read up to>, "sensors": [<sensor>, ...],
+#                                             "columns": {"datetime": [...], "latitude": [...], <sensor>: [...], ...}}
+# Only surfacings appended after "bytes" are parsed when the columns are read again, a rewritten file is read from the start.
+COLUMNS_DIR = 'columns'
+POSITION_COLUMNS = ['mission_name', 'mission_num', 'datetime', 'latitude', 'longitude']
+
+
+def positions_file(positions_dir, glider):
+    return '{}/{}.jsonl'.format(positions_dir, glider)
+
+
+def read_index(positions_dir):
+    '''Read the index of stored gliders, empty if there's no store yet'''
+    try:
+        with open('{}/{}'.format(positions_dir, INDEX_FILE), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_index(positions_dir, index):
+    '''Replace the index in one step, readers see either the old or the new one'''
+    write_json_file('{}/{}'.format(positions_dir, INDEX_FILE), index)
+
+
+def surfacing_line(surfacing):
+    return (json.dumps(surfacing) + '\n').encode('utf-8')
+
+
+def line_datetime(line):
+    return json.loads(line)['datetime']
+
+
+def write_positions(positions_dir, glider, surfacings):
+    '''Replace all stored surfacings of a glider (sorted by datetime, one per datetime)'''
+    os.makedirs(positions_dir, exist_ok=True)
+    # First surfacing of each datetime is kept
+    unique = {}
+    for surfacing in surfacings:
+        unique.setdefault(surfacing['datetime'], surfacing)
+    surfacings = [unique[datetime] for datetime in sorted(unique)]
+
+    with locked(positions_dir):
+        filename = positions_file(positions_dir, glider)
+        with open(filename + '.tmp', 'wb') as file:
+            for surfacing in surfacings:
+                file.write(surfacing_line(surfacing))
+        os.replace(filename + '.tmp', filename)
+
+        index = read_index(positions_dir)
+        if(len(surfacings) == 0):
+            index.pop(glider, None)
+        else:
+            index[glider] = {'first': surfacings[0]['datetime'],
+                             'latest': surfacings[-1]['datetime'],
+                             'count': len(surfacings),
+                             'bytes': os.path.getsize(filename),
+                             'file_id': uuid.uuid4().hex}
+        write_index(positions_dir, index)
+
+
+def append_positions(positions_dir, glider, surfacings):
+    '''Append new surfacings of a glider, returns the number of surfacings added
+
+    Surfacings newer than the latest stored one are appended. Older ones (e.g. from a log
+    that was read again) are only added if their datetime isn't stored yet, which rewrites the file.'''
+
+    surfacings = sorted(surfacings, key=lambda x: x['datetime'])
+    with locked(positions_dir):
+        index = read_index(positions_dir)
+        if(glider not in index):
+            write_positions(positions_dir, glider, surfacings)
+            return len(surfacings)
+
+        entry = index[glider]
+        older = [surfacing for surfacing in surfacings if surfacing['datetime'] <= entry['latest']]
+        if(len(older) > 0):
+            stored_datetimes = {surfacing['datetime'] for surfacing in read_positions(positions_dir, glider, start=older[0]['datetime'])}
+            missing = [surfacing for surfacing in older if surfacing['datetime'] not in stored_datetimes]
+            if(len(missing) > 0):
+                stored = read_positions(positions_dir, glider)
+                write_positions(positions_dir, glider, stored + surfacings)
+                return read_index(positions_dir)[glider]['count'] - entry['count']
+
+        newer = []
+        for surfacing in surfacings:
+            if(surfacing['datetime'] > entry['latest'] and (len(newer) == 0 or surfacing['datetime'] > newer[-1]['datetime'])):
+                newer.append(surfacing)
+        if(len(newer) == 0):
+            return 0
+
+        with open(positions_file(positions_dir, glider), 'r+b') as file:
+            # Drop anything left by an append that didn't update the index
+            file.truncate(entry['bytes'])
+            file.seek(entry['bytes'])
+            file.write(b''.join(surfacing_line(surfacing) for surfacing in newer))
+            entry['bytes'] = file.tell()
+
+        entry['latest'] = newer[-1]['datetime']
+        entry['count'] += len(newer)
+        write_index(positions_dir, index)
+
+        return len(newer)
+
+
+def line_start(file, offset):
+    '''Offset of the first line starting at or after given offset'''
+    if(offset == 0):
+        return 0
+    file.seek(offset - 1)
+    file.readline()
+    return file.tell()
+
+
+def find_offset(file, size, datetime, after=False):
+    '''Offset of the first line with datetime >= given (> if after) by bisecting the byte offsets (lines are sorted by datetime)'''
+    low, high = 0, size
+    while(low < high):
+        middle = (low + high)//2
+        offset = line_start(file, middle)
+        if(offset >= size):
+            high = middle
+            continue
+        file.seek(offset)
+        line_time = line_datetime(file.readline())
+        if(line_time < datetime or (after and line_time == datetime)):
+            # Offsets up to the end of this line lead to this line or the next one
+            low = file.tell()
+        else:
+            high = middle
+    return min(line_start(file, low), size)
+
+
+def read_positions(positions_dir, glider, start=None, end=None):
+    '''Read stored surfacings of a glider with start <= datetime <= end, only the lines in range are parsed'''
+    with locked(positions_dir, shared=True):
+        entry = read_index(positions_dir).get(glider)
+        if(entry is None):
+            return []
+
+        with open(positions_file(positions_dir, glider), 'rb') as file:
+            first = 0 if start is None else find_offset(file, entry['bytes'], start)
+            last = entry['bytes'] if end is None else find_offset(file, entry['bytes'], end, after=True)
+            if(first >= last):
+                return []
+            file.seek(first)
+            data = file.read(last - first)
+
+    return parse_lines(data)
+
+
+def parse_lines(data):
+    '''Surfacings of whole lines read from a surfacings file'''
+    if(len(data) == 0):
+        return []
+    # Lines into one JSON array, parsed at once
+    return json.loads(b'[' + data[:-1].replace(b'\n', b',') + b']')
+
+
+def read_appended_positions(positions_dir, glider, file_id, offset):
+    '''Read the surfacings of a glider stored after byte offset, for keeping something derived from them up to date
+
+    Returns (surfacings, index entry), or (None, entry) if the file was rewritten since (file_id changed) and
+    has to be read from the start. The entry's "bytes" is where to continue from next time.'''
+    with locked(positions_dir, shared=True):
+        entry = read_index(positions_dir).get(glider)
+        if(entry is None):
+            return [], None
+        if(entry.get('file_id') != file_id or offset > entry['bytes']):
+            return None, entry
+
+        with open(positions_file(positions_dir, glider), 'rb') as file:
+            file.seek(offset)
+            data = file.read(entry['bytes'] - offset)
+    return parse_lines(data), entry
+
+
+def columns_file(positions_dir, glider):
+    return '{}/{}/{}.json'.format(positions_dir, COLUMNS_DIR, glider)
+
+
+def empty_columns(file_id, sensors):
+    return {'file_id': file_id,
+            'bytes': 0,
+            'sensors': list(sensors),
+            'columns': {column: [] for column in POSITION_COLUMNS + list(sensors)}}
+
+
+def read_position_columns(positions_dir, glider, sensors, start=None, end=None):
+    '''Read stored surfacings of a glider with start <= datetime <= end as columns
+
+    Returns {"mission_name", "mission_num", "datetime", "latitude", "longitude", <sensor>: [...]} with only the given
+    sensors (None where a surfacing doesn't have the sensor). The columns are kept in the columns file of the glider,
+    so only surfacings appended since the last read are parsed.'''
+    cache_file = columns_file(positions_dir, glider)
+    cache = read_json_file(cache_file)
+    if(cache is None or not set(sensors).issubset(cache['sensors'])):
+        cache = empty_columns(None, sensors)
+
+    surfacings, entry = read_appended_positions(positions_dir, glider, cache['file_id'], cache['bytes'])
+    if(entry is None):
+        return empty_columns(None, sensors)['columns']
+    while(surfacings is None):
+        # Rewritten file, read from the start
+        cache = empty_columns(entry.get('file_id'), sensors)
+        surfacings, entry = read_appended_positions(positions_dir, glider, cache['file_id'], 0)
+
+    if(len(surfacings) > 0):
+        columns = cache['columns']
+        columns['mission_name'] += [surfacing['mission_name'] for surfacing in surfacings]
+        columns['mission_num'] += [surfacing['mission_num'] for surfacing in surfacings]
+        columns['datetime'] += [surfacing['datetime'] for surfacing in surfacings]
+        columns['latitude'] += [surfacing['location']['latitude'] for surfacing in surfacings]
+        columns['longitude'] += [surfacing['location']['longitude'] for surfacing in surfacings]
+        for sensor in cache['sensors']:
+            columns[sensor] += [surfacing['sensors'].get(sensor) for surfacing in surfacings]
+
+        cache['bytes'] = entry['bytes']
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            write_json_file(cache_file, cache)
+        except OSError as e:
+            # Columns are still returned, e.g. from a read-only copy of the store
+            print(glider, 'columns not saved', e)
+
+    times = cache['columns']['datetime']
+    first = 0 if start is None else bisect.bisect_left(times, start)
+    last = len(times) if end is None else bisect.bisect_right(times, end)
+    return {column: cache['columns'][column][first:last] for column in POSITION_COLUMNS + list(sensors)}
+
+
+def tail_positions(positions_dir, glider, count):
+    '''Read the latest count surfacings of a glider from the end of its file'''
+    with locked(positions_dir, shared=True):
+        entry = read_index(positions_dir).get(glider)
+        if(entry is None or count <= 0):
+            return []
+
+        with open(positions_file(positions_dir, glider), 'rb') as file:
+            position = entry['bytes']
+            data = b''
+            # One extra line break so the first kept line is complete
+            while(position > 0 and data.count(b'\n') <= count):
+                step = min(position, 2**16)
+                position -= step
+                file.seek(position)
+                data = file.read(step) + data
+
+    return [json.loads(line) for line in data.splitlines()[-count:]]
+
+
+def remove_positions_until(positions_dir, glider, until):
+    '''Remove stored surfacings of a glider with datetime <= until, returns the number removed
+
+    The kept lines are copied as they are, without parsing them.'''
+    with locked(positions_dir):
+        index = read_index(positions_dir)
+        entry = index.get(glider)
+        if(entry is None):
+            return 0
+
+        filename = positions_file(positions_dir, glider)
+        with open(filename, 'rb') as file:
+            first = find_offset(file, entry['bytes'], until, after=True)
+            file.seek(first)
+            kept = file.read(entry['bytes'] - first)
+
+        if(len(kept) == 0):
+            os.remove(filename)
+            del index[glider]
+            write_index(positions_dir, index)
+            return entry['count']
+
+        with open(filename + '.tmp', 'wb') as file:
+            file.write(kept)
+        os.replace(filename + '.tmp', filename)
+
+        removed = entry['count'] - kept.count(b'\n')
+        index[glider] = dict(entry, first=line_datetime(kept[:kept.index(b'\n')]), count=entry['count'] - removed, bytes=len(kept),
+                              file_id=uuid.uuid4().hex)
+        write_index(positions_dir, index)
+
+        return removed
+
+
+def import_positions_json(positions_dir, json_file):
+    '''Import gliders of a current_positions.json style file ({glider: [surfacings]}) that aren't in the store yet'''
+    with open(json_file, 'r') as file:
+        json_data = json.load(file)
+
+    with locked(positions_dir):
+        index = read_index(positions_dir)
+        for glider, surfacings in json_data.items():
+            if(glider not in index):
+                write_positions(positions_dir, glider, surfacings)
+
+    return list(json_data.keys())
+
+
+def main():
+    '''Import an old current_positions.json into the store'''
+
+    positions_dir = sys.argv[1]
+    json_file = sys.argv[2]
+    gliders = import_positions_json(positions_dir, json_file)
+    for glider, entry in read_index(positions_dir).items():
+        if(glider in gliders):
+            print(glider, entry)
+
+if __name__ == "__main__":
+    main()
+
+    # python "./AIS Map/Glider Data Processing/glider_positions.py" "./AIS Map/Map Data/Gliders/JSONs/positions" "./AIS Map/Map Data/Gliders/JSONs/current_positions.json"
@@ -3,57 +3,48 @@ import datetime
 import json
 import os
 import re
-from copy import deepcopy
 import sys
 
+from glider_database import sync_database
+from glider_forecast import update_forecast
+from glider_positions import append_positions, import_positions_json, read_index
+from shared_files import locked, read_json_file, write_json_file
 
-def file_exists_and_not_empty(file_path):
-    return os.path.isfile(file_path) and os.path.getsize(file_path) > 0
 
-def read_data_from_file(filename):
-    """Reads the data from the given file.
+# Position history from before the position store (JSONs/positions), imported into the store if it exists
+OLD_POSITIONS_FILE = 'current_positions.json'
 
-    Args:
-      filename: The name of the file to read.
+def file_exists_and_not_empty(file_path):
+    return os.path.isfile(file_path) and os.path.getsize(file_path) > 0
 
-    Returns:
-      A string containing the data from the file.
-    """
+# Precompiled patterns of the network log lines read by parse_glider_data()
+VEHICLE_NAME_PATTERN = re.compile(r'Vehicle Name: (\w+)')
+MISSION_NAME_PATTERN = re.compile(r'MissionName:(\w+)\.[Mm][Ii]')
+MISSION_NUM_PATTERN = re.compile(r'MissionNum:([-\w]+)')
+CURR_TIME_PATTERN = re.compile(r'Curr Time:\s(\w+)\s+(\w+)\s+(\d+)\s+(\d+:\d+:\d+)\s+(\d+)')
+LOCATION_PATTERN = re.compile(r'DR  Location:\s+(\d+.\d+)\s+N\s+(\d+.\d+)\s+E\s+measured')
+SENSOR_PATTERN = re.compile(r'sensor:(\w+)\(.*\)=([-\.\d]+)')
 
-    with open(filename, 'r') as f:
-        data = f.read()
-    if len(data) > 0:
-        return data
-    else:
-        raise ValueError('Empty file: ', filename)
+# Month abbreviations of 'Curr Time', like strptime('%b') without the locale lookup
+MONTHS = {month: number for number, month in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 
+                                                         'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
 
 
 def parse_datetime(datetime_str):
     """Parses a datetime from a string of the format "Curr Time: Thu Sep 28 10:45:32 2023 MT:    3697".
 
     Args:
-      datetime_str: A string containing the datetime to parse.
+      datetime_str: The groups of CURR_TIME_PATTERN (weekday, month, day, time, year).
 
     Returns:
       A datetime object representing the parsed datetime.
     """
     try:
-        #print('1>',datetime_str.group())
         date_time_match = datetime_str
-        # Match the date and time using a regular expression.
-        # Check the type of the datetime_str variable.
-        # if type(datetime_str) is not str:
-        #     # Convert the datetime_str variable to a string.
-        #     datetime_str = str(datetime_str)
-
-        # date_time_match = re.search(r'Curr Time: (\w+)\s+(\w+)\s+(\d+)\s+(\d+:\d+:\d+)\s+(\d+)', datetime_str)
-        # print('2>', date_time_match.group())
-        
         date = int(date_time_match[2])
         time = date_time_match[3]
         year = int(date_time_match[4])
-        month = datetime.datetime.strptime(date_time_match[1], '%b').month
-        #day = int(date_time_match.group(1))
+        month = MONTHS[date_time_match[1].lower()]
         hour = int(time[:2])
         minute = int(time[3:5])
         second = int(time[6:])
@@ -89,88 +80,80 @@ def convert_ddmm_mmm_to_decimal_degrees(ddmm_mmm_coordinates):
     return decimal_degrees
 
 
-def parse_glider_data(data):
-    """Parses the glider data from the given string.
+def parse_glider_data(lines):
+    """Parses the glider data from the lines of a network log in one pass.
+
+    Each 'Curr Time' line starts a surfacing, which gets the first DR location and the 
+    sensors up to the next one. Surfacings without a DR location (e.g. the line was cut 
+    by other output) are skipped. Mission name and number are the first ones in the log.
 
     Args:
-      data: A string containing the glider data.
+      lines: An iterable of the log lines, e.g. an open file.
 
     Returns:
-      A dictionary containing the parsed data.
+      The glider name and a list of the parsed surfacings.
     """
 
-    # Parse the vehicle name.
-    vehicle_name_match = re.search(r'Vehicle Name: (\w+)', data)
-    glider = vehicle_name_match.group(1)
-
-    # Parse the mission name.
-    mission_name_match = re.search(r'MissionName:(\w+)\.[Mm][Ii]', data)
+    glider = None
     mission_name = None
-    if(mission_name_match):
-        mission_name = mission_name_match.group(1)
-
-    # Parse the mission number.
-    mission_num_match = re.search(r'MissionNum:([-\w]+)', data)
     mission_num = None
-    if(mission_num_match):
-        mission_num = mission_num_match.group(1)
-
-    # Parse the date and time.
-    date_time_match = re.findall(
-        r'Curr Time:\s(\w+)\s+(\w+)\s+(\d+)\s+(\d+:\d+:\d+)\s+(\d+)', data)
-    #print(date_time_match)
-    # if date_time_match:
-    #     print('Matched String:', date_time_match.group())
-    # else:
-    #     print('No match found.')
-        
-
-    if date_time_match:
-        # Specify the datetime format
-        datetime_format = '%Y-%m-%dT%H:%M:%SZ'
-        try:
-            for i,date_time in enumerate(date_time_match):
-                # Parse into datetime object, then convert datetime object to string
-                date_time_match[i] = parse_datetime(date_time).strftime(datetime_format)
-        except Exception:
-            raise ValueError('Time missing')
-
-    # Parse the location.
-    location_match = re.findall(
-        r'DR  Location:\s+(\d+.\d+)\s+N\s+(\d+.\d+)\s+E\s+measured', data)
-    for i,location in enumerate(location_match):
-        latitude = convert_ddmm_mmm_to_decimal_degrees(location[0])
-        longitude = convert_ddmm_mmm_to_decimal_degrees(location[1])
-        location_match[i] = {
-            'latitude': float(latitude),
-            'longitude': float(longitude)
-        }
-
-    # Split the data into chunks by 'Curr Time'
-    split_data = re.split(r'Curr Time',data)
-    sensor_data_match = []
-    for split in split_data:
-        # Get all the sensor data in each chunk
-        sensor_data_match.append(re.findall(r'sensor:(\w+)\(.*\)=([-\.\d]+)',split))
-    # Remove anything before first 'Curr Time'
-    sensor_data_match = sensor_data_match[1:]
-
     log_data = []
+    surfacing = None
+
+    for line in lines:
+        if('sensor:' in line):
+            if(surfacing is not None):
+                sensor_match = SENSOR_PATTERN.search(line)
+                if(sensor_match):
+                    surfacing['sensors'][sensor_match[1]] = float(sensor_match[2])
+
+        elif('Curr Time' in line):
+            # Previous surfacing is complete
+            if(surfacing is not None and surfacing['location'] is not None):
+                log_data.append(surfacing)
+
+            date_time_match = CURR_TIME_PATTERN.search(line)
+            if(date_time_match is None):
+                raise ValueError('Time missing')
+            surfacing = {'mission_name': None,
+                         'mission_num': None,
+                         'datetime': parse_datetime(date_time_match.groups()).isoformat() + 'Z',
+                         'location': None,
+                         'sensors': {}}
+
+        elif('DR  Location:' in line):
+            if(surfacing is not None and surfacing['location'] is None):
+                location_match = LOCATION_PATTERN.search(line)
+                if(location_match):
+                    surfacing['location'] = {'latitude': convert_ddmm_mmm_to_decimal_degrees(location_match[1]),
+                                             'longitude': convert_ddmm_mmm_to_decimal_degrees(location_match[2])}
+
+        elif('Vehicle Name:' in line):
+            if(glider is None):
+                vehicle_name_match = VEHICLE_NAME_PATTERN.search(line)
+                if(vehicle_name_match):
+                    glider = vehicle_name_match[1]
+
+        elif('Mission' in line):
+            if(mission_name is None):
+                mission_name_match = MISSION_NAME_PATTERN.search(line)
+                if(mission_name_match):
+                    mission_name = mission_name_match[1]
+            if(mission_num is None):
+                mission_num_match = MISSION_NUM_PATTERN.search(line)
+                if(mission_num_match):
+                    mission_num = mission_num_match[1]
+
+    if(surfacing is not None and surfacing['location'] is not None):
+        log_data.append(surfacing)
+
+    if(glider is None):
+        raise ValueError('Vehicle name missing')
+
+    for surfacing in log_data:
+        surfacing['mission_name'] = mission_name
+        surfacing['mission_num'] = mission_num
 
-    for i in range(0,len(date_time_match)):
-        parsed_data = {}
-        parsed_data['mission_name'] = mission_name
-        parsed_data['mission_num'] = mission_num
-        parsed_data['datetime'] = date_time_match[i]
-        parsed_data['location'] = location_match[i]
-        parsed_data['sensors'] = {}
-        
-        for sensor_tuple in sensor_data_match[i]:
-            sensor_name, sensor_value = sensor_tuple
-            parsed_data['sensors'][sensor_name] = float(sensor_value)
-        
-        log_data.append(deepcopy(parsed_data))
-        
     return glider, log_data
 
 def overwrite_json_condition(json_file, json_data, new_data, key):
@@ -186,12 +169,10 @@ def overwrite_json_condition(json_file, json_data, new_data, key):
     return overwrite
 
 def read_overwrite_json(dataroot, json_file, new_data):
-    '''Read and if necessary, overwrite old json'''
+    '''Read and if necessary, overwrite old json (the JSONs directory has to be locked)'''
     # read previous position list as json
-    try:
-        with open('{}/JSONs/{}'.format(dataroot, json_file), 'r') as file:
-            json_data = json.load(file)
-    except Exception:
+    json_data = read_json_file('{}/JSONs/{}'.format(dataroot, json_file))
+    if(json_data is None):
         json_data = new_data
     else:
         # overwrite new data into dict
@@ -199,161 +180,172 @@ def read_overwrite_json(dataroot, json_file, new_data):
             if(overwrite_json_condition(json_file, json_data, new_data, key)):
                 json_data[key] = new_data[key]
 
-    with open('{}/JSONs/{}'.format(dataroot, json_file), 'w') as file:
-        json.dump(json_data, file)
+    write_json_file('{}/JSONs/{}'.format(dataroot, json_file), json_data)
     
     return
 
-def read_append_json(dataroot, glider, json_file, data):
-    '''Read and append old json'''
-    # read previous position list as json
-    try:
-        with open('{}/JSONs/{}'.format(dataroot, json_file), 'r') as file:
-            full_data = json.load(file)
-    except Exception as e:
-        full_data = data
-    else:
-        # append new data into dict
-        for key in data.keys():
-            try:
-                # if glider already in file
-                full_data[key] += data[key]
-            except KeyError as e:
-                # if glider not yet in file
-                full_data[key] = data[key]
-                print('append error ', e, glider, key)
-
-    # re-sort after appending and before writing to file
+def is_mission_log(filename, start_mission):
+    '''Log file named like <glider>_<yyyymmddThhmmss>_network_net_0.log from after the mission start'''
+    parts = filename.split('_')
+    return ('log' in filename) and (len(parts) > 1) and (parts[1][0:len(start_mission)] > start_mission)
+
+
+def read_processed_logs(processed_logs_file, log_list_file, log_dir):
+    '''Read the index of processed logs {filename: {"size": bytes, "mtime": seconds}}
+
+    Without an index, the logs in the old log_list.txt are taken as processed at their current size.'''
     try:
-        full_data[glider] = sorted(full_data[glider], key=lambda x: x["datetime"])
-    except Exception:
+        with open(processed_logs_file, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
         pass
 
-    with open('{}/JSONs/{}'.format(dataroot, json_file), 'w') as file:
-        json.dump(full_data, file)
-    
-    return
+    processed_logs = {}
+    try:
+        with open(log_list_file, 'r') as file:
+            log_list = [line.strip() for line in file if line.strip()]
+    except FileNotFoundError:
+        return processed_logs
 
+    for filename in log_list:
+        try:
+            stat = os.stat(log_dir + filename)
+        except FileNotFoundError:
+            continue
+        processed_logs[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    write_processed_logs(processed_logs_file, processed_logs)
+    return processed_logs
 
-def update_location(dataroot, glider, current_pos_file, start_mission):
-    '''Update json file of the current position of a glider'''
+
+def write_processed_logs(processed_logs_file, processed_logs):
+    '''Replace the index of processed logs in one step'''
+    write_json_file(processed_logs_file, processed_logs)
+
+
+def find_new_logs(log_dir, processed_logs, start_mission):
+    '''New mission logs and processed ones that changed since, as {filename: {"size": bytes, "mtime": seconds}}
+
+    The directory is listed once. Every mission log's size and modification time is compared to the index,
+    so a log appended to or replaced at any time (e.g. a late sync, or a copy with an older mtime) is read again.'''
+    new_logs = {}
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            previous = processed_logs.get(entry.name)
+            if(not is_mission_log(entry.name, start_mission)):
+                continue
+            stat = entry.stat()
+            if(previous is None or stat.st_size != previous['size'] or stat.st_mtime != previous['mtime']):
+                new_logs[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    return new_logs
+
+
+def processed_logs_path(dataroot, glider):
+    return '{:}/{:}/data/processed_logs.json'.format(dataroot, glider)
+
+
+def read_new_surfacings(dataroot, glider, start_mission):
+    '''Read and parse new or grown logs of a glider, returns (surfacings sorted by datetime, updated processed log index)
+
+    Nothing is written, so gliders can be read in parallel. Write the index with write_processed_logs() 
+    after the surfacings are saved with save_surfacings().'''
 
     log_list_file = '{:}/{:}/data/log_list.txt'.format(dataroot, glider)
-    len_start = len(start_mission)
-    
-    # Read list of previously handeled log-files    
-    try:
-    # Read the file and store each line as an element in a list
-        with open(log_list_file, 'r') as file:
-            log_list = file.readlines()
-        if len(log_list) == 0:
-            log_list = []
-    except Exception as e:
-        log_list = []
-    else:
-         log_list = sorted([line.strip() for line in log_list])
- 
-    # Read a list of logfiles to process
     log_dir = '{:}/{:}/logs/'.format(dataroot, glider) 
-    l_temp = sorted([f for f in os.listdir(log_dir) if f not in log_list])
-    try:           
-        files = [f for f in os.listdir(log_dir) if                              # filenames in directory where: 
-                            ('log' in f) &                                      # 1. filename contains 'log'
-#                            (f.split('_')[1].split('T')[0] > start_mission) &   # 2. filename date > start_mission
-                            (f.split('_')[1][0:len_start] > start_mission) &    # 2. filename date > start_mission
-                            (f not in log_list)]                                # 3. filename isn't in log_list
-        if len(files) == 0:
+
+    # Read index of previously handeled log-files and find new or grown ones
+    processed_logs = read_processed_logs(processed_logs_path(dataroot, glider), log_list_file, log_dir)
+    try:
+        new_logs = find_new_logs(log_dir, processed_logs, start_mission)
+        if len(new_logs) == 0:
             raise ValueError('No new logfiles')
     except Exception as e:
-        raise ValueError(e, ' logfiles error, ', glider, start_mission, len(files), l_temp[-3:])
-
-    # OBS:
-    # previous data should be read, this routine is called by glidername. If both on a missing data should not be deleted
-    #     
-    # # read previous position list as json
-    # try:
-    #     with open(filename, 'r') as file:
-    #         curr_pos = json.load(dataroot+'/forweb/'+current_pos_file)
-    #     print('Positioita: ', len(curr_pos), len(curr_pos[glider]))
-    # except Exception:
-    #     current_pos = new_data
-    # else:
-    #     for key, value in current_pos.items():
-    #         try:
-    #             a = len(value)  # Check if the value is even
-    #         except Exception:
-    #             current_pos[key] = []
-    #         # append new data into dict
-    #         current_pos[key].append(new_data[g])
-    #
-    # if josn is empty, reread all logs, otherwise only last onces
-    # lets read all and rewrite all data
-    # files = [f for f in files if ('log' in f) & (f.split('_')[1].split('T')[0] > start_mission)] # & \~(f in log_list)]
-    # if len(files) == 0:
-    #     raise ValueError('No new logs')
-    
-    files = sorted(files)
+        raise ValueError(e, ' logfiles error, ', glider, start_mission, len(processed_logs))
+
+    files = sorted(new_logs.keys())
 
     # read new log-files
     new_data = {glider:[]}
     
     for f in files:
+        # Read and parse the log line by line
         try:
-            data = read_data_from_file(log_dir+f)
-        except Exception:
-            continue
-        # Parse the example data.
-        try:
-            glider, parsed_data = parse_glider_data(data)
+            with open(log_dir+f, 'r') as file:
+                log_glider, parsed_data = parse_glider_data(file)
         except Exception:
             continue
 
-        # Append parsed data into new data
+        # Append parsed data into new data, logs of other gliders are skipped
         try:
-            new_data[glider] += parsed_data
+            new_data[log_glider] += parsed_data
         except KeyError:
             pass
-            # Create new key if glider name different from the one given in arguments
-            # new_data[glider] = []
-            # new_data[glider].append(parsed_data)
 
-    if new_data == {} :
-        new_data[glider] = []
-        raise ValueError('No new data')
-    
-    # for g, value in new_data:
-    #     try:
-    #         current_pos[g].append(new_data[g])
-    #     except KeyError:
-    #         current_pos[g] = []
-    #         current_pos[g].append(new_data[g])
-
-    # current_pos = {key: value.append(new_data[g]) for key, value in current_pos.items()}
-    
-    try:
-        new_data[glider] = sorted(new_data[glider], key=lambda x: x["datetime"])
-    except Exception:
-        pass
+    # Logs are read again only if they grow
+    processed_logs.update(new_logs)
+
+    return sorted(new_data[glider], key=lambda x: x["datetime"]), processed_logs
+
+
+def save_surfacings(dataroot, new_data, current_pos_file, database=None):
+    '''Update deployment and last positions and append to the position store, new_data = {glider: surfacings sorted by datetime}
+
+    The shared files are updated under the JSONs directory's lock and replaced in one step, 
+    so runs for different gliders don't lose each other's updates. Returns the number of 
+    surfacings added to the store per glider. If a database is given, its glider tables 
+    are synced with the store (see glider_database.py).'''
+
+    new_data = {key: value for key, value in new_data.items() if len(value) > 0}
+    positions_dir = '{}/JSONs/positions'.format(dataroot)
+    added = {}
+
+    if(len(new_data) > 0):
+        # Mission's deployment coordinates and date
+        deployment_positions = {}
+        for key, value in new_data.items():
+            deployment_positions[key] = value[0]  
+
+        # latest position of glider    
+        last_positions = {}
+        for key, value in new_data.items():
+            last_positions[key] = value[-1]  
+
+        with locked('{}/JSONs'.format(dataroot)):
+            read_overwrite_json(dataroot, 'deployment_positions.json', deployment_positions)
+            read_overwrite_json(dataroot, 'last_positions.json', last_positions)
 
-    # Deployment and last positions should be for both(all) gliders, so at first read files, and then update & write
-    # Mission's deployment coordinates and date
-    deployment_positions = {}
-    for key, value in new_data.items():
-        deployment_positions[key] = value[0]  
+            # Append new surfacings into the glider's position store
+            current_pos_path = '{}/JSONs/{}'.format(dataroot, current_pos_file)
+            if(len(read_index(positions_dir)) == 0 and file_exists_and_not_empty(current_pos_path)):
+                # Position history from before the store
+                import_positions_json(positions_dir, current_pos_path)
+            added = {key: append_positions(positions_dir, key, value) for key, value in new_data.items()}
 
-    # latest position of glider    
-    last_positions = {}
-    for key, value in new_data.items():
-        last_positions[key] = value[-1]  
+            # Battery forecasts read only the surfacings added
+            for key in new_data.keys():
+                update_forecast(positions_dir, '{}/JSONs/forecasts'.format(dataroot), key)
+
+    if(database is not None):
+        # All gliders, so surfacings of a failed sync are inserted on the next run
+        try:
+            sync_database(database, positions_dir)
+        except Exception as e:
+            print('glider tables not synced', e)
+
+    return added
+
+
+def update_location(dataroot, glider, current_pos_file, start_mission, database=None):
+    '''Update json file of the current position of a glider'''
+
+    surfacings, processed_logs = read_new_surfacings(dataroot, glider, start_mission)
+
+    if len(surfacings) == 0:
+        write_processed_logs(processed_logs_path(dataroot, glider), processed_logs)
+        raise ValueError('No new data')
 
-    read_overwrite_json(dataroot, 'deployment_positions.json', deployment_positions)
-    read_overwrite_json(dataroot, 'last_positions.json', last_positions)
-    read_append_json(dataroot, glider, current_pos_file, new_data)
+    save_surfacings(dataroot, {glider: surfacings}, current_pos_file, database)
 
-    # Open the parsed log list file in append mode and write the new rows
-    with open(log_list_file, 'a') as file:
-        for row in files:
-            file.write(row + '\n')  # Append each row followed by a newline character
+    write_processed_logs(processed_logs_path(dataroot, glider), processed_logs)
 
     return True
 
@@ -365,8 +357,9 @@ def main():
     glider = sys.argv[2]
     glider_positions = sys.argv[3]
     start_missions_date = sys.argv[4]
+    database = sys.argv[5] if len(sys.argv) > 5 else None
     try:
-        current_pos = update_location(dataroot, glider, glider_positions, start_missions_date)
+        current_pos = update_location(dataroot, glider, glider_positions, start_missions_date, database)
     except Exception as e:
         print(e)
         pass
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+# Lock file of a directory's shared files, e.g. JSONs/.lock for deployment_positions.json, last_positions.json and glider_waypoints.json
+LOCK_FILE = '.lock'
+
+# Locks held by the current thread, so functions holding a lock can call each other
+held_locks = threading.local()
+
+
+@contextmanager
+def locked(directory, shared=False):
+    '''Hold an exclusive lock of the shared files in a directory, between processes and threads
+
+    A shared lock is for reads that have to see the files of one change (e.g. the position store's index and a glider's file),
+    any number of readers hold it at the same time. Reads in a directory that doesn't exist or can't be written to
+    (a read-only copy) aren't locked, nothing changes the files there. Don't make changes while holding a shared lock.'''
+    lock_path = os.path.abspath(os.path.join(directory, LOCK_FILE))
+    held = getattr(held_locks, 'paths', None)
+    if(held is None):
+        held = held_locks.paths = set()
+    if(lock_path in held):
+        yield
+        return
+
+    try:
+        if(not shared):
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(lock_path, 'a')
+    except OSError:
+        if(not shared):
+            raise
+        yield
+        return
+
+    with lock_file:
+        if(fcntl is not None):
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        held.add(lock_path)
+        try:
+            yield
+        finally:
+            held.discard(lock_path)
+            if(fcntl is not None):
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_json_file(file_path, default=None):
+    '''Read a JSON file, default if it doesn't exist or isn't valid JSON'''
+    try:
+        with open(file_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_file(file_path, data):
+    '''Replace a JSON file in one step, readers see either the old or the new file'''
+    # Temporary file of this process and thread, the Service runs jobs in threads of one process
+    # (not tempfile, its files are only readable by the owner)
+    temp_path = '{}.{}.{}.tmp'.format(file_path, os.getpid(), threading.get_ident())
+    with open(temp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(temp_path, file_path)
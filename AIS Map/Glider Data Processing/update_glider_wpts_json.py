@@ -1,17 +1,43 @@
-import os
-import re
-import json
 import sys 
 
-def convert_coordinates_ddmm_to_dddd(coord):
-    '''Convert coordinates from degrees+minutes to degrees+decimals'''
-    
-    degs = coord//100
-    mins = coord % 100
+from shared_files import locked, read_json_file, write_json_file
+from glider_plans import read_plans, find_new_plans, save_plans
 
-    return round(degs + mins/60, 5)
+def read_goto_changes(root_dir, goto_dir, glider_name):
+    '''Reads new and changed goto files of a glider into the plan cache (see glider_plans.py), None if nothing changed
 
-def main():
+    Returns {"new_plans", "files"} for save_plans() and "current", the plan in force now if it changed (else None).
+    Nothing is written, so gliders can be read in parallel.'''
+
+    plans = read_plans(f'{root_dir}/JSONs/plans', glider_name)
+    new_plans, files = find_new_plans(f"{root_dir}/{glider_name}/{goto_dir}", plans)
+    if(len(new_plans) == 0 and files == plans['files']):
+        return None
+
+    # Plan in force now is the latest one, a changed file with the same name is a new plan
+    current = None
+    if(len(new_plans) > 0 and (len(plans['plans']) == 0 or 
+                               (new_plans[-1]['time'], new_plans[-1]['file']) > (plans['plans'][-1]['time'], plans['plans'][-1]['file']))):
+        current = new_plans[-1]
+
+    return {'new_plans': new_plans, 'files': files, 'current': current}
+
+def save_glider_waypoints(root_dir, filename, waypoints):
+    '''Updates the waypoints of given gliders ({glider: waypoints}) into the json
+
+    The json is updated under the JSONs directory's lock and replaced in one step.'''
+    with locked(f'{root_dir}/JSONs'):
+        glider_wpt_dict = read_json_file(f'{root_dir}/JSONs/{filename}', {})
+        glider_wpt_dict.update(waypoints)
+        write_json_file(f'{root_dir}/JSONs/{filename}', glider_wpt_dict)
+
+def write_latest_read_goto(root_dir, glider_name, latest_goto_name):
+    '''Marks the goto file as read'''
+    with open(f'{root_dir}/{glider_name}/data/latest_read_goto.txt', 'w') as file:
+        file.write(latest_goto_name)
+        file.close()
+
+def update_glider_waypoints(root_dir, goto_dir, filename, glider_name):
     '''Reads glider goto-files and creates a json'''
     '''
     Output json format example:
@@ -20,6 +46,21 @@ def main():
                 [19.57372, 61.08332], [19.43089, 60.96624], [19.50365, 60.57783]], 
     "koskelo": [[19.43089, 60.96624], [19.50365, 60.57783], [19.43089, 60.96624]]}
     '''
+    changes = read_goto_changes(root_dir, goto_dir, glider_name)
+    if(changes is None):
+        return
+
+    # Update json
+    if(changes['current'] is not None):
+        save_glider_waypoints(root_dir, filename, {glider_name: changes['current']['waypoints']})
+
+    # Update log, plans are read again if the json wasn't updated
+    save_plans(f'{root_dir}/JSONs/plans', glider_name, changes['new_plans'], changes['files'])
+    if(changes['current'] is not None):
+        write_latest_read_goto(root_dir, glider_name, changes['current']['file'])
+
+def main():
+    '''Reads glider goto-files and creates a json'''
     # glider_names = ["uivelo", "koskelo"]
     # root_dir = "../Map Data/Gliders"
     # goto_dir = "archive"
@@ -29,54 +70,7 @@ def main():
     filename = sys.argv[3]
     glider_name = sys.argv[4]
 
-    glider_wpt_dict = {}
-
-    # for glider_name in glider_names:
-    # Get the latest goto file
-    goto_files = list(filter(re.compile(".*goto.*").match, 
-                                os.listdir(f"{root_dir}/{glider_name}/{goto_dir}")))
-    latest_goto_name = sorted(goto_files)[-1]
-    
-    # Check if it's already been read
-    try:
-        with open(f'{root_dir}/{glider_name}/data/latest_read_goto.txt', 'r') as file:
-            latest_read_goto = file.read()
-            file.close()
-            if(latest_read_goto == latest_goto_name):
-                return
-    except Exception:
-        pass
-    # Read the goto file contents
-    with open(f"{root_dir}/{glider_name}/{goto_dir}/{latest_goto_name}", 'r') as f:
-        latest_goto = f.read()
-
-    glider_waypoints = re.findall(r"^\d[\d \t\.]*", latest_goto, re.MULTILINE)
-    glider_waypoints = [wpt.split() for wpt in glider_waypoints]
-    glider_waypoints = [[float(coord) for coord in wpt] for wpt in glider_waypoints]
-    glider_waypoints = [[convert_coordinates_ddmm_to_dddd(coord) for coord in wpt] 
-                        for wpt in glider_waypoints]
-
-    # Check if waypoints loop, append first element to the end if they do
-    legs_to_run = re.search(r"num_legs_to_run\(nodim\)\s*([-\d]+)", 
-                            latest_goto).group(1)
-    if (legs_to_run == "-1"):
-        glider_waypoints.append(glider_waypoints[0])
-
-    # Update json
-    try:
-        with open(f'{root_dir}/JSONs/{filename}', 'r') as file:
-            glider_wpt_dict = json.load(file)
-    except Exception:
-        pass
-    glider_wpt_dict[glider_name] = glider_waypoints
-
-    with open(f'{root_dir}/JSONs/{filename}', 'w') as file:
-        json.dump(glider_wpt_dict, file)
-
-    # Update log
-    with open(f'{root_dir}/{glider_name}/data/latest_read_goto.txt', 'w') as file:
-        file.write(latest_goto_name)
-        file.close()
+    update_glider_waypoints(root_dir, goto_dir, filename, glider_name)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from parse2 import read_new_surfacings, save_surfacings, write_processed_logs, processed_logs_path, OLD_POSITIONS_FILE
+from update_glider_wpts_json import read_goto_changes, save_glider_waypoints, write_latest_read_goto
+from glider_plans import save_plans
+
+
+def find_gliders(dataroot):
+    '''Gliders with a logs directory in dataroot'''
+    return sorted(name for name in os.listdir(dataroot) if os.path.isdir('{}/{}/logs'.format(dataroot, name)))
+
+
+def process_glider(dataroot, glider, start_mission, goto_dir):
+    '''Read a glider's new logs and latest goto file, runs in a worker process and writes nothing
+
+    Returns {"glider", "surfacings", "processed_logs", "goto": read_goto_changes() or None, "errors"}'''
+    result = {'glider': glider, 'surfacings': [], 'processed_logs': None, 'goto': None, 'errors': []}
+
+    try:
+        result['surfacings'], result['processed_logs'] = read_new_surfacings(dataroot, glider, start_mission)
+    except Exception as e:
+        # e.g. "No new logfiles", the usual case
+        result['errors'].append(str(e))
+
+    try:
+        result['goto'] = read_goto_changes(dataroot, goto_dir, glider)
+    except Exception as e:
+        result['errors'].append('goto: {}'.format(e))
+
+    return result
+
+
+def update_gliders(dataroot, gliders, start_mission, current_pos_file, goto_dir, waypoints_file, workers=None, database=None):
+    '''Process gliders in parallel and write each shared JSON once, returns {glider: surfacings added}
+
+    Workers only read and parse. The results are merged and the shared files (deployment and last positions,
+    position store, waypoints) are written here under the JSONs directory's lock. Per glider indexes of read logs
+    and the goto plan cache are written after that, so a failed write is retried on the next run.
+    If a database is given, the new surfacings are also inserted into its glider tables.'''
+
+    if(workers is None):
+        workers = min(len(gliders), os.cpu_count() or 1)
+
+    if(workers <= 1 or len(gliders) <= 1):
+        results = [process_glider(dataroot, glider, start_mission, goto_dir) for glider in gliders]
+    else:
+        # Workers aren't forked: the Service calls this from a job thread while other threads may hold locks
+        # (stdout, sqlite, the port data cache) that a forked worker would inherit held and wait on forever
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as executor:
+            futures = [executor.submit(process_glider, dataroot, glider, start_mission, goto_dir) for glider in gliders]
+            results = [future.result() for future in futures]
+
+    for result in results:
+        for error in result['errors']:
+            print(result['glider'], error)
+
+    # One locked write per shared file for all gliders
+    added = save_surfacings(dataroot, {result['glider']: result['surfacings'] for result in results}, current_pos_file, database)
+    waypoints = {result['glider']: result['goto']['current']['waypoints'] for result in results 
+                 if result['goto'] is not None and result['goto']['current'] is not None}
+    if(len(waypoints) > 0):
+        save_glider_waypoints(dataroot, waypoints_file, waypoints)
+
+    for result in results:
+        if(result['processed_logs'] is not None):
+            write_processed_logs(processed_logs_path(dataroot, result['glider']), result['processed_logs'])
+        if(result['goto'] is not None):
+            save_plans('{}/JSONs/plans'.format(dataroot), result['glider'], result['goto']['new_plans'], result['goto']['files'])
+            if(result['goto']['current'] is not None):
+                write_latest_read_goto(dataroot, result['glider'], result['goto']['current']['file'])
+
+    return {result['glider']: added.get(result['glider'], 0) for result in results}
+
+
+def database_argument(argv):
+    '''Database given with --database=<path>, None if not given'''
+    for arg in argv:
+        if(arg.startswith('--database=')):
+            return arg[len('--database='):]
+    return None
+
+
+def main():
+    '''Update the JSONs of all gliders (or given ones)'''
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--database=')]
+    database = database_argument(sys.argv)
+    dataroot = args[0]
+    start_missions_date = args[1]
+    gliders = args[2:] if len(args) > 2 else find_gliders(dataroot)
+
+    new_surfacings = update_gliders(dataroot, gliders, start_missions_date, OLD_POSITIONS_FILE, 'archive', 'glider_waypoints.json',
+                                    database=database)
+    for glider, count in new_surfacings.items():
+        if(count > 0):
+            print(glider, count, 'new surfacings')
+
+if __name__ == "__main__":
+    main()
+
+    # python "./AIS Map/Glider Data Processing/update_gliders.py" "./AIS Map/Map Data/Gliders" 20231108
+    # python "./AIS Map/Glider Data Processing/update_gliders.py" "./AIS Map/Map Data/Gliders" 20231108 koskelo uivelo
+    # python "./AIS Map/Glider Data Processing/update_gliders.py" "./AIS Map/Map Data/Gliders" 20231108 --database="./AIS Map/Map Data/AIS.sqlite"
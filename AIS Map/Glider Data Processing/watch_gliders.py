@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import threading
+import traceback
+from datetime import datetime
+
+from parse2 import OLD_POSITIONS_FILE
+from update_gliders import update_gliders, find_gliders, database_argument
+
+# Changes are collected until no new ones come in for DEBOUNCE_SECONDS, at most MAX_DELAY_SECONDS after the first one
+DEBOUNCE_SECONDS = 2
+MAX_DELAY_SECONDS = 30
+# Directory listing interval of the polling watcher
+POLL_SECONDS = 5
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    '''Files closed after writing or moved into the directories (e.g. by rsync), Linux only'''
+
+    def __init__(self, directories):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if(self.fd < 0):
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.directories = {}
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if(wd < 0):
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', directory)
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        '''Changes within timeout seconds as [(directory, filename)], filename None if events were lost'''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if(len(readable) == 0):
+            return []
+
+        data = os.read(self.fd, 64*1024)
+        changes = []
+        offset = 0
+        while(offset < len(data)):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if(mask & IN_Q_OVERFLOW):
+                # Kernel queue overflowed, any directory may have changed
+                changes += [(directory, None) for directory in self.directories.values()]
+            elif(wd in self.directories):
+                changes.append((self.directories[wd], os.fsdecode(name)))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    '''Files whose size or modification time changed, by listing the directories every POLL_SECONDS'''
+
+    def __init__(self, directories, poll_seconds=POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.snapshots = {directory: self.snapshot(directory) for directory in directories}
+        self.next_poll = time.monotonic() + poll_seconds
+
+    def snapshot(self, directory):
+        '''Size and modification time of the files in directory, hidden (e.g. rsync's temporary) files left out'''
+        snapshot = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if(entry.name.startswith('.') or not entry.is_file()):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed or renamed after listing
+                    continue
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        '''Changes within timeout seconds as [(directory, filename)], the directories are still listed only every poll_seconds'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while(True):
+            if(time.monotonic() >= self.next_poll):
+                self.next_poll = time.monotonic() + self.poll_seconds
+                changes = []
+                for directory, previous in self.snapshots.items():
+                    current = self.snapshot(directory)
+                    changes += [(directory, name) for name, stat in current.items() if previous.get(name) != stat]
+                    self.snapshots[directory] = current
+                if(len(changes) > 0):
+                    return changes
+
+            if(deadline is not None and time.monotonic() >= deadline):
+                return []
+            wake = self.next_poll if deadline is None else min(self.next_poll, deadline)
+            time.sleep(max(0, wake - time.monotonic()))
+
+    def close(self):
+        pass
+
+
+def open_watcher(directories, poll=False):
+    '''inotify watcher, or the polling one if asked or inotify isn't available (e.g. not Linux)'''
+    if(not poll):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            print('inotify not available ({}), polling every {} s'.format(e, POLL_SECONDS))
+    return PollingWatcher(directories)
+
+
+def is_glider_file(directory, filename, goto_dir):
+    '''Logs in logs/ and goto files in the goto directory, not hidden (e.g. rsync's temporary) files'''
+    if(filename is None):
+        return True
+    if(filename.startswith('.')):
+        return False
+    if(os.path.basename(directory) == goto_dir):
+        return 'goto' in filename
+    return filename.endswith('.log')
+
+
+def watch_gliders(dataroot, gliders, start_mission, current_pos_file, goto_dir, waypoints_file,
+                  poll=False, stop_event=None, database=None):
+    '''Run update_gliders() for the gliders whose logs or goto files changed, until stop_event is set
+
+    Changes are debounced: a burst of files (e.g. a surfacing's logs) is handled in one run
+    DEBOUNCE_SECONDS after the last file, or MAX_DELAY_SECONDS after the first one.'''
+
+    if(stop_event is None):
+        stop_event = threading.Event()
+
+    # Watched directory: glider
+    directories = {}
+    for glider in gliders:
+        for subdir in ['logs', goto_dir]:
+            directory = '{}/{}/{}'.format(dataroot, glider, subdir)
+            if(os.path.isdir(directory)):
+                directories[directory] = glider
+
+    watcher = open_watcher(list(directories), poll)
+    print('{:%Y-%m-%d %H:%M:%S} Watching {} directories with {}'.format(datetime.now(), len(directories), type(watcher).__name__), flush=True)
+
+    def run_update(changed, first_change=None):
+        try:
+            new_surfacings = update_gliders(dataroot, changed, start_mission, current_pos_file, goto_dir, waypoints_file,
+                                            database=database)
+        except Exception:
+            # A failing update shouldn't stop the watcher, the files are read again on the next change
+            traceback.print_exc()
+            return
+        if(first_change is None):
+            print('{:%Y-%m-%d %H:%M:%S} {} new surfacings'.format(datetime.now(), new_surfacings), flush=True)
+        else:
+            print('{:%Y-%m-%d %H:%M:%S} {} new surfacings, {:.1f} s after the first change'.format(
+                  datetime.now(), new_surfacings, time.monotonic() - first_change), flush=True)
+
+    try:
+        # Files that came in while the watcher wasn't running
+        run_update(sorted(set(directories.values())))
+
+        while(not stop_event.is_set()):
+            # Short timeout so stop_event is noticed
+            changes = watcher.wait(1)
+            if(len(changes) == 0):
+                continue
+
+            first_change = time.monotonic()
+            changed = set()
+            while(len(changes) > 0):
+                changed.update(directories[directory] for directory, filename in changes
+                               if is_glider_file(directory, filename, goto_dir))
+                remaining = MAX_DELAY_SECONDS - (time.monotonic() - first_change)
+                if(remaining <= 0 or stop_event.is_set()):
+                    break
+                changes = watcher.wait(min(DEBOUNCE_SECONDS, remaining))
+
+            if(len(changed) > 0):
+                run_update(sorted(changed), first_change)
+    finally:
+        watcher.close()
+
+
+def main():
+    '''Update the glider JSONs as soon as new logs or goto files are written'''
+
+    args = [arg for arg in sys.argv[1:] if arg != '--poll' and not arg.startswith('--database=')]
+    dataroot = args[0]
+    start_missions_date = args[1]
+    gliders = args[2:] if len(args) > 2 else find_gliders(dataroot)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *args: stop_event.set())
+
+    watch_gliders(dataroot, gliders, start_missions_date, OLD_POSITIONS_FILE, 'archive', 'glider_waypoints.json',
+                  poll='--poll' in sys.argv, stop_event=stop_event, database=database_argument(sys.argv))
+
+if __name__ == "__main__":
+    main()
+
+    # python "./AIS Map/Glider Data Processing/watch_gliders.py" "./AIS Map/Map Data/Gliders" 20231108
+    # python "./AIS Map/Glider Data Processing/watch_gliders.py" "./AIS Map/Map Data/Gliders" 20231108 koskelo uivelo --poll
+    # python "./AIS Map/Glider Data Processing/watch_gliders.py" "./AIS Map/Map Data/Gliders" 20231108 --database="./AIS Map/Map Data/AIS.sqlite"
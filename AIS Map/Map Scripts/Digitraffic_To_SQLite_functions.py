@@ -2,16 +2,22 @@
 #         Imports           #
 #############################
 
+import os
+import json
+import codecs
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import numpy as np
 import sqlite3
-from math import floor
+from math import floor, nan
+from array import array
 from sqlite3 import Error
 from datetime import datetime, timedelta
 
-import geopandas as gpd
-from shapely.geometry import Polygon, Point
+from Metrics_functions import timed, timer, count, add_size
 
 # NOTE: Required downloads: 
 # UpdatedPub150.csv from https://msi.nga.mil/Publications/WPI 
@@ -27,6 +33,28 @@ from shapely.geometry import Polygon, Point
 
 HEADERS = {'Digitraffic-User': 'Foo/Bar'} 
 
+# Set DIGITRAFFIC_API_HOST to use another host, e.g. the replay server in ../Benchmarks 
+HOST = os.environ.get("DIGITRAFFIC_API_HOST", "https://meri.digitraffic.fi/api/ais/v1/")
+
+# Retry temporary errors (too many requests, server errors) with exponential backoff (0, 2, 4 s)
+# NOTE: Respects Retry-After headers, as requested in the guidelines above
+RETRY = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], 
+              allowed_methods=["GET"], raise_on_status=False)
+
+# Sessions reuse connections between calls (e.g. one call per mmsi in collect_specific_ships_locations),
+# kept per thread since jobs of the service (see ../Service) run in parallel
+thread_sessions = threading.local()
+
+def get_session():
+    '''Get the requests session of the current thread'''
+    if(not hasattr(thread_sessions, "session")):
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        session.mount("http://",  HTTPAdapter(max_retries=RETRY))
+        session.mount("https://", HTTPAdapter(max_retries=RETRY))
+        thread_sessions.session = session
+    return thread_sessions.session
+
 # /locations: 'Find latest vessel locations by mmsi and optional 
 #              timestamp interval in milliseconds from Unix epoch.'
 #   mmsi
@@ -43,44 +71,58 @@ HEADERS = {'Digitraffic-User': 'Foo/Bar'}
 
 # NOTE: Python timestamps in seconds, digitraffic in milliseconds
 
-def get_ships_meta(since):
-    '''Get the metadata of all ships since given timestamp'''
+def get_ships_meta(since, stream=False):
+    '''Get the metadata of all ships since given timestamp (the unread response if stream=True)'''
     # https://meri.digitraffic.fi/api/ais/v1/vessels
     
-    host = "https://meri.digitraffic.fi/api/ais/v1/"
+    host = HOST
     tag = "vessels"
     shipmeta_url = f'{host}{tag}?from={since}'
-    meta_response = requests.get(shipmeta_url, headers=HEADERS)
+    with timer("digitraffic_meta_fetch"):
+        meta_response = get_session().get(shipmeta_url, stream=stream)
+    if(stream):
+        # Payload size is counted while reading, see iter_json_array()
+        return meta_response
+    add_size("digitraffic_meta_payload", len(meta_response.content))
     return meta_response.json()
 
 def get_ship_meta(MMSI):
     '''Get the metadata of a ship with MMSI'''
     # https://meri.digitraffic.fi/api/ais/v1/vessels/338926878
 
-    host = "https://meri.digitraffic.fi/api/ais/v1/"
+    host = HOST
     tag = "vessels/"
     shipmeta_url = f'{host}{tag}{MMSI}'
-    meta_response = requests.get(shipmeta_url, headers=HEADERS)
+    with timer("digitraffic_ship_meta_fetch"):
+        meta_response = get_session().get(shipmeta_url)
+    add_size("digitraffic_ship_meta_payload", len(meta_response.content))
     return meta_response.json()
     
-def get_ships_locations(latitude, longitude, distance, since):
-    '''Get the location of ships close to lat/lon'''
+def get_ships_locations(latitude, longitude, distance, since, stream=False):
+    '''Get the location of ships close to lat/lon (the unread response if stream=True)'''
     # https://meri.digitraffic.fi/api/ais/v1/locations?from=1692184014&radius=20&latitude=59.837&longitude=23.29
     
-    host = "https://meri.digitraffic.fi/api/ais/v1/"
+    host = HOST
     tag = "locations"
     shiplocat_url = f'{host}{tag}?from={since}&radius={distance}&latitude={latitude}&longitude={longitude}'
-    locat_response = requests.get(shiplocat_url, headers=HEADERS)
+    with timer("digitraffic_locations_fetch"):
+        locat_response = get_session().get(shiplocat_url, stream=stream)
+    if(stream):
+        # Payload size is counted while reading, see iter_json_array()
+        return locat_response
+    add_size("digitraffic_locations_payload", len(locat_response.content))
     return locat_response.json()
 
 def get_ship_location(mmsi):
     '''Get the location of a ship with MMSI'''
     # https://meri.digitraffic.fi/api/ais/v1/locations?mmsi=338926878
     
-    host = "https://meri.digitraffic.fi/api/ais/v1/"
+    host = HOST
     tag = "locations"
     shiplocat_url = f'{host}{tag}?mmsi={mmsi}'
-    locat_response = requests.get(shiplocat_url, headers=HEADERS)
+    with timer("digitraffic_ship_location_fetch"):
+        locat_response = get_session().get(shiplocat_url)
+    add_size("digitraffic_ship_location_payload", len(locat_response.content))
     return locat_response.json()
 
 #############################
@@ -261,6 +303,7 @@ def add_missing_port_data(locodes):
 
     return locodes
 
+@timed()
 def load_port_data():
     '''Load UN locode data'''
     
@@ -331,6 +374,23 @@ def load_port_data():
  
     return locodes
 
+# Loaded port data and the modification time of the file it was loaded from,
+# so long running processes (see ../Service) only reload it when the file changes.
+# The Service's worker threads share it, the lock makes one of them load it and the others wait.
+port_data_cache = {}
+port_data_lock = threading.Lock()
+
+def get_port_data():
+    '''Load UN locode data once per process, returns a copy since matching modifies it'''
+    port_file_mtime = os.path.getmtime("../Map Data/Ports/code-list_csv.csv")
+
+    with port_data_lock:
+        if(port_data_cache.get("mtime") != port_file_mtime):
+            port_data_cache["locodes"] = load_port_data()
+            port_data_cache["mtime"] = port_file_mtime
+
+        return port_data_cache["locodes"].copy()
+
 def match_locodes(meta_df, locodes):
     '''Use regex to get valid locodes from destination column'''
     # Replace destination underscores with spaces for easier matching at word boundaries
@@ -521,26 +581,31 @@ def match_port_identifiers(meta_df, locodes):
 
     return meta_df
 
+@timed()
 def classify_regions(dataframe, latitude_column, longitude_column, region_column):
     '''Classify locations based on coordinates''' 
-    # NOTE: GeoPandas uses LonLat
+    # NOTE: Imported here so scripts that don't classify anything start faster
+    import shapely
+    from shapely.geometry import Polygon
+
+    # NOTE: Shapely uses LonLat
     bothnian_bay    = Polygon([[22,  66],  [25.6,65.9],[26,  65],  [22.5,63.1],[19.7,63.6]])
     bothnian_sea    = Polygon([[16.6,63],  [16.6,60.5],[18,  60.5],[21.5,60.7],[22.5,63.1],[19.7,63.6]])
     archipelago_sea = Polygon([[18,  60.5],[21.5,60.7],[23,  60.5],[23,  60],  [21.8,59.4],[18.6,59.7]])
     gulf_of_finland = Polygon([[23,  60],  [21.8,59.4],[23.5,58.8],[30.8,59.5],[29.5,61]])
     saimaa_laatokka = Polygon([[30.8,59.5],[29.5,61],  [26,  61],  [26,  63.5],[31,  63.5],[34,  60]])
 
-    locations_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(dataframe[longitude_column], 
-                                                                 dataframe[latitude_column]), 
-                                                                 crs="EPSG:4979")
+    # Test the coordinates directly instead of creating point geometries (and importing geopandas)
+    longitudes = dataframe[longitude_column].to_numpy(dtype=float)
+    latitudes = dataframe[latitude_column].to_numpy(dtype=float)
 
     dataframe[region_column] = "Baltic Sea"
 
-    dataframe.loc[locations_gdf.intersects(bothnian_bay),    region_column] = "Bothnian Bay"
-    dataframe.loc[locations_gdf.intersects(bothnian_sea),    region_column] = "Bothnian Sea"
-    dataframe.loc[locations_gdf.intersects(archipelago_sea), region_column] = "Archipelago Sea"
-    dataframe.loc[locations_gdf.intersects(gulf_of_finland), region_column] = "Gulf of Finland"
-    dataframe.loc[locations_gdf.intersects(saimaa_laatokka), region_column] = "Saimaa and Laatokka"
+    dataframe.loc[shapely.intersects_xy(bothnian_bay,    longitudes, latitudes), region_column] = "Bothnian Bay"
+    dataframe.loc[shapely.intersects_xy(bothnian_sea,    longitudes, latitudes), region_column] = "Bothnian Sea"
+    dataframe.loc[shapely.intersects_xy(archipelago_sea, longitudes, latitudes), region_column] = "Archipelago Sea"
+    dataframe.loc[shapely.intersects_xy(gulf_of_finland, longitudes, latitudes), region_column] = "Gulf of Finland"
+    dataframe.loc[shapely.intersects_xy(saimaa_laatokka, longitudes, latitudes), region_column] = "Saimaa and Laatokka"
     
     return dataframe
 
@@ -567,9 +632,10 @@ def classify_destination_regions(meta_df, regions):
 
     return meta_df
 
+@timed()
 def analyze_destinations(meta_df):
     '''Parse and edit destinations from ship metadata'''
-    locodes = load_port_data()
+    locodes = get_port_data()
     meta_df = match_port_identifiers(meta_df, locodes) # NOTE: Contains in-place editing of locodes-dataframe
 
     locodes = classify_regions(locodes, "Latitude", "Longitude", "PortLocation")
@@ -577,12 +643,42 @@ def analyze_destinations(meta_df):
                                                              "Location", 
                                                              "PortLocation"]].copy())
 
-    return meta_df
+    return apply_dtypes(meta_df, META_DTYPES)
 
  ###########################
 #     General processing    #
  ###########################
 
+# Compact dtypes of the locations and meta columns, applied when collecting and when loading (see apply_dtypes())
+# NOTE: Only where the values stay exactly the same:
+#       - float32 only for integer valued columns that can be NA (exact up to 2**24), 
+#         sog, cog, coordinates and draught stay float64 as float32 would change the stored and shown values
+#       - Categories for the regions, which have a handful of values (destinations are free text)
+#       - Timestamps stay int64
+LOCATION_DTYPES = {"navStat":    "int8", 
+                   "rot":        "float32", 
+                   "posAcc":     "bool", 
+                   "heading":    "float32", 
+                   "shipRegion": "category"}
+META_DTYPES = {"shipType":               "int16", 
+               "destinationOneRegion":   "category", 
+               "destinationTwoRegion":   "category", 
+               "destinationThreeRegion": "category"}
+
+def apply_dtypes(df, dtypes):
+    '''Convert columns to compact dtypes, columns not in the dataframe are skipped
+
+       Integer and bool columns with missing values (e.g. meta of ships without metadata after a join) become float32'''
+
+    for column, dtype in dtypes.items():
+        if(column not in df.columns):
+            continue
+        if(dtype != "category" and np.dtype(dtype).kind in "iub" and df[column].isna().any()):
+            dtype = "float32"
+        df[column] = df[column].astype(dtype)
+
+    return df
+
 def next_year(dt):
         '''Set datetime one year ahead'''
         
@@ -633,42 +729,155 @@ def eta_to_datetime(eta):
 
     return eta_datetime
 
-def collect_ships_locations(latitude, longitude, distance, since):
-    '''Collect ships' location data into a dataframe from given location, distance and time'''
+def etas_to_datetimes(etas, now=None):
+    '''Convert a column of digitraffic AIS ETAs to datetimes, vectorized version of eta_to_datetime()
 
-    # NOTE: Python timestamps in seconds, digitraffic in milliseconds
-    current_timestamp = floor(datetime.now().timestamp()*1000)
-    
-    ship_collection = get_ships_locations(latitude, longitude, distance, since)
-    ships = ship_collection["features"]
+       Invalid or not available ETAs become NaT. now can be given for testing the year rollover'''
 
-    ''' Example:
-    ... 'features': ...
-    'geometry': {'type': 'Point', 'coordinates': [22.949432, 59.821617]},
-    'properties': {'mmsi': 209955000,
-    'sog': 0.0,
-    'cog': 57.2,
-    'navStat': 5,
-    'rot': 0,
-    'posAcc': False,
-    'raim': False,
-    'heading': 258,
-    'timestamp': 43,
-    'timestampExternal': 1692345778776}'''
-    
-    ship_dict = [dict(ship['properties'], 
-                     **{'longitude':ship['geometry']['coordinates'][0], 
-                        'latitude' :ship['geometry']['coordinates'][1]}) 
-                for ship in ships]
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
 
-    df = pd.DataFrame.from_dict(ship_dict)
+    etas = pd.to_numeric(pd.Series(etas), errors="coerce")
+    valid = (etas.notna() & (etas != 1596)).to_numpy() # All default / not available (00/00 24:60 MM/DD HH:MM)
+    eta_bits = etas.fillna(1596).to_numpy(dtype=np.int64)
+
+    # Same bits as in eta_to_datetime()
+    eta_min = (eta_bits         & 0x3F) % 60 # Set default/NA to 0 for datetime conversion
+    eta_hr  = ((eta_bits >>  6) & 0x1F) % 24 # Set default/NA to 0 for datetime conversion
+    eta_day =  (eta_bits >> 11) & 0x1F
+    eta_mth =  (eta_bits >> 16) & 0x0F
+
+    valid &= (eta_mth != 0) & (eta_day != 0)
+    eta_mth = np.where(valid, eta_mth, 13) # Makes the rows already known to be invalid NaT below
+
+    def assemble(year):
+        # Bad dates (e.g. 31st September) become NaT
+        return pd.to_datetime(pd.DataFrame({"year": year, "month": eta_mth, "day": eta_day,
+                                            "hour": eta_hr, "minute": eta_min}, index=etas.index), errors="coerce")
+
+    eta_datetimes = assemble(now.year)
+
+    # Simple check if ETA is e.g. from this year's December to next year's January
+    # February 29th in a leap year becomes NaT next year, add 365 days instead (like next_year())
+    rollover = eta_datetimes < now - pd.Timedelta(days=180)
+    if(rollover.any()):
+        next_year_datetimes = assemble(now.year + 1)
+        next_year_datetimes = next_year_datetimes.fillna(eta_datetimes + pd.Timedelta(days=365))
+        eta_datetimes = eta_datetimes.where(~rollover, next_year_datetimes)
+
+    return eta_datetimes
+
+def iter_response_text(response, size_name=None, chunk_size=2**16):
+    '''Read a streamed response as decoded text chunks, counting the payload size'''
+    # Incremental decoder so multi-byte characters split between chunks decode correctly
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if(size_name is not None):
+            add_size(size_name, len(chunk))
+        yield utf8_decoder.decode(chunk)
+    yield utf8_decoder.decode(b"", final=True)
+
+def iter_json_array(response, key=None, size_name=None, chunk_size=2**16):
+    '''Decode the items of a JSON array from a streamed response one at a time
+
+       The array is either the whole response (/vessels) or the value of key in the
+       top-level object ("features" of /locations). Only the unread part of the
+       response and the current item are held in memory at a time.'''
+
+    decoder = json.JSONDecoder()
+    texts = iter_response_text(response, size_name, chunk_size)
+    buffer = ""
+    position = None
+
+    # Find the start of the array
+    while(position is None):
+        text = next(texts, None)
+        if(text is None):
+            raise ValueError(f"No {key or 'JSON'} array in response: {buffer[:200]}")
+        buffer += text
+
+        key_index = 0 if key is None else buffer.find(f'"{key}"')
+        if(key_index >= 0):
+            array_index = buffer.find("[", key_index)
+            if(array_index >= 0):
+                position = array_index + 1
+
+    while(True):
+        # Skip whitespace and separators between items
+        while(position < len(buffer) and buffer[position] in " \t\r\n,"):
+            position += 1
+
+        if(position < len(buffer) and buffer[position] == "]"):
+            return
+
+        try:
+            if(position == len(buffer)):
+                raise json.JSONDecodeError("Array continues in next chunk", buffer, position)
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Item continues in the next chunk (or the response is broken)
+            text = next(texts, None)
+            if(text is None):
+                raise
+            buffer = buffer[position:] + text
+            position = 0
+            continue
+
+        yield item
+
+# Typed columns filled while streaming (array typecodes: b/h/q = int8/16/64, f/d = float32/64, B = bool, U = list of str)
+# Already in the compact dtypes of LOCATION_DTYPES and META_DTYPES
+# NOTE: sog, cog and coordinates stay float64, float32 would change the stored values (e.g. sog 12.3 -> 12.300000190734863)
+LOCATION_COLUMN_TYPES = {"mmsi": "q", "sog": "d", "cog": "d", "navStat": "b", "rot": "f", 
+                         "posAcc": "B", "heading": "f", "timestampExternal": "q", 
+                         "longitude": "d", "latitude": "d"}
+META_COLUMN_TYPES = {"name": "U", "timestamp": "q", "mmsi": "q", "callSign": "U", 
+                     "shipType": "h", "draught": "d", "eta": "q", "destination": "U"}
+
+def new_columns(column_types):
+    '''Empty typed columns'''
+    return {column: ([] if typecode == "U" else array(typecode)) 
+            for column, typecode in column_types.items()}
+
+def append_row(columns, row):
+    '''Append a decoded JSON object to typed columns, other fields are skipped
+
+       Missing (null) values are NaN and None like with .json(), 
+       an integer or bool column with one becomes float64 (apply_dtypes() makes it float32 where compact)'''
+    for column, values in columns.items():
+        value = row.get(column)
+        if(value is None and isinstance(values, array)):
+            value = nan
+            if(values.typecode not in "fd"):
+                values = columns[column] = array("d", values)
+        values.append(value)
+
+def append_location_feature(columns, feature):
+    '''Append a /locations feature (properties and coordinates) to typed columns'''
+    properties = feature["properties"]
+    properties["longitude"], properties["latitude"] = feature["geometry"]["coordinates"][:2]
+    append_row(columns, properties)
+
+def columns_to_df(columns):
+    '''Dataframe from typed columns'''
+    data = {}
+    for column, values in columns.items():
+        if(not isinstance(values, array)):
+            data[column] = np.asarray(values, dtype=object)
+        elif(values.typecode == "B"):
+            data[column] = np.frombuffer(values, dtype=bool)
+        else:
+            data[column] = np.frombuffer(values, dtype=values.typecode)
+    return pd.DataFrame(data)
+
+def format_ships_locations(columns, current_timestamp):
+    '''Format typed /locations columns for the locations table'''
+
+    df = columns_to_df(columns)
     df['locAPICallTimestamp'] = current_timestamp
 
-    # Remove unnecessary columns:
-    # Receiver autonomous integrity monitoring (RAIM) flag of electronic position fixing device
-    # The second within the minute data was reported
-    df = df.drop(["raim", "timestamp"], axis=1)
-    
+    # Receiver autonomous integrity monitoring (RAIM) flag and 
+    # the second within the minute data was reported are not collected (see LOCATION_COLUMN_TYPES)
+
     # Rename timestamp column to a more descriptive name for merging tables later
     df = df.rename(columns={"timestampExternal": "locUpdateTimestamp"})
 
@@ -679,18 +888,17 @@ def collect_ships_locations(latitude, longitude, distance, since):
                      'heading': 511}, np.nan)
     
     df = classify_regions(df, "latitude", "longitude", "shipRegion")
+    df = apply_dtypes(df, LOCATION_DTYPES)
+    count("locations_collected", len(df))
 
     return df
 
-def collect_specific_ships_locations(mmsi_list):
-    '''Collect ships' location data into a dataframe from given list of mmsis'''
+@timed()
+def collect_ships_locations(latitude, longitude, distance, since):
+    '''Collect ships' location data into a dataframe from given location, distance and time'''
+
     # NOTE: Python timestamps in seconds, digitraffic in milliseconds
     current_timestamp = floor(datetime.now().timestamp()*1000)
-    
-    ships = []
-    for mmsi in mmsi_list:
-        ship_collection = get_ship_location(mmsi)
-        ships += ship_collection["features"]
 
     ''' Example:
     ... 'features': ...
@@ -705,42 +913,39 @@ def collect_specific_ships_locations(mmsi_list):
     'heading': 258,
     'timestamp': 43,
     'timestampExternal': 1692345778776}'''
-    
-    ship_dict = [dict(ship['properties'], 
-                     **{'longitude':ship['geometry']['coordinates'][0], 
-                        'latitude' :ship['geometry']['coordinates'][1]}) 
-                for ship in ships]
 
-    df = pd.DataFrame.from_dict(ship_dict)
-    df['locAPICallTimestamp'] = current_timestamp
-
-    # Remove unnecessary columns:
-    # Receiver autonomous integrity monitoring (RAIM) flag of electronic position fixing device
-    # The second within the minute data was reported
+    # Decode the features one by one straight into typed columns 
+    # instead of loading the whole response and a dict per ship
+    columns = new_columns(LOCATION_COLUMN_TYPES)
+    with get_ships_locations(latitude, longitude, distance, since, stream=True) as response:
+        with timer("digitraffic_locations_parse"):
+            for feature in iter_json_array(response, "features", "digitraffic_locations_payload"):
+                append_location_feature(columns, feature)
 
-    df = df.drop(["raim", "timestamp"], axis=1)
-    
-    # Rename timestamp column to a more descriptive name for merging tables later
-    df = df.rename(columns={"timestampExternal": "locUpdateTimestamp"})
+    return format_ships_locations(columns, current_timestamp)
 
-    # Replace default / not available values with NAs
-    df = df.replace({'sog': 102.3, 
-                     'cog': 360, 
-                     'rot': -128, 
-                     'heading': 511}, np.nan)
+@timed()
+def collect_specific_ships_locations(mmsi_list):
+    '''Collect ships' location data into a dataframe from given list of mmsis'''
+    # NOTE: Python timestamps in seconds, digitraffic in milliseconds
+    current_timestamp = floor(datetime.now().timestamp()*1000)
     
-    df = classify_regions(df, "latitude", "longitude", "shipRegion")
+    # Example in collect_ships_locations()
+    columns = new_columns(LOCATION_COLUMN_TYPES)
+    for mmsi in mmsi_list:
+        ship_collection = get_ship_location(mmsi)
+        for feature in ship_collection["features"]:
+            append_location_feature(columns, feature)
 
-    return df
+    return format_ships_locations(columns, current_timestamp)
 
+@timed()
 def collect_ships_meta(since):
     '''Collect ships' metadata into a dataframe since given time'''
 
     # NOTE: Python timestamps in seconds, digitraffic in milliseconds
     current_timestamp = floor(datetime.now().timestamp()*1000)
     
-    ships = get_ships_meta(since)
-
     ''' Example:
     {'name': 'JOHANNA HELENA',
     'timestamp': 1692414605620,
@@ -757,9 +962,24 @@ def collect_ships_meta(since):
     'referencePointD': 8,
     'destination': 'SE OXE'}'''
 
-    df = pd.DataFrame.from_dict(ships)
+    # Decode the ships one by one straight into typed columns, the unused fields are skipped
+    columns = new_columns(META_COLUMN_TYPES)
+    with get_ships_meta(since, stream=True) as response:
+        with timer("digitraffic_meta_parse"):
+            for ship in iter_json_array(response, size_name="digitraffic_meta_payload"):
+                append_row(columns, ship)
+
+    df = columns_to_df(columns)
     df['metaAPICallTimestamp'] = current_timestamp
 
+    df = format_ships_meta(df)
+    count("meta_collected", len(df))
+
+    return df
+
+def format_ships_meta(df):
+    '''Format raw digitraffic metadata for the meta table'''
+
     # Remove unnecessary columns:
     # Vessel International Maritime Organization (IMO) number
     # Type of electronic position fixing device (GPS, GLONASS, etc.)
@@ -768,9 +988,10 @@ def collect_ships_meta(since):
     # NOTE: MMSI changes with e.g. nationality, whereas IMO is static. 
     #       We use MMSI because so does digitraffic
 
+    # (not collected at all when streaming, see META_COLUMN_TYPES)
     df = df.drop(["imo", "posType",
                   "referencePointA", "referencePointB",
-                  "referencePointC", "referencePointD"], axis=1)
+                  "referencePointC", "referencePointD"], axis=1, errors="ignore")
 
     # Replace default / not available values with NAs
     df = df.replace({'draught': 0}, np.nan)
@@ -783,7 +1004,39 @@ def collect_ships_meta(since):
     cutoff_timestamp = floor(cutoff.timestamp()*1000)
     # Set ETA for metadata updated over a month ago to NA
     df.loc[(df["metaUpdateTimestamp"] < cutoff_timestamp), "eta"] = 1596
-    df["eta"] = df["eta"].apply(eta_to_datetime)
+    df["eta"] = etas_to_datetimes(df["eta"])
+
+    return apply_dtypes(df, META_DTYPES)
+
+@timed()
+def collect_specific_ships_meta(mmsi_list):
+    '''Collect metadata of given mmsis into a dataframe, ships without metadata are left out
+
+       A failed request (e.g. out of retries, or an error page instead of JSON) only leaves out that ship'''
+
+    # NOTE: Python timestamps in seconds, digitraffic in milliseconds
+    current_timestamp = floor(datetime.now().timestamp()*1000)
+
+    ships = []
+    for mmsi in mmsi_list:
+        try:
+            ship = get_ship_meta(mmsi)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Couldn't get metadata for {mmsi}: {e}")
+            count("meta_fetch_errors")
+            continue
+        # Unknown mmsis return an error message instead
+        if("mmsi" in ship):
+            ships.append(ship)
+
+    if(len(ships) == 0):
+        return pd.DataFrame()
+
+    df = pd.DataFrame.from_dict(ships)
+    df['metaAPICallTimestamp'] = current_timestamp
+
+    df = format_ships_meta(df)
+    count("meta_collected", len(df))
 
     return df
 
@@ -802,11 +1055,13 @@ def create_connection(db_file):
     
     return conn
 
+@timed()
 def append_table(db_connection, dataframe, table):
     '''Append a dataframe to a database table'''
 
     if db_connection is not None:
         dataframe.to_sql(table, db_connection, if_exists="append", index=False)
+        count(f"{table}_rows_appended", len(dataframe))
     else:
         print("Error! cannot create the database connection.")
 
@@ -818,27 +1073,111 @@ def drop_table(db_connection, table):
     cursor.execute(f'DROP TABLE {table}')
     db_connection.commit()
 
+@timed()
 def delete_duplicate_rows(db_connection, table, columns):
     '''Delete duplicate rows from a database table'''
 
     sql_command = f'DELETE FROM {table} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY {columns})'
     sql_cursor = db_connection.cursor()
     sql_cursor.execute(sql_command)
+    count(f"{table}_duplicates_deleted", sql_cursor.rowcount)
     db_connection.commit()
 
+@timed()
+def sqlite_rows(dataframe):
+    '''Rows of a dataframe as Python values for sqlite3, like to_sql() writes them (NaN and NaT as NULL, datetimes as ISO strings)'''
+    columns = []
+    for column in dataframe.columns:
+        values = dataframe[column]
+        if(values.dtype.kind == "M"):
+            values = values.map(lambda value: value.isoformat(" "), na_action="ignore")
+        columns.append(values.astype(object).where(values.notna(), None))
+    return zip(*columns)
+
+def append_unique(db_connection, dataframe, table, key_columns, commit=True):
+    '''Append rows to a table in one transaction, skipping rows whose key already is in the table
+
+       Replaces append_table() + delete_duplicate_rows(), which scans the whole table on every call.
+       With commit=False the caller commits, e.g. together with update_current_threats()'''
+
+    # Simply create the table (no rows yet) if it doesn't exist
+    try:
+        dataframe.head(0).to_sql(table, db_connection, if_exists="fail", index=False)
+    except ValueError:
+        pass
+
+    create_unique_index(db_connection, table, key_columns)
+
+    # Stage the rows in a temp table (like upsert_meta()), only seen by this connection
+    columns_string = ", ".join(dataframe.columns)
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute(f"DROP TABLE IF EXISTS temp.temp_{table}")
+    sql_cursor.execute(f"CREATE TEMP TABLE temp_{table} AS SELECT {columns_string} FROM main.{table} LIMIT 0")
+    placeholders = ", ".join("?" for _ in dataframe.columns)
+    sql_cursor.executemany(f"INSERT INTO temp.temp_{table} VALUES ({placeholders})", sqlite_rows(dataframe))
+
+    sql_cursor.execute(f"INSERT OR IGNORE INTO main.{table} ({columns_string}) SELECT {columns_string} FROM temp.temp_{table}")
+    count(f"{table}_rows_appended", sql_cursor.rowcount)
+    count(f"{table}_duplicates_skipped", len(dataframe) - sql_cursor.rowcount)
+    sql_cursor.execute(f"DROP TABLE temp.temp_{table}")
+    if(commit):
+        db_connection.commit()
+
+def create_unique_index(db_connection, table, key_columns):
+    '''Create a unique index on the key columns of a table, if it doesn't exist yet
+
+       Duplicate keys already in the table (e.g. from before the index) are deleted first, keeping the earliest row'''
+
+    index = f"{table}_unique_key"
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,))
+    if(sql_cursor.fetchone() is not None):
+        return
+
+    key_string = ", ".join(key_columns)
+    delete_duplicate_rows(db_connection, table, key_string)
+    sql_cursor.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({key_string})")
+    db_connection.commit()
+
+@timed()
 def delete_old(db_connection, table, column, timestamp):
     '''Delete rows from a database table with updatetime < given time'''
 
     sql_command = f'DELETE FROM {table} WHERE {column} < {timestamp}'
     sql_cursor = db_connection.cursor()
     sql_cursor.execute(sql_command)
+    count(f"{table}_old_deleted", sql_cursor.rowcount)
+    db_connection.commit()
+
+def create_location_indexes(db_connection):
+    '''Create the indexes used for loading ship locations and paths, if they don't exist yet'''
+
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("CREATE INDEX IF NOT EXISTS locations_update_time ON locations (locUpdateTimestamp)")
+    sql_cursor.execute("CREATE INDEX IF NOT EXISTS locations_mmsi_update_time ON locations (mmsi, locUpdateTimestamp)")
+    db_connection.commit()
+
+def create_threat_indexes(db_connection):
+    '''Create the index used for finding a glider's threats by time (e.g. mission end cleanup), if it doesn't exist yet'''
+
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("CREATE INDEX IF NOT EXISTS threats_glider_api_call_time ON threats (glider_name, locAPICallTimestamp)")
     db_connection.commit()
 
+@timed()
 def update_meta_table(db_connection, since): # TODO: In-depth QA
     '''Update database meta table with with data since last update'''
     meta_df = collect_ships_meta(since)
     meta_df = analyze_destinations(meta_df)
 
+    upsert_meta(db_connection, meta_df)
+
+    # Bulk update may have found ships waiting in the backfill queue
+    remove_found_from_meta_queue(db_connection)
+
+def upsert_meta(db_connection, meta_df):
+    '''Update rows of the meta table by mmsi and insert rows for new mmsis'''
+
     # Simply create a table if one doesn't exist
     try:
         meta_df.to_sql("meta", db_connection, if_exists="fail", index=False)
@@ -878,6 +1217,79 @@ def update_meta_table(db_connection, since): # TODO: In-depth QA
     cursor.execute("DROP TABLE temp")
     db_connection.commit()
 
+#############################
+#   Metadata backfill queue #
+#############################
+
+# Ships drawn on the map without metadata are queued here instead of updating the metadata
+# while drawing the map (see check_missing_meta() in Draw_Map_functions.py).
+# The queue is emptied by backfill_meta.py / the Service, or the next update_meta.py run.
+
+def create_meta_queue(db_connection):
+    '''Create the metadata backfill queue table if it doesn't exist'''
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("CREATE TABLE IF NOT EXISTS meta_queue "
+                       "(mmsi INTEGER PRIMARY KEY, queuedTimestamp INTEGER, attempts INTEGER DEFAULT 0)")
+    db_connection.commit()
+
+def queue_missing_meta(db_connection, mmsi_list):
+    '''Add mmsis to the metadata backfill queue, already queued ones are kept as is'''
+    create_meta_queue(db_connection)
+
+    queued_timestamp = floor(datetime.now().timestamp()*1000)
+    sql_cursor = db_connection.cursor()
+    sql_cursor.executemany("INSERT OR IGNORE INTO meta_queue (mmsi, queuedTimestamp) VALUES (?, ?)",
+                           [(int(mmsi), queued_timestamp) for mmsi in mmsi_list])
+    db_connection.commit()
+    count("meta_queued", sql_cursor.rowcount)
+
+def remove_found_from_meta_queue(db_connection):
+    '''Remove queued mmsis that now have metadata'''
+    create_meta_queue(db_connection)
+
+    sql_cursor = db_connection.cursor()
+    # The meta table is created by the first metadata update, before that nothing has been found
+    sql_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'")
+    if(sql_cursor.fetchone() is None):
+        return
+
+    sql_cursor.execute("DELETE FROM meta_queue WHERE mmsi IN (SELECT mmsi FROM meta)")
+    db_connection.commit()
+
+@timed()
+def backfill_meta_queue(db_connection, max_ships=100, max_attempts=12):
+    '''Get metadata for queued mmsis one by one (digitraffic /vessels/mmsi), returns number of ships found
+
+       Ships still without metadata are retried on the next run, up to max_attempts times'''
+    create_meta_queue(db_connection)
+    remove_found_from_meta_queue(db_connection)
+
+    query = f"SELECT mmsi FROM meta_queue ORDER BY attempts, queuedTimestamp LIMIT {int(max_ships)}"
+    mmsi_list = pd.read_sql_query(query, db_connection)["mmsi"].tolist()
+    if(len(mmsi_list) == 0):
+        return 0
+
+    found = 0
+    try:
+        meta_df = collect_specific_ships_meta(mmsi_list)
+        if(not meta_df.empty):
+            meta_df = analyze_destinations(meta_df)
+            upsert_meta(db_connection, meta_df)
+
+        remove_found_from_meta_queue(db_connection)
+        found = len(meta_df)
+    finally:
+        # Counted even if the run failed, so a ship that always fails can't hold the head of the queue.
+        # Give up on ships that never seem to broadcast their metadata
+        sql_cursor = db_connection.cursor()
+        sql_cursor.executemany("UPDATE meta_queue SET attempts = attempts + 1 WHERE mmsi = ?",
+                               [(int(mmsi),) for mmsi in mmsi_list])
+        sql_cursor.execute("DELETE FROM meta_queue WHERE attempts >= ?", (int(max_attempts),))
+        db_connection.commit()
+
+    count("meta_backfilled", found)
+    return found
+
 def get_latest_meta_update_timestamp(db_connection):
     '''Get the latest update timestamp from meta table'''
     query = ("SELECT MAX(metaUpdateTimestamp) from meta")
@@ -891,14 +1303,65 @@ def get_latest_meta_update_timestamp(db_connection):
 
 def get_recent_threat_mmsi_list(db_connection, recency_cutoff_timestamp):
     '''Get the mmsis of ships recently classified as threats'''
+
+    # Latest classification time of each ship is kept in current_threats, 
+    # so this is a range scan instead of going through the whole threats history
+    create_current_threats(db_connection)
+
+    query = ("SELECT mmsi FROM current_threats "
+             "WHERE locAPICallTimestamp > ? "
+             "ORDER BY mmsi")
     
-    query = ("SELECT mmsi FROM (" 
-                "SELECT *, ROW_NUMBER() OVER(PARTITION BY mmsi ORDER BY locAPICallTimestamp DESC) AS rownum FROM threats"
-            ") latest_threats "
-            "WHERE latest_threats.rownum = 1 "
-            f" AND locAPICallTimestamp > {recency_cutoff_timestamp}")                    
-    
-    mmsi_list = pd.read_sql_query(query, db_connection)
+    mmsi_list = pd.read_sql_query(query, db_connection, params=(recency_cutoff_timestamp,))
     mmsi_list = mmsi_list["mmsi"].tolist()
 
-    return mmsi_list
\ No newline at end of file
+    return mmsi_list
+
+def create_current_threats(db_connection):
+    '''Create the current_threats table (latest threat classification time per ship) if it doesn't exist yet'''
+
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'current_threats'")
+    if(sql_cursor.fetchone() is not None):
+        return
+
+    sql_cursor.execute("CREATE TABLE current_threats (mmsi INTEGER PRIMARY KEY, locAPICallTimestamp INTEGER)")
+    sql_cursor.execute("CREATE INDEX current_threats_api_call_time ON current_threats (locAPICallTimestamp)")
+    db_connection.commit()
+
+    # Fill from existing threats (e.g. databases from before this table)
+    rebuild_current_threats(db_connection)
+
+def rebuild_current_threats(db_connection):
+    '''Recreate current_threats from the threats table, e.g. after deleting threats
+
+       Commits, also changes made before the call (the rebuild is in the same transaction as e.g. the delete)'''
+
+    sql_cursor = db_connection.cursor()
+    sql_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'current_threats'")
+    # Without the table there is nothing to rebuild, it's created (and filled) on first use
+    if(sql_cursor.fetchone() is not None):
+        sql_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'threats'")
+        has_threats = sql_cursor.fetchone() is not None
+
+        sql_cursor.execute("DELETE FROM current_threats")
+        if(has_threats):
+            sql_cursor.execute("INSERT INTO current_threats (mmsi, locAPICallTimestamp) "
+                               "SELECT mmsi, MAX(locAPICallTimestamp) FROM threats GROUP BY mmsi")
+    db_connection.commit()
+
+def update_current_threats(db_connection, threats_df):
+    '''Update the latest threat classification times of ships with newly written threats
+
+       Commits, also the threats written before the call with append_unique(..., commit=False)'''
+
+    create_current_threats(db_connection)
+
+    latest = threats_df.groupby("mmsi")["locAPICallTimestamp"].max()
+    rows = [(int(mmsi), int(timestamp)) for mmsi, timestamp in latest.items()]
+
+    sql_cursor = db_connection.cursor()
+    sql_cursor.executemany("INSERT INTO current_threats (mmsi, locAPICallTimestamp) VALUES (?, ?) "
+                           "ON CONFLICT(mmsi) DO UPDATE SET locAPICallTimestamp = "
+                           "MAX(locAPICallTimestamp, excluded.locAPICallTimestamp)", rows)
+    db_connection.commit()
\ No newline at end of file
@@ -5,24 +5,43 @@ from datetime import datetime, timedelta
 
 import requests
 import json
-
-import folium
-import folium.plugins as plugins
-import altair as alt
-from branca.element import Template, MacroElement
+import hashlib
 
 import math
 import numpy as np
-
-import geopandas as gpd
-from shapely.geometry import Polygon, LineString, Point
+import os
+import sys
 
 from urllib.error import HTTPError
 
-from Digitraffic_To_SQLite_functions import (update_meta_table, 
-                                             get_latest_meta_update_timestamp, 
-                                             classify_regions, 
-                                             append_table, delete_duplicate_rows)
+from Digitraffic_To_SQLite_functions import (queue_missing_meta, 
+                                             classify_regions, create_location_indexes,
+                                             append_unique, update_current_threats,
+                                             apply_dtypes, LOCATION_DTYPES, META_DTYPES)
+from Metrics_functions import timed, timer, count
+
+# The glider position store is shared with the glider data processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Glider Data Processing"))
+from glider_positions import read_index, read_position_columns
+from glider_plans import plan_at
+from glider_forecast import update_forecast, forecast, FORECAST_SENSORS
+
+# NOTE: The heavy libraries are imported only where they're needed to keep startup fast:
+#       folium and branca in load_map_libraries() when drawing a map, 
+#       geopandas and shapely when processing ships, altair when creating glider charts
+folium = None
+plugins = None
+Template = None
+MacroElement = None
+
+def load_map_libraries():
+    '''Import the map drawing libraries on first use'''
+    global folium, plugins, Template, MacroElement
+
+    if(folium is None):
+        import folium
+        import folium.plugins as plugins
+        from branca.element import Template, MacroElement
 
 #############################
 #    Database interaction   #
@@ -40,64 +59,77 @@ def create_connection(db_file):
     return conn
 
 def check_missing_meta(db_connection, ships_df):
-    '''Check if any metadata is missing and update if necessary'''
+    '''Queue ships with missing metadata for backfilling'''
+    # NOTE: Metadata isn't fetched here so drawing the map isn't held up by it, 
+    #       the ships are drawn with placeholders until backfill_meta.py or update_meta.py has run
 
     no_meta = ships_df["metaUpdateTimestamp"].isna()
     if(any(no_meta)):
-        no_meta_ships = ships_df[no_meta.values]["mmsi"]
-        no_meta_ships_string = ", ".join(no_meta_ships.apply(str))
+        queue_missing_meta(db_connection, ships_df.loc[no_meta, "mmsi"])
+        print(f"Metadata missing for {no_meta.sum()} ships, queued for backfill")
 
-        # Update meta table from API
-        update_meta_table(db_connection, get_latest_meta_update_timestamp(db_connection))
+    return ships_df
 
-        # Query missing metadata
-        query = f"SELECT * FROM meta WHERE mmsi IN ({no_meta_ships_string})"
-        meta_df = pd.read_sql_query(query, db_connection)
+def load_ship_paths(db_connection, since, path_since):
+    '''Load the previous paths (after path_since) of ships that had an update after since, returns a Series of
+       [[lat, lon], ...] lists indexed by mmsi'''
 
-        if(meta_df.empty):
-            print("Some metadata still missing after update, try again later")
-            return ships_df
+    # Only the needed columns, already in path order
+    query = ("SELECT mmsi, latitude, longitude FROM locations "
+            f"WHERE locUpdateTimestamp > {path_since} "
+                "AND mmsi IN "
+                    "(SELECT mmsi FROM locations "
+                   f"WHERE locUpdateTimestamp > {since}) "
+            "ORDER BY mmsi, locUpdateTimestamp, rowid")
 
-        # Make mmsi into the index for updating
-        meta_df.set_index('mmsi', inplace = True)
-        ships_df.set_index('mmsi', inplace = True)
+    paths_df = pd.read_sql_query(query, db_connection)
+    count("path_rows_loaded", len(paths_df))
 
-        # Fill missing data
-        ships_df.update(meta_df)
+    if(paths_df.empty):
+        return pd.Series(dtype=object)
 
-        # Make mmsi into a column again
-        ships_df.reset_index(inplace = True)
+    # Each position only once per ship (e.g. while moored)
+    paths_df = paths_df[~paths_df.duplicated()]
 
-    return ships_df
+    mmsis = paths_df["mmsi"].to_numpy()
+    coords = paths_df[["latitude", "longitude"]].to_numpy()
 
+    # Rows are sorted by mmsi, so each ship's path is between consecutive split indices
+    split_indices = np.flatnonzero(mmsis[1:] != mmsis[:-1]) + 1
+    ship_mmsis = mmsis[np.concatenate(([0], split_indices))]
+    ship_paths = [path.tolist() for path in np.split(coords, split_indices)]
+
+    return pd.Series(ship_paths, index=ship_mmsis, dtype=object)
+
+@timed()
 def load_data(db_connection, since):
     '''Load and merge data from a SQLite database into a dataframe'''
 
     # Set limit for previous path length from current time
     path_since = since - timedelta(hours=3).seconds*1000
 
-    # Query data after path_since for ships that had an update after since
-    query = ("SELECT * FROM locations "
-            "LEFT JOIN meta ON locations.mmsi = meta.mmsi "
-            f"WHERE locations.mmsi IN "
-                "(SELECT mmsi from locations "
-               f"WHERE locUpdateTimestamp > {since}) "
-            f"AND locUpdateTimestamp > {path_since}")
+    create_location_indexes(db_connection)
+
+    # Latest location of each ship that had an update after since
+    # NOTE: Ties (same update from several API calls) go to the earliest API call (lowest rowid)
+    query = ("SELECT * FROM ("
+                "SELECT *, ROW_NUMBER() OVER(PARTITION BY mmsi ORDER BY locUpdateTimestamp DESC, rowid) AS rownum "
+               f"FROM locations WHERE locUpdateTimestamp > {since}"
+            ") latest_locations "
+            "LEFT JOIN meta ON latest_locations.mmsi = meta.mmsi "
+            "WHERE latest_locations.rownum = 1 "
+            "ORDER BY latest_locations.mmsi")
 
     ships_df = pd.read_sql_query(query, db_connection)
+    count("latest_location_rows_loaded", len(ships_df))
 
     ships_df = ships_df.loc[:,~ships_df.columns.duplicated()] # If mmsi column duplicates from missing values in meta, drop the extra column    
+    ships_df = ships_df.drop(columns=["rownum"])
+    ships_df = ships_df.drop_duplicates(subset="mmsi", ignore_index=True) # In case meta has several rows for a ship
 
-    # Create a column for the path in a new dataframe
-    ship_paths_df = ships_df[["mmsi", "latitude", "longitude"]].copy()
-    ship_paths_df.drop_duplicates(inplace = True)
-    ship_paths_df["coords"] = ship_paths_df[["latitude", "longitude"]].values.tolist()
-    ship_paths_df = ship_paths_df.groupby("mmsi").apply(lambda row: list(row["coords"]), include_groups=False).reset_index()
-    ship_paths_df.rename(columns = {0: "path"}, inplace = True)
-
-    # Take only latest location and add path column
-    ships_df = ships_df.loc[ships_df.groupby(["mmsi"])["locUpdateTimestamp"].idxmax()]
-    ships_df = ships_df.merge(ship_paths_df, how='left')
+    # Add previous paths
+    ship_paths = load_ship_paths(db_connection, since, path_since)
+    ships_df["path"] = ships_df["mmsi"].map(ship_paths)
 
     # Check for missing metadata and add it if necessary
     ships_df = check_missing_meta(db_connection, ships_df)
@@ -110,10 +142,17 @@ def load_data(db_connection, since):
     # ships_df = ships_df.drop(["metaUpdateTimestamp", "locUpdateTimestamp", "rownum"], axis=1)
     ships_df = ships_df.drop(["metaUpdateTimestamp", "locUpdateTimestamp"], axis=1)
 
+    # Same compact dtypes as when collecting (SQLite only has integers, floats and text)
+    ships_df = apply_dtypes(ships_df, LOCATION_DTYPES)
+    ships_df = apply_dtypes(ships_df, META_DTYPES)
+
     return ships_df
 
-def save_dangerous_ship_data(ships_df, glider_name, glider_latest_loc, db_connection):
-    '''Update SQLite database with dangerous ship data'''
+# A ship's reported location classified for a glider is saved once (the first classification is kept)
+THREATS_KEY = ["mmsi", "glider_name", "locUpdatetime", "locAPICallTimestamp"]
+
+def get_dangerous_ship_data(ships_df, glider_name, glider_latest_loc):
+    '''Get the rows of ships dangerous to a glider for the threats table'''
 
     # TODO: Consider if:
     #       We should convert time back to timestamp for database interaction
@@ -141,12 +180,22 @@ def save_dangerous_ship_data(ships_df, glider_name, glider_latest_loc, db_connec
         dangerous_ships['glider_name'] = glider_name
         dangerous_ships['glider_latest_lat'] = glider_latest_loc[0]
         dangerous_ships['glider_latest_lon'] = glider_latest_loc[1]
-        dangerous_ships.drop(columns=['path', 'range', 'tooltip_html', 'threat_class', 'max_threat_class'], inplace=True)
+        dangerous_ships.drop(columns=['path', 'predicted_path', 'range', 'tooltip_html', 'threat_class', 'max_threat_class'], inplace=True)
 
-        append_table(db_connection, dangerous_ships, "threats")
-        delete_duplicate_rows(db_connection, "threats", ", ".join(list(dangerous_ships.columns)))
+    return dangerous_ships
 
-    return
+@timed()
+def save_dangerous_ship_data(dangerous_ships_list, db_connection):
+    '''Update SQLite database with dangerous ship data of all gliders in one batch'''
+
+    dangerous_ships_list = [dangerous_ships for dangerous_ships in dangerous_ships_list if not dangerous_ships.empty]
+    if(len(dangerous_ships_list) == 0):
+        return
+
+    dangerous_ships = pd.concat(dangerous_ships_list, ignore_index=True)
+    # Threats and their latest times in current_threats are committed together
+    append_unique(db_connection, dangerous_ships, "threats", THREATS_KEY, commit=False)
+    update_current_threats(db_connection, dangerous_ships)
 
 #############################
 #  Glider data interaction  #
@@ -175,40 +224,50 @@ def read_json(file):
         f.close()
     return(data)
 
-def load_glider_sensors(interesting_sensors):
-    '''Read data from glider'''
+def load_glider_sensors(interesting_sensors, start=None, end=None):
+    '''Read data from glider, surfacings with start <= datetime <= end ("2023-11-13T09:34:18Z") if given
 
-    pathData = read_json('../Map Data/Gliders/JSONs/current_positions.json')
-    glider_names = list(pathData.keys())
+    Only the given sensors are read, straight into one column each for all gliders.'''
 
-    gliders_df = pd.DataFrame()
-    for glider_name in glider_names:
-        glider_df = pd.DataFrame.from_dict(pathData[glider_name])
-        glider_df["glider_name"] = str.capitalize(glider_name)
-        gliders_df = pd.concat([gliders_df, glider_df], ignore_index=True)
-    
-    if(gliders_df.empty):
-        return None, gliders_df, interesting_sensors
-
-    gliders_df["datetime"] = pd.to_datetime(gliders_df["datetime"], format='%Y-%m-%dT%H:%M:%SZ')
+    positions_dir = '../Map Data/Gliders/JSONs/positions'
+    glider_names = list(read_index(positions_dir).keys())
 
-    # Explode nested dicts into columns
-    gliders_df = gliders_df.join(pd.DataFrame(gliders_df.pop('location').values.tolist()))
-
-    sensors_df = pd.DataFrame(gliders_df.pop('sensors').values.tolist())
-    
-    # Use only sensors also in dataframe:
-    interesting_sensors = list(set(sensors_df.columns).intersection(set(interesting_sensors)))
-
-    sensors_df = sensors_df[interesting_sensors]
-    gliders_df = gliders_df.join(sensors_df)
+    columns = {}
+    names = []
+    for glider_name in glider_names:
+        glider_columns = read_position_columns(positions_dir, glider_name, interesting_sensors, start, end)
+        for column, values in glider_columns.items():
+            columns.setdefault(column, []).extend(values)
+        names += [str.capitalize(glider_name)]*len(glider_columns["datetime"])
+
+    if(len(names) == 0):
+        return None, pd.DataFrame(), interesting_sensors
+
+    # Use only sensors some glider has
+    interesting_sensors = [sensor for sensor in interesting_sensors 
+                           if any(value is not None for value in columns[sensor])]
+
+    gliders_df = pd.DataFrame({"mission_name": columns["mission_name"],
+                               "mission_num":  columns["mission_num"],
+                               # Parsed by numpy without the "Z", much faster than pd.to_datetime() with a format
+                               "datetime":     np.array([time[:-1] for time in columns["datetime"]], dtype="datetime64[s]").astype("datetime64[ns]"),
+                               "glider_name":  names,
+                               "latitude":     np.array(columns["latitude"], dtype=float),
+                               "longitude":    np.array(columns["longitude"], dtype=float)})
+    for sensor in interesting_sensors:
+        # Missing values as NaN
+        gliders_df[sensor] = np.array(columns[sensor], dtype=float)
 
     return glider_names, gliders_df, interesting_sensors
 
-def load_glider_waypoints(glider_names, gliders_latest_loc):
-    '''Read waypoint plan data'''
+def load_glider_waypoints(glider_names, gliders_latest_loc, at=None):
+    '''Read waypoint plan data, the current plans or the plans in force at given time (e.g. for replaying threats)'''
 
-    glider_waypoints = read_json('../Map Data/Gliders/JSONs/glider_waypoints.json')
+    if(at is None):
+        glider_waypoints = read_json('../Map Data/Gliders/JSONs/glider_waypoints.json')
+    else:
+        plans = {glider_name: plan_at('../Map Data/Gliders/JSONs/plans', glider_name, at) for glider_name in glider_names}
+        glider_waypoints = {glider_name: plan['waypoints'] for glider_name, plan in plans.items() if plan is not None}
     wpt_glider_names = list(glider_waypoints.keys())
     gliders_wpt_df = pd.DataFrame()
     
@@ -229,15 +288,16 @@ def load_glider_waypoints(glider_names, gliders_latest_loc):
     return gliders_wpt_df
     
 
-def load_glider_data():
-    ''' Load glider data and reformat for map drawing'''
+@timed()
+def load_glider_data(start=None):
+    ''' Load glider data and reformat for map drawing, surfacings since start ("2023-11-13T09:34:18Z") if given'''
 
     interesting_sensors = ["m_battery", 
                     "m_coulomb_amphr_total", 
                     "m_digifin_leakdetect_reading", 
                     "m_lithium_battery_relative_charge"]
 
-    glider_names, gliders_df, interesting_sensors = load_glider_sensors(interesting_sensors)
+    glider_names, gliders_df, interesting_sensors = load_glider_sensors(interesting_sensors, start)
 
     if (gliders_df.empty):
         return None, interesting_sensors
@@ -279,6 +339,22 @@ def haversine_distance(point1, point2):
     distance = R * c
     return distance
 
+def haversine_distances(latitudes, longitudes, points):
+    '''Haversine distances between each coordinate and each point (ships x points matrix), vectorized haversine_distance()'''
+
+    R = 6373.0
+    lat1 = np.radians(np.asarray(latitudes,  dtype=float))[:, np.newaxis]
+    lon1 = np.radians(np.asarray(longitudes, dtype=float))[:, np.newaxis]
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    lat2 = np.radians(points[:, 0])[np.newaxis, :]
+    lon2 = np.radians(points[:, 1])[np.newaxis, :]
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = (np.sin(dlat/2))**2 + np.cos(lat1) * np.cos(lat2) * (np.sin(dlon/2))**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    distance = R * c
+    return distance
+
 def get_endpoint(lat1,lon1,bearing,dist):
     '''Find end point with start coordinates, bearing & distance'''
     
@@ -339,6 +415,114 @@ def get_path(coords, sog, cog, rot):
 
     return path, radius
 
+#############################
+#    Ship render caching    #
+#############################
+
+def get_glider_state_key(glider_data, vip_ships):
+    '''Hash glider positions, plans and VIP ships to detect when all ships need reclassifying'''
+
+    if(glider_data == None):
+        state = {"vip_ships": sorted(vip_ships)}
+    else:
+        latest_loc = glider_data["gliders_latest_loc"][["glider_name", "latitude", "longitude"]]
+        wpts = glider_data["gliders_wpt_df"][["glider_name", "latitude", "longitude"]]
+        state = {"latest_loc": latest_loc.values.tolist(),
+                 "waypoints":  wpts.values.tolist(),
+                 "regions":    glider_data["gliders_regions"].values.tolist(),
+                 "vip_ships":  sorted(vip_ships)}
+
+    return hashlib.sha1(json.dumps(state, default=str).encode()).hexdigest()
+
+def get_ship_cache_keys(ships_df):
+    '''Get the columns identifying an unchanged ship between runs'''
+    # NaT (e.g. missing metadata) becomes the smallest int64, which is still a stable key
+    keys = pd.DataFrame({"mmsi": ships_df["mmsi"].values})
+    keys["locUpdateTimestamp"]  = ships_df["locUpdatetime"].values.astype("datetime64[ms]").astype("int64")
+    keys["metaUpdateTimestamp"] = ships_df["metaUpdatetime"].values.astype("datetime64[ms]").astype("int64")
+    keys.index = ships_df.index
+
+    return keys
+
+def split_cached_ships(db_connection, ships_df, glider_state):
+    '''Split ships into those that need processing and those with valid cached data'''
+
+    query = ("SELECT mmsi, locUpdateTimestamp, metaUpdateTimestamp, "
+             "predicted_path, range, tooltip_html, max_class_colour "
+             "FROM ship_render_cache WHERE glider_state = ?")
+    try:
+        cache_df = pd.read_sql_query(query, db_connection, params=(glider_state,))
+    except pd.errors.DatabaseError: # No cache table yet
+        return ships_df, ships_df.iloc[0:0]
+
+    keys = get_ship_cache_keys(ships_df)
+    keys = keys.reset_index().merge(cache_df, how="left", 
+                                    on=["mmsi", "locUpdateTimestamp", "metaUpdateTimestamp"])
+    keys.set_index("index", inplace=True)
+    keys.index.name = None
+
+    is_cached = keys["tooltip_html"].notna()
+
+    cached_ships_df = ships_df.loc[is_cached].copy()
+    cached_ships_df["predicted_path"]   = keys.loc[is_cached, "predicted_path"].apply(json.loads)
+    cached_ships_df["range"]            = keys.loc[is_cached, "range"]
+    cached_ships_df["tooltip_html"]     = keys.loc[is_cached, "tooltip_html"]
+    cached_ships_df["max_class_colour"] = keys.loc[is_cached, "max_class_colour"]
+
+    return ships_df.loc[~is_cached].copy(), cached_ships_df
+
+def save_ship_cache(db_connection, ships_df, glider_state):
+    '''Save derived ship data so unchanged ships can be reused on the next run'''
+
+    cache_df = get_ship_cache_keys(ships_df)
+    cache_df["predicted_path"]   = ships_df["predicted_path"].apply(json.dumps)
+    cache_df["range"]            = ships_df["range"]
+    cache_df["tooltip_html"]     = ships_df["tooltip_html"]
+    cache_df["max_class_colour"] = ships_df["max_class_colour"] if "max_class_colour" in ships_df else None
+    cache_df["glider_state"]     = glider_state
+
+    # Only the latest run is ever needed, so simply replace the previous cache
+    cache_df.to_sql("ship_render_cache", db_connection, if_exists="replace", index=False)
+
+def merge_cached_ships(ships_df, cached_ships_df, db_connection, glider_state):
+    '''Combine processed and cached ships, update the cache and finalize paths for drawing'''
+
+    print(f"Reused {len(cached_ships_df)} of {len(ships_df) + len(cached_ships_df)} ships from the previous map")
+    count("ships_processed", len(ships_df))
+    count("ships_reused", len(cached_ships_df))
+
+    ships_df = pd.concat([ships_df, cached_ships_df], ignore_index=True)
+    save_ship_cache(db_connection, ships_df, glider_state)
+
+    ships_df['path'] = ships_df['path'] + ships_df['predicted_path']
+    ships_df.drop(columns=['predicted_path'], inplace=True)
+
+    # After creating tooltips but before creating markers we want to fill NAs
+    ships_df[['cog', 'sog']] = ships_df[['cog', 'sog']].fillna(0) 
+
+    return ships_df
+
+def encode_path(coords, precision=5):
+    '''Encode [lat, lon] coordinates into a Google encoded polyline string'''
+    # https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+    # Precision 5 is ~1 m, decoded in the browser by decodePath in add_on_click_functionality
+    points = np.asarray(coords, dtype=float).reshape(-1, 2)
+    points = points[~np.isnan(points).any(axis=1)] # Leaflet can't draw NaN coordinates anyway
+
+    # Quantize and delta-encode, then zigzag so negative deltas stay small
+    values = np.round(points*10**precision).astype(np.int64)
+    values = np.diff(values, axis=0, prepend=0).ravel()
+    values = np.where(values < 0, ~(values << 1), values << 1)
+
+    # Split each value into 5-bit chunks (max 7 for 35 bits), with 0x20 marking that more chunks follow
+    shifts = 5*np.arange(7)
+    chunks = (values[:, np.newaxis] >> shifts) & 0x1F
+    num_chunks = 1 + ((values[:, np.newaxis] >> shifts[1:]) > 0).sum(axis=1)
+    chunks |= 0x20*(np.arange(7) < (num_chunks - 1)[:, np.newaxis])
+    used_chunks = np.arange(7) < num_chunks[:, np.newaxis]
+
+    return (chunks[used_chunks] + 63).astype(np.uint8).tobytes().decode("ascii")
+
 #############################
 #    Ship data processing   #
 #############################
@@ -372,19 +556,33 @@ def translate_ship_types(ships_df):
     
     return ships_df
 
-def process_no_gliders_ship_data(ships_df):
+@timed()
+def process_no_gliders_ship_data(ships_df, vip_ships, db_connection):
     '''Prepare data for drawing ship markers when there are no active gliders'''
 
+    # Only process ships that changed since the previous map
+    glider_state = get_glider_state_key(None, vip_ships)
+    ships_df, cached_ships_df = split_cached_ships(db_connection, ships_df, glider_state)
+
+    if(not ships_df.empty):
+        ships_df = process_changed_no_gliders_ship_data(ships_df)
+
+    return merge_cached_ships(ships_df, cached_ships_df, db_connection, glider_state)
+
+def process_changed_no_gliders_ship_data(ships_df):
+    '''Predict paths and create tooltips for ships when there are no active gliders'''
+    import geopandas as gpd
+
     # Predict ship movement
     # NOTE: GeoPandas uses LonLat, so all intersect checks have to as well
     # ships_df[['path', 'range']]  = ships_df.apply(lambda row: get_path([row['latitude'],row['longitude']],row['sog'],row['cog'],row['rot']), axis=1, result_type='expand')
-    ships_df[['predicted_path', 'range']]  = ships_df.apply(lambda row: get_path([row['latitude'],row['longitude']],row['sog'],row['cog'],row['rot']), axis=1, result_type='expand')
-    ships_df['path'] = ships_df['path'] + ships_df['predicted_path']
-    ships_df.drop(columns=['predicted_path'], inplace=True)
-    ship_ranges = gpd.GeoDataFrame(ships_df, geometry=gpd.points_from_xy(ships_df.longitude, ships_df.latitude), crs="EPSG:4979") # Map projection units in degrees
-    ship_ranges = ship_ranges.to_crs("EPSG:3857")         # Map projection units in meters for setting circle radius
-    ship_ranges = ship_ranges.buffer(ships_df['range'])
-    ship_ranges = ship_ranges.to_crs("EPSG:4979")         # Map projection units in degrees for testing intersection
+    with timer("get_path"):
+        ships_df[['predicted_path', 'range']]  = ships_df.apply(lambda row: get_path([row['latitude'],row['longitude']],row['sog'],row['cog'],row['rot']), axis=1, result_type='expand')
+    with timer("buffer_ship_ranges"):
+        ship_ranges = gpd.GeoDataFrame(ships_df, geometry=gpd.points_from_xy(ships_df.longitude, ships_df.latitude), crs="EPSG:4979") # Map projection units in degrees
+        ship_ranges = ship_ranges.to_crs("EPSG:3857")         # Map projection units in meters for setting circle radius
+        ship_ranges = ship_ranges.buffer(ships_df['range'])
+        ship_ranges = ship_ranges.to_crs("EPSG:4979")         # Map projection units in degrees for testing intersection
 
     # Translate ship type to string
     ships_df = translate_ship_types(ships_df)
@@ -394,7 +592,7 @@ def process_no_gliders_ship_data(ships_df):
 
     ships_df['tooltip_html'] = ships_df.apply(lambda ship: '</span></p><p style="text-align:left;">'.join(
             ['<p style="text-align:left;"> ' + 
-             'Name: <span style="float:right;">'          + ship['name'],
+             'Name: <span style="float:right;">'          + (ship['name'] if pd.notna(ship['metaUpdatetime']) else "Metadata pending"),
              'Callsign: <span style="float:right;">'      + ship['callSign'],
              'Ship type: <span style="float:right;">'     + ship['shipTypeString'],
              'Draught (m): <span style="float:right;">'   + str(ship['draught']/10).replace('nan',''),
@@ -405,99 +603,123 @@ def process_no_gliders_ship_data(ships_df):
              'ETA: <span style="float:right;">'           + ship['eta'].replace('T',' '),
              'Last updated: <span style="float:right;">'  + ship['locUpdatetime'].strftime("%Y-%m-%d %H:%M:%S").replace('NaT','') + 
              "</p>"]), axis=1)
-
-    # After creating tooltips but before creating markers we want to fill NAs
-    ships_df[['cog', 'sog']] = ships_df[['cog', 'sog']].fillna(0) 
     
     return ships_df
 
-def classify_ships(ships_df, ship_ranges, vip_ships, glider_latest_loc, glider_regions, glider_wpt_line):
-    '''Classify ships based on threat'''
+REGION_COLUMNS = ['shipRegion', 'destinationOneRegion', 'destinationTwoRegion', 'destinationThreeRegion']
+DESTINATION_REGION_COLUMNS = REGION_COLUMNS[1:]
+
+# Ships going through glider regions: (glider region, ship regions, destination regions)
+# e.g. a ship in the Baltic Sea heading to the Bothnian Bay passes through the Bothnian Sea
+THROUGH_REGION_RULES = [("Bothnian Sea",    ["Baltic Sea", "Archipelago Sea", "Gulf of Finland", "Saimaa and Laatokka"], ["Bothnian Bay"]),
+                        ("Bothnian Sea",    ["Bothnian Bay"], ["Baltic Sea", "Archipelago Sea", "Gulf of Finland", "Saimaa and Laatokka"]),
+                        ("Archipelago Sea", ["Baltic Sea", "Gulf of Finland", "Saimaa and Laatokka"], ["Bothnian Bay", "Bothnian Sea"]),
+                        ("Archipelago Sea", ["Bothnian Bay", "Bothnian Sea"], ["Baltic Sea", "Gulf of Finland", "Saimaa and Laatokka"]),
+                        ("Gulf of Finland", ["Saimaa and Laatokka"], ["Baltic Sea", "Archipelago Sea", "Bothnian Bay", "Bothnian Sea"]),
+                        ("Gulf of Finland", ["Baltic Sea", "Archipelago Sea", "Bothnian Bay", "Bothnian Sea"], ["Saimaa and Laatokka"])]
+
+def classify_region_sharing_ships(ships_df, gliders_regions_list):
+    '''Ships in - or with destination in or through - the regions of each glider (ships x gliders matrix)'''
+
+    regions = sorted({region for glider_regions in gliders_regions_list for region in glider_regions} | 
+                     {region for _, ship_regions, destination_regions in THROUGH_REGION_RULES 
+                             for region in ship_regions + destination_regions})
+
+    # Ships x regions: in the region, or with a destination in it
+    in_region = np.column_stack([ships_df['shipRegion'].isin([region]).to_numpy() for region in regions])
+    destination_in_region = np.column_stack([ships_df[DESTINATION_REGION_COLUMNS].isin([region]).any(axis=1).to_numpy() 
+                                             for region in regions])
+
+    # Regions x gliders
+    glider_in_region = np.array([[region in glider_regions for glider_regions in gliders_regions_list] for region in regions])
+
+    region_sharing = (in_region | destination_in_region).astype(int) @ glider_in_region.astype(int) > 0
+
+    # Ships x rules and rules x gliders
+    region_index = {region: index for index, region in enumerate(regions)}
+    going_through = np.column_stack([in_region[:, [region_index[region] for region in ship_regions]].any(axis=1) &
+                                     destination_in_region[:, [region_index[region] for region in destination_regions]].any(axis=1)
+                                     for _, ship_regions, destination_regions in THROUGH_REGION_RULES])
+    rule_applies = np.array([[glider_region in glider_regions for glider_regions in gliders_regions_list]
+                             for glider_region, _, _ in THROUGH_REGION_RULES])
+
+    return region_sharing | (going_through.astype(int) @ rule_applies.astype(int) > 0)
+
+@timed()
+def classify_ships(ships_df, ship_ranges, vip_ships, gliders_latest_locs, gliders_regions_list, gliders_wpt_lines):
+    '''Classify ships based on threat to all gliders at once
+
+       Returns the threat classes and distances from the gliders (km) as ships x gliders matrices'''
+
+    import geopandas as gpd
+
+    num_ships, num_gliders = len(ships_df), len(gliders_wpt_lines)
+
+    distances = haversine_distances(ships_df['latitude'], ships_df['longitude'], gliders_latest_locs)
 
-    ships_df['distance_from_glider'] = ships_df.apply(lambda ship: haversine_distance([ship['latitude'],ship['longitude']], glider_latest_loc), axis=1)
+    # Ships whose range intersects each glider's plan, one spatial index query for all plans
+    glider_index, ship_index = ship_ranges.sindex.query(gpd.GeoSeries(gliders_wpt_lines, crs=ship_ranges.crs), predicate="intersects")
+    intersects_plan = np.zeros((num_ships, num_gliders), dtype=bool)
+    intersects_plan[ship_index, glider_index] = True
 
+    ship_range = ships_df['range'].to_numpy(dtype=float)[:, np.newaxis]
+    has_range = ship_range > 0
+
+    # Later classes override earlier ones
     # Default/unclassified
-    ships_df['threat_class'] = 0
-
-    # Ships in - or with destination in - the same region as glider
-    ships_df.loc[ships_df[['shipRegion', 
-                          'destinationOneRegion', 
-                          'destinationTwoRegion', 
-                          'destinationThreeRegion']].isin(glider_regions).any(axis=1), "threat_class"] = 1
-
-    # Check for ships going through glider regions
-    if("Bothnian Sea" in glider_regions):
-        ships_df.loc[(ships_df['shipRegion'].isin(["Baltic Sea", "Archipelago Sea", "Gulf of Finland", "Saimaa and Laatokka"])) & 
-                     (ships_df[['destinationOneRegion', 
-                                'destinationTwoRegion', 
-                                'destinationThreeRegion']].isin(["Bothnian Bay"]).any(axis=1)), 
-                    "threat_class"] = 1
-        ships_df.loc[(ships_df['shipRegion'].isin(["Bothnian Bay"])) & 
-                     (ships_df[['destinationOneRegion', 
-                                'destinationTwoRegion', 
-                                'destinationThreeRegion']].isin(["Baltic Sea", "Archipelago Sea", "Gulf of Finland", "Saimaa and Laatokka"]).any(axis=1)), 
-                    "threat_class"] = 1
-    
-    if("Archipelago Sea" in glider_regions):
-        ships_df.loc[(ships_df['shipRegion'].isin(["Baltic Sea", "Gulf of Finland", "Saimaa and Laatokka"])) & 
-                     (ships_df[['destinationOneRegion', 
-                                'destinationTwoRegion', 
-                                'destinationThreeRegion']].isin(["Bothnian Bay", "Bothnian Sea"]).any(axis=1)), 
-                    "threat_class"] = 1
-        ships_df.loc[(ships_df['shipRegion'].isin(["Bothnian Bay", "Bothnian Sea"])) & 
-                     (ships_df[['destinationOneRegion', 
-                                'destinationTwoRegion', 
-                                'destinationThreeRegion']].isin(["Baltic Sea", "Gulf of Finland", "Saimaa and Laatokka"]).any(axis=1)), 
-                    "threat_class"] = 1
-        
-    if("Gulf of Finland" in glider_regions):
-        ships_df.loc[(ships_df['shipRegion'].isin(["Saimaa and Laatokka"])) & 
-                     (ships_df[['destinationOneRegion', 
-                                'destinationTwoRegion', 
-                                'destinationThreeRegion']].isin(["Baltic Sea", "Archipelago Sea", "Bothnian Bay", "Bothnian Sea"]).any(axis=1)), 
-                    "threat_class"] = 1
-        ships_df.loc[(ships_df['shipRegion'].isin(["Baltic Sea", "Archipelago Sea", "Bothnian Bay", "Bothnian Sea"])) & 
-                     (ships_df[['destinationOneRegion', 
-                                'destinationTwoRegion', 
-                                'destinationThreeRegion']].isin(["Saimaa and Laatokka"]).any(axis=1)), 
-                    "threat_class"] = 1
+    threat_classes = np.zeros((num_ships, num_gliders), dtype=np.int64)
+
+    # Ships in - or with destination in - the same region as glider, or going through it
+    threat_classes[classify_region_sharing_ships(ships_df, gliders_regions_list)] = 1
 
     # Ships that intersect glider plan
     # TODO: Consider marking only those that also don't intersect past path?
     #       dangerous with sharp turns though...
-    ships_df.loc[(ships_df['range'] > 0) & (ship_ranges.intersects(glider_wpt_line)), "threat_class"] = 2
+    threat_classes[has_range & intersects_plan] = 2
 
     # Ships whose range intersects glider's location
-    ships_df.loc[(ships_df['range'] > 0) & (ships_df['distance_from_glider']*1000 < ships_df['range']), "threat_class"] = 3
+    threat_classes[has_range & (distances*1000 < ship_range)] = 3
 
     # Stationary ships
-    ships_df.loc[(ships_df['sog'] == 0), "threat_class"] = 4
+    threat_classes[(ships_df['sog'] == 0).to_numpy(), :] = 4
 
     # Ships within 10km
-    ships_df.loc[(ships_df['distance_from_glider'] < 10), "threat_class"] = 5
+    threat_classes[distances < 10] = 5
 
     # VIP ships
-    ships_df.loc[(ships_df['mmsi'].isin(vip_ships)), "threat_class"] = 99
+    threat_classes[ships_df['mmsi'].isin(vip_ships).to_numpy(), :] = 99
 
-    # Save the highest threat class so far for map drawing
-    ships_df.loc[(ships_df['max_threat_class'] < ships_df['threat_class']), 
-                 "max_threat_class"] = ships_df['threat_class']
-    
-    return ships_df
+    return threat_classes, distances
 
+@timed()
 def process_ship_data(ships_df, glider_data, vip_ships, db_connection):
     '''Prepare data for drawing ship markers'''
 
+    # Only process ships that changed since the previous map, 
+    # or all of them if glider locations or plans changed
+    glider_state = get_glider_state_key(glider_data, vip_ships)
+    ships_df, cached_ships_df = split_cached_ships(db_connection, ships_df, glider_state)
+
+    if(not ships_df.empty):
+        ships_df = process_changed_ship_data(ships_df, glider_data, vip_ships, db_connection)
+
+    return merge_cached_ships(ships_df, cached_ships_df, db_connection, glider_state)
+
+def process_changed_ship_data(ships_df, glider_data, vip_ships, db_connection):
+    '''Predict paths, create tooltips and classify ships'''
+    import geopandas as gpd
+    from shapely.geometry import LineString, Point
+
     # Predict ship movement
     # NOTE: GeoPandas uses LonLat, so all intersect checks have to as well
     # ships_df[['path', 'range']]  = ships_df.apply(lambda row: get_path([row['latitude'],row['longitude']],row['sog'],row['cog'],row['rot']), axis=1, result_type='expand')
-    ships_df[['predicted_path', 'range']]  = ships_df.apply(lambda row: get_path([row['latitude'],row['longitude']],row['sog'],row['cog'],row['rot']), axis=1, result_type='expand')
-    ships_df['path'] = ships_df['path'] + ships_df['predicted_path']
-    ships_df.drop(columns=['predicted_path'], inplace=True)
-    ship_ranges = gpd.GeoDataFrame(ships_df, geometry=gpd.points_from_xy(ships_df.longitude, ships_df.latitude), crs="EPSG:4326") # Map projection units in degrees
-    ship_ranges = ship_ranges.to_crs("EPSG:32634")         # Map projection units in meters for setting circle radius
-    ship_ranges = ship_ranges.buffer(ships_df['range'])
-    ship_ranges = ship_ranges.to_crs("EPSG:4326")         # Map projection units in degrees for testing intersection
+    with timer("get_path"):
+        ships_df[['predicted_path', 'range']]  = ships_df.apply(lambda row: get_path([row['latitude'],row['longitude']],row['sog'],row['cog'],row['rot']), axis=1, result_type='expand')
+    with timer("buffer_ship_ranges"):
+        ship_ranges = gpd.GeoDataFrame(ships_df, geometry=gpd.points_from_xy(ships_df.longitude, ships_df.latitude), crs="EPSG:4326") # Map projection units in degrees
+        ship_ranges = ship_ranges.to_crs("EPSG:32634")         # Map projection units in meters for setting circle radius
+        ship_ranges = ship_ranges.buffer(ships_df['range'])
+        ship_ranges = ship_ranges.to_crs("EPSG:4326")         # Map projection units in degrees for testing intersection
 
     # Unpack glider_data dict for readability
     glider_names       = glider_data["glider_names"]
@@ -513,7 +735,7 @@ def process_ship_data(ships_df, glider_data, vip_ships, db_connection):
 
     ships_df['tooltip_html'] = ships_df.apply(lambda ship: '</span></p><p style="text-align:left;">'.join(
             ['<p style="text-align:left;"> ' + 
-             'Name: <span style="float:right;">'          + ship['name'],
+             'Name: <span style="float:right;">'          + (ship['name'] if pd.notna(ship['metaUpdatetime']) else "Metadata pending"),
              'Callsign: <span style="float:right;">'      + ship['callSign'],
              'Ship type: <span style="float:right;">'     + ship['shipTypeString'],
              'Draught (m): <span style="float:right;">'   + str(ship['draught']/10).replace('nan',''),
@@ -525,11 +747,12 @@ def process_ship_data(ships_df, glider_data, vip_ships, db_connection):
              'Last updated: <span style="float:right;">'  + ship['locUpdatetime'].strftime("%Y-%m-%d %H:%M:%S").replace('NaT','') + 
              "</p>"]), axis=1)
 
-    ships_df['max_threat_class'] = 0
-
+    gliders_latest_locs  = []
+    gliders_regions_list = []
+    gliders_wpt_lines    = []
     for glider_name in glider_names:
-        glider_latest_loc = gliders_latest_loc[["latitude","longitude"]].loc[gliders_latest_loc["glider_name"] == glider_name].values.tolist()[0]
-        glider_regions = list(gliders_regions["glider_region"].loc[gliders_regions["glider_name"] == glider_name])
+        gliders_latest_locs.append(gliders_latest_loc[["latitude","longitude"]].loc[gliders_latest_loc["glider_name"] == glider_name].values.tolist()[0])
+        gliders_regions_list.append(list(gliders_regions["glider_region"].loc[gliders_regions["glider_name"] == glider_name]))
         glider_wpt_df = gliders_wpt_df.loc[gliders_wpt_df["glider_name"] == glider_name]
 
         # NOTE: GeoPandas uses LonLat, so all intersect checks have to as well
@@ -538,11 +761,22 @@ def process_ship_data(ships_df, glider_data, vip_ships, db_connection):
             glider_wpt_line = LineString(glider_wpt_line)
         else:
             glider_wpt_line = Point(glider_wpt_line)
+        gliders_wpt_lines.append(glider_wpt_line)
 
-        ships_df = classify_ships(ships_df, ship_ranges, vip_ships, glider_latest_loc, glider_regions, glider_wpt_line)
-        
-        # Write dangerous ships into a sqlite table
-        save_dangerous_ship_data(ships_df, glider_name, glider_latest_loc, db_connection)
+    threat_classes, distances = classify_ships(ships_df, ship_ranges, vip_ships, 
+                                               gliders_latest_locs, gliders_regions_list, gliders_wpt_lines)
+
+    # Save the highest threat class for map drawing
+    ships_df['max_threat_class'] = threat_classes.max(axis=1, initial=0)
+
+    # Collect dangerous ships of each glider, written into a sqlite table in one batch
+    dangerous_ships_list = []
+    for glider_number, glider_name in enumerate(glider_names):
+        ships_df['distance_from_glider'] = distances[:, glider_number]
+        ships_df['threat_class'] = threat_classes[:, glider_number]
+        dangerous_ships_list.append(get_dangerous_ship_data(ships_df, glider_name, gliders_latest_locs[glider_number]))
+
+    save_dangerous_ship_data(dangerous_ships_list, db_connection)
 
     # Set the colours we want to draw the markers with
     ships_df["max_class_colour"] = "#8ED6FF"
@@ -562,14 +796,13 @@ def process_ship_data(ships_df, glider_data, vip_ships, db_connection):
     # Drop now unnecessary classification columns
     ships_df.drop(columns=['threat_class', 'max_threat_class'], inplace=True)
 
-    # After creating tooltips but before creating markers we want to fill NAs
-    ships_df[['cog', 'sog']] = ships_df[['cog', 'sog']].fillna(0) 
     return ships_df
 
 #############################
 #        Map drawing        #
 #############################
 
+@timed()
 def add_no_gliders_ship_markers(map, ships_df, vip_ships):
     '''Add markers for ships on the map when there are no active gliders'''
 
@@ -590,7 +823,7 @@ def add_no_gliders_ship_markers(map, ships_df, vip_ships):
         iframe = folium.IFrame(html=ship.tooltip_html, width=300, height=350)
         popup = folium.Popup(html=iframe, max_width=300)
         marker = plugins.BoatMarker([ship.latitude, ship.longitude], popup=popup, color=color,
-                                     heading=ship.cog, pathCoords=ship.path, circleRadius=ship.range)
+                                     heading=ship.cog, encodedPath=encode_path(ship.path), circleRadius=round(ship.range))
         if(ship.mmsi in vip_ships):
             marker.add_to(vip_ship_layer)
         elif(ship.shipRegion == "Bothnian Bay"):
@@ -628,12 +861,14 @@ def add_on_click_functionality(map):
     '''Edit javascript to add on-click events to ship markers'''
 
     # Modify Marker template to include the onClick event
+    # The rendered script gets parsed as a template again, so the options are wrapped in a raw block
+    # to keep "{{" in encoded paths from being read as template syntax
     
     click_template = """
                     {% macro script(this, kwargs) %}
                         var {{ this.get_name() }} = L.boatMarker(
                             {{ this.location|tojson }},
-                            {{ this.options|tojson }}
+                            {{ '{% raw %}' }}{{ this.options|tojson }}{{ '{% endraw %}' }}
                         ).addTo({{ this._parent.get_name() }}).on('click', onClick).on('dblclick', onDblClick);
                         {% if this.wind_heading is not none -%}
                         {{ this.get_name() }}.setHeadingWind(
@@ -654,9 +889,32 @@ def add_on_click_functionality(map):
 
     # Extensions of circle and polyline are used here so they can be removed on click without 
     # removing all circles and polylines (glider paths and ranges)
-    click_js = f"""function onClick(e) {{                
+    click_js = f"""function decodePath(encoded) {{
+                    // Decode a Google encoded polyline (precision 5) made by encode_path
+                    var coords = [];
+                    var index = 0, lat = 0, lng = 0;
+
+                    while (index < encoded.length) {{
+                        var delta = [0, 0];
+                        for (var i = 0; i < 2; i++) {{
+                            var result = 0, shift = 0, b;
+                            do {{
+                                b = encoded.charCodeAt(index++) - 63;
+                                result |= (b & 0x1f) << shift;
+                                shift += 5;
+                            }} while (b >= 0x20);
+                            delta[i] = (result & 1) ? ~(result >> 1) : (result >> 1);
+                        }}
+                        lat += delta[0];
+                        lng += delta[1];
+                        coords.push([lat / 1e5, lng / 1e5]);
+                    }}
+                    return coords;
+                    }}
+
+                    function onClick(e) {{                
                                     
-                    var coords = e.target.options.pathCoords;
+                    var coords = decodePath(e.target.options.encodedPath);
 
                     var circle_radius = e.target.options.circleRadius;
                     var ship_location = [e.latlng.lat, e.latlng.lng];
@@ -718,64 +976,25 @@ def add_on_click_functionality(map):
      
     return map
 
-def extrapolate_variables(glider_df, extrapolation_variables, extrapolation_targets):
-    '''Perform linear extrapolation of given variables'''
-    # Calculate the differences between rows in datetime and battery_variable columns
-    gradient_df = glider_df[extrapolation_variables + ["datetime"]].diff()
-
-    # Create the dataframe used to hold extrapolated data
-    last_datetime = glider_df["datetime"].loc[glider_df["datetime"].idxmax()]
-    extrapolated_data = pd.DataFrame([np.full(len(extrapolation_variables), np.nan)], columns=extrapolation_variables)
-    extrapolated_data = extrapolated_data.add_suffix("_extrapolated")
-    extrapolated_data["datetime"] = last_datetime
-
-    for i,variable in enumerate(extrapolation_variables):
-        # Determine latest non-NA value for variable and its datetime
-        last_value = glider_df[variable].loc[glider_df[variable].last_valid_index()]
-        last_value_datetime = glider_df["datetime"].loc[glider_df[variable].last_valid_index()]
-
-        extrapolation_target = extrapolation_targets[i]
-        # Calculate the difference per second for each row
-        gradient_df[f"{variable}_per_second"] = gradient_df[variable]/gradient_df["datetime"].dt.seconds
-        # Take the weighted average per second difference from rows within timeframe ending at last valid variable data point
-        # making sure not to include NAs
-        gradient_timeframe = timedelta(hours=12)
-        gradient_timeframe_idx = ((glider_df["datetime"] > last_value_datetime - gradient_timeframe) & 
-                                  (gradient_df[f"{variable}_per_second"].notna()))
-
-        if(len(gradient_timeframe_idx) > 0):
-            avg_gradient = np.average(gradient_df[gradient_timeframe_idx][f"{variable}_per_second"], 
-                                      weights=gradient_df[gradient_timeframe_idx]["datetime"].dt.seconds)
-        else:
-            avg_gradient = np.nan
+def extrapolate_variables(glider_df, forecasts, extrapolation_variables, extrapolation_targets):
+    '''Linear extrapolation of given variables to their targets, from the glider's forecast state (see glider_forecast.py)'''
+    # Extrapolated values by datetime: the latest datetime, and the start and end point of each variable's extrapolation
+    extrapolated_points = {glider_df["datetime"].max(): {}}
 
-        if(np.isnan(avg_gradient) | 
-           (avg_gradient*(extrapolation_target-last_value) <= 0)): # Gradient == 0 or different sign from expected gradient
+    for variable, extrapolation_target in zip(extrapolation_variables, extrapolation_targets):
+        variable_forecast = forecast(forecasts, variable, extrapolation_target)
+        if(variable_forecast is None):
             continue # Extrapolated values are NaN
 
-        secs_to_target = (extrapolation_target-last_value)/avg_gradient
-        secs_to_target = np.ceil(secs_to_target)
-
-        extrapolated_datetime = last_value_datetime + timedelta(seconds=secs_to_target)
-        extrapolated_value = last_value + secs_to_target*avg_gradient
-
-        # Add the starting point for the extrapolated graph
-        if(extrapolated_data.datetime.isin([last_value_datetime]).any()): # If startpoint datetime already in dataframe
-            extrapolated_data.loc[extrapolated_data["datetime"] == last_value_datetime, f"{variable}_extrapolated"] = last_value
-        else:                                                             # If startpoint datetime not yet in dataframe
-            new_row = {"datetime":last_value_datetime, f"{variable}_extrapolated":last_value}
-            extrapolated_data = pd.concat([extrapolated_data, pd.DataFrame([new_row])], ignore_index=True)
-            
-        # Add the end point for the extrapolated graph
-        if(extrapolated_data.datetime.isin([extrapolated_datetime]).any()): # If endpoint datetime already in dataframe
-            extrapolated_data.loc[extrapolated_data["datetime"] == extrapolated_datetime, f"{variable}_extrapolated"] = extrapolated_value
-        else:                                                               # If endpoint datetime not yet in dataframe
-            new_row = {"datetime":extrapolated_datetime, f"{variable}_extrapolated":extrapolated_value}
-            extrapolated_data = pd.concat([extrapolated_data, pd.DataFrame([new_row])], ignore_index=True)
+        extrapolated_points.setdefault(pd.Timestamp(variable_forecast["last_datetime"]), {})[f"{variable}_extrapolated"] = variable_forecast["last_value"]
+        extrapolated_points.setdefault(pd.Timestamp(variable_forecast["target_datetime"]), {})[f"{variable}_extrapolated"] = variable_forecast["target_value"]
+
+    extrapolated_data = pd.DataFrame(list(extrapolated_points.values()), dtype=float,
+                                     index=pd.DatetimeIndex(list(extrapolated_points.keys()), name="datetime"),
+                                     columns=[f"{variable}_extrapolated" for variable in extrapolation_variables])
     
     # Since Altair has issues with columns that are mostly missing values, we need to extrapolate all variables to the last datetime
-    extrapolated_data.sort_values(by=["datetime"], inplace=True)
-    extrapolated_data.set_index("datetime", inplace=True)
+    extrapolated_data.sort_index(inplace=True)
     extrapolated_data.interpolate(method='time', inplace=True, limit_direction="forward", limit_area="inside")
     extrapolated_data.reset_index(inplace=True)
 
@@ -801,7 +1020,10 @@ def extrapolate_glider_battery(glider_name, glider_df, interesting_sensors):
     extrapolation_variables = [battery_variable, "m_coulomb_amphr_total"]
     extrapolation_targets = [battery_extrapolation_target, coulomb_extrapolation_target]
 
-    extrapolated_data = extrapolate_variables(glider_df, extrapolation_variables, extrapolation_targets)
+    # Forecast state is updated when surfacings are stored, this only reads surfacings stored since
+    forecasts = update_forecast('../Map Data/Gliders/JSONs/positions', '../Map Data/Gliders/JSONs/forecasts', 
+                                str.lower(glider_name), FORECAST_SENSORS + extrapolation_variables)
+    extrapolated_data = extrapolate_variables(glider_df, forecasts, extrapolation_variables, extrapolation_targets)
 
     # Create the dataframe used in plotting
     plot_df = glider_df[["datetime"]+interesting_sensors].copy()
@@ -860,6 +1082,8 @@ def adjust_glider_popup_chart_domains(glider_df, battery_variable, battery_domai
 
 def create_glider_popup_chart(glider_name, glider_df, interesting_sensors):
     '''Create the chart used in glider popup'''
+    import altair as alt
+
     plot_df, battery_variable, battery_unit, battery_domain, coulomb_domain = extrapolate_glider_battery(glider_name, glider_df, interesting_sensors)
 
     date_range = [min(glider_df.datetime),max(glider_df.datetime)]
@@ -907,6 +1131,7 @@ def create_glider_popup_chart(glider_name, glider_df, interesting_sensors):
     )
     return chart
 
+@timed()
 def add_glider_markers(map, glider_data, interesting_sensors):
     '''Add markers for gliders on the map'''
 
@@ -965,6 +1190,7 @@ def add_glider_markers(map, glider_data, interesting_sensors):
 
     return map
 
+@timed()
 def add_ship_markers(map, ships_df):
     '''Add markers for ships on the map'''
 
@@ -981,7 +1207,7 @@ def add_ship_markers(map, ships_df):
         iframe = folium.IFrame(html=ship.tooltip_html, width=300, height=350)
         popup = folium.Popup(html=iframe, max_width=300)
         marker = plugins.BoatMarker([ship.latitude, ship.longitude], popup=popup, 
-                           heading=ship.cog, pathCoords=ship.path, circleRadius=ship.range, 
+                           heading=ship.cog, encodedPath=encode_path(ship.path), circleRadius=round(ship.range), 
                            color=ship.max_class_colour)
         
         if(ship.max_class_colour == "yellow"):
@@ -1260,8 +1486,11 @@ def add_map_tools(map):
 
     return map
 
+@timed()
 def draw_map(map_center, ships_df, vip_ships, db_connection):
     '''Draw interactive map based on AIS data'''
+    load_map_libraries()
+
     map = folium.Map(location=map_center, zoom_start=9, tiles=None)
     map = add_on_click_functionality(map)
 
@@ -1269,7 +1498,7 @@ def draw_map(map_center, ships_df, vip_ships, db_connection):
 
     if(glider_data == None):
         # Still draw a map of ships if there's no active gliders
-        ships_df = process_no_gliders_ship_data(ships_df)
+        ships_df = process_no_gliders_ship_data(ships_df, vip_ships, db_connection)
         map = add_no_gliders_ship_markers(map, ships_df, vip_ships)
         map = add_aranda_plan(map)
     else:
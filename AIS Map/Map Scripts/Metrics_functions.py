@@ -0,0 +1,136 @@
+#############################
+#         Imports           #
+#############################
+
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Set AIS_METRICS_FILE to also append the run metrics to a separate file
+# Set AIS_PROFILE to a file path to dump a cProfile of the whole run there
+#   (view e.g. with python -m pstats <file> or snakeviz)
+METRICS_FILE_VARIABLE = "AIS_METRICS_FILE"
+PROFILE_FILE_VARIABLE = "AIS_PROFILE"
+
+# Metrics of the current run, kept per thread so jobs running in parallel (see ../Service) don't mix
+# NOTE: Durations are inclusive, so e.g. load_data also contains the time of check_missing_meta
+thread_runs = threading.local()
+
+def get_run():
+    '''Get the metrics and state of the current thread's run'''
+    if(not hasattr(thread_runs, "metrics")):
+        thread_runs.metrics = {"durations": {}, "calls": {}, "counts": {}, "sizes": {}}
+        thread_runs.state = {"script": None, "start": None, "profiler": None}
+    return thread_runs.metrics, thread_runs.state
+
+#############################
+#     Collecting metrics    #
+#############################
+
+@contextmanager
+def timer(stage):
+    '''Add the duration of the with block to the stage duration'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run_metrics, _ = get_run()
+        durations = run_metrics["durations"]
+        durations[stage] = durations.get(stage, 0) + time.perf_counter() - start
+        run_metrics["calls"][stage] = run_metrics["calls"].get(stage, 0) + 1
+
+def timed(stage=None):
+    '''Decorator for timing every call of a function (stage defaults to the function name)'''
+    def decorator(function):
+        name = stage or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    '''Add to a counter, e.g. number of rows'''
+    run_metrics, _ = get_run()
+    run_metrics["counts"][name] = run_metrics["counts"].get(name, 0) + int(value)
+
+def add_size(name, num_bytes):
+    '''Add to a size counter in bytes, e.g. API payload size'''
+    run_metrics, _ = get_run()
+    run_metrics["sizes"][name] = run_metrics["sizes"].get(name, 0) + int(num_bytes)
+
+def get_peak_rss_mb():
+    '''Peak resident set size of this process in megabytes'''
+    if(resource is None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if(sys.platform == "darwin"):
+        return round(peak/1024**2, 1)
+    return round(peak/1024, 1)
+
+#############################
+#      Run bookkeeping      #
+#############################
+
+def start_run(script):
+    '''Reset metrics and start profiling if requested'''
+    run_metrics, run_state = get_run()
+    for metrics in run_metrics.values():
+        metrics.clear()
+
+    run_state["script"] = script
+    run_state["start"] = time.perf_counter()
+
+    if(os.environ.get(PROFILE_FILE_VARIABLE)):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            run_state["profiler"] = profiler
+        except ValueError: # Newer Pythons only allow one active profiler, e.g. another job's
+            print(f"Not profiling {script}, another profiler is already active")
+
+def end_run():
+    '''Print the run metrics as one JSON line (and append to AIS_METRICS_FILE if set)'''
+    run_metrics, run_state = get_run()
+
+    profiler = run_state["profiler"]
+    if(profiler is not None):
+        profiler.disable()
+        profiler.dump_stats(os.environ[PROFILE_FILE_VARIABLE])
+        run_state["profiler"] = None
+
+    total = None
+    if(run_state["start"] is not None):
+        total = round(time.perf_counter() - run_state["start"], 4)
+
+    line = json.dumps({"script":      run_state["script"],
+                       "time":        datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+                       "total_s":     total,
+                       "durations_s": {stage: round(duration, 4) for stage, duration in run_metrics["durations"].items()},
+                       "calls":       run_metrics["calls"],
+                       "counts":      run_metrics["counts"],
+                       "sizes_bytes": run_metrics["sizes"],
+                       "peak_rss_mb": get_peak_rss_mb()})
+
+    print(line, flush=True)
+
+    metrics_file = os.environ.get(METRICS_FILE_VARIABLE)
+    if(metrics_file):
+        with open(metrics_file, "a") as file:
+            file.write(line + "\n")
+
+    return line
@@ -0,0 +1,32 @@
+from Digitraffic_To_SQLite_functions import create_connection, backfill_meta_queue
+from Metrics_functions import start_run, end_run
+import sys
+
+# NOTE: Required downloads: 
+# UpdatedPub150.csv from https://msi.nga.mil/Publications/WPI 
+# code-list_csv.csv from https://datahub.io/core/un-locode
+# Make sure you're in the same directory, 
+# or adjust their paths in Digitraffic_To_SQLite_functions.py
+
+def backfill_meta(db_connection, max_ships):
+    '''Get metadata for ships queued by the map scripts'''
+    found = backfill_meta_queue(db_connection, max_ships)
+    print(f"Backfilled metadata for {found} ships")
+
+if __name__ == "__main__":
+    start_run("backfill_meta")
+
+    # database = "AIS.sqlite"
+    database = sys.argv[1]
+    db_connection = create_connection(database)
+
+    # Each ship is a separate API call (>0.5s per mmsi), so limit the number of ships per run
+    # max_ships = 100
+    max_ships = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    backfill_meta(db_connection, max_ships)
+    db_connection.close()
+
+    end_run()
+
+# .../your_env_name_here/bin/python ".../FMI Gliders/AIS Map/Map Scripts/backfill_meta.py" ".../FMI Gliders/AIS Map/Map Data/AIS.sqlite" 100
@@ -1,6 +1,6 @@
 from Digitraffic_To_SQLite_functions import (create_connection, update_meta_table, 
                                             collect_ships_locations, append_table, 
-                                            delete_duplicate_rows)
+                                            delete_duplicate_rows, create_location_indexes)
 from datetime import datetime, timedelta
 from math import floor
 import sys
@@ -36,6 +36,7 @@ locations_df = collect_ships_locations(latitude, longitude, distance, since)
 
 append_table(db_connection, locations_df, "locations")
 delete_duplicate_rows(db_connection, "locations", ", ".join(list(locations_df.columns)))
+create_location_indexes(db_connection)
 
 db_connection.close()
 
@@ -1,104 +1,158 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from math import floor
 import os
+import sys
 import sqlite3
-import json
+
+from Digitraffic_To_SQLite_functions import rebuild_current_threats, create_threat_indexes
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Glider Data Processing"))
+from glider_positions import remove_positions_until
+from glider_plans import remove_plans_until
+from glider_database import sync_database
+from shared_files import locked, read_json_file, write_json_file
 
 def read_json_remove_glider(json_root, json_file, glider):
-    '''Read json and remove ALL glider data'''
-    # read previous position list as json
-    with open('{}/{}'.format(json_root, json_file), 'r') as file:
-        json_data = json.load(file)
-        file.close()
-    
-    try:
+    '''Read json and remove ALL glider data, returns whether the glider was in it'''
+    with locked(json_root):
+        json_data = read_json_file('{}/{}'.format(json_root, json_file))
+        if(json_data is None or glider not in json_data):
+            return False
+
         del json_data[glider]
-    except KeyError as e:
-        # print(e)
-        return
-
-    with open('{}/{}'.format(json_root, json_file), 'w') as file:
-        json.dump(json_data, file)
-        file.close()
-
-def read_json_remove_glider_by_date(json_root, json_file, glider, mission_end_string):
-    '''Read json and remove glider data before given datetime'''
-    # read previous position list as json
-    with open('{}/{}'.format(json_root, json_file), 'r') as file:
-        json_data = json.load(file)
-        file.close()
-    
-    try:
+        write_json_file('{}/{}'.format(json_root, json_file), json_data)
+    return True
+
+def read_json_remove_glider_by_date(json_root, json_file, glider, mission_end_datetime):
+    '''Read json and remove glider data up to given datetime ("2023-11-23T14:30:00Z"), returns the number of surfacings removed'''
+    with locked(json_root):
+        json_data = read_json_file('{}/{}'.format(json_root, json_file))
+        if(json_data is None or glider not in json_data):
+            return 0
+
         glider_data = json_data[glider]
-    except KeyError as e:
-        # print(e)
-        return
-    if(isinstance(glider_data, list)):
-        json_data[glider] = [elem for elem in glider_data if elem["datetime"] > mission_end_string + "Z"]
-    else:
-        if(glider_data["datetime"] < mission_end_string + "Z"):
+        if(isinstance(glider_data, list)):
+            json_data[glider] = [elem for elem in glider_data if elem["datetime"] > mission_end_datetime]
+            removed = len(glider_data) - len(json_data[glider])
+        elif(glider_data["datetime"] <= mission_end_datetime):
             del json_data[glider]
+            removed = 1
+        else:
+            removed = 0
 
-    with open('{}/{}'.format(json_root, json_file), 'w') as file:
-        json.dump(json_data, file)
-        file.close()
+        if(removed > 0):
+            write_json_file('{}/{}'.format(json_root, json_file), json_data)
+    return removed
 
 def delete_invalid_threats(db_connection, timestamp, glider):
-    '''Delete rows from database threats table for a glider with updatetime > mission end time'''
+    '''Delete rows from database threats table for a glider with updatetime > mission end time, returns the number deleted
+
+       The delete and the rebuild of current_threats (if the table exists) are committed together,
+       so the map never sees one without the other'''
 
-    sql_command = f"DELETE FROM threats WHERE locAPICallTimestamp > {timestamp} AND glider_name = '{str.capitalize(glider)}'"
     sql_cursor = db_connection.cursor()
-    sql_cursor.execute(sql_command)
-    db_connection.commit()
+    sql_cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'threats'")
+    if(sql_cursor.fetchone() is None):
+        return 0
 
-def delete_gotos_and_yos(archive_root, mission_end_string):
-    '''Delete invalid data after glider retrieval'''
-    # Choose files before mission end
-    files = [f for f in os.listdir(archive_root) if (f.split('_')[0] < mission_end_string)]
+    # Index on (glider_name, locAPICallTimestamp), so only the deleted rows are read
+    create_threat_indexes(db_connection)
 
-    # Delete files
-    for file in files:
-        os.remove(f"{archive_root}/{file}")
+    try:
+        sql_cursor.execute("DELETE FROM threats WHERE glider_name = ? AND locAPICallTimestamp > ?",
+                           (str.capitalize(glider), timestamp))
+        deleted = sql_cursor.rowcount
 
-def check_latest_read_goto(log_root, mission_end_string, json_root, glider):
-        with open(f'{log_root}/latest_read_goto.txt', 'r') as file:
-            latest_read_goto = file.read()
-            file.close()
+        # Latest threat times may have been deleted
+        rebuild_current_threats(db_connection)
+        db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
 
-        if(latest_read_goto.split('_')[0] < mission_end_string):
-            read_json_remove_glider(json_root, "glider_waypoints.json", glider)
+    return deleted
 
+def delete_gotos_and_yos(archive_root, mission_end_string):
+    '''Delete the mission's goto and yo files (named like 20231113T093418_goto_l10.ma) from before the mission end, returns the number deleted'''
+    deleted = 0
+    try:
+        with os.scandir(archive_root) as entries:
+            for entry in entries:
+                if(entry.is_file() and entry.name.split('_')[0] < mission_end_string):
+                    os.remove(entry.path)
+                    deleted += 1
+    except FileNotFoundError:
+        pass
+    return deleted
 
-def main():
-    '''Delete invalid data after glider retrieval'''
-    glider = "uivelo"
-    mission_end = datetime.strptime("2023-11-23 14:30:00", "%Y-%m-%d %H:%M:%S")
+def check_latest_read_goto(log_root, mission_end_string, json_root, glider):
+    '''Remove the glider's waypoints if its latest read goto file is from before the mission end, returns whether they were removed'''
+    try:
+        with open(f'{log_root}/latest_read_goto.txt', 'r') as file:
+            latest_read_goto = file.read()
+    except FileNotFoundError:
+        return False
+
+    if(latest_read_goto.split('_')[0] < mission_end_string):
+        return read_json_remove_glider(json_root, "glider_waypoints.json", glider)
+    return False
+
+def parse_mission_end(mission_end):
+    '''Mission end from "2023-11-23 14:30:00" or "2023-11-23T14:30:00Z", in UTC like the glider logs'''
+    mission_end = datetime.fromisoformat(mission_end.replace("Z", "+00:00"))
+    if(mission_end.tzinfo is None):
+        mission_end = mission_end.replace(tzinfo=timezone.utc)
+    return mission_end.astimezone(timezone.utc)
+
+def mission_end_cleanup(glider, mission_end, database, gliders_root):
+    '''Delete invalid data after glider retrieval, returns the number of removed items by kind'''
+    json_root = f"{gliders_root}/JSONs"
+    archive_root = f"{gliders_root}/{glider}/archive"
+    log_root = f"{gliders_root}/{glider}/data"
+
+    # Format datetime like goto and yo files, and like the surfacings' datetimes
+    mission_end_string = mission_end.strftime("%Y%m%dT%H%M%S")
+    mission_end_datetime = mission_end.strftime("%Y-%m-%dT%H:%M:%SZ")
     timestamp = floor(mission_end.timestamp()*1000)
 
-    database = "./AIS Map/Map Data/AIS.sqlite"
-    json_root = "./AIS Map/Map Data/Gliders/JSONs"
-    archive_root = f"./AIS Map/Map Data/Gliders/{glider}/archive"
-    log_root = f"./AIS Map/Map Data/Gliders/{glider}/data"
+    removed = {}
+    removed["goto_and_yo_files"] = delete_gotos_and_yos(archive_root, mission_end_string)
+    removed["waypoints"] = int(check_latest_read_goto(log_root, mission_end_string, json_root, glider))
+    removed["plans"] = remove_plans_until(f"{json_root}/plans", glider, mission_end_datetime)
 
-    # Format datetime like goto and yo files
-    mission_end_string = mission_end.strftime("%Y%m%dT%H%M%S")
+    # Surfacings stay in the database's glider tables for analysis, insert any not synced yet
+    sync_database(database, f"{json_root}/positions", [glider])
 
-    delete_gotos_and_yos(archive_root, mission_end_string)
+    # Position store is cut at the mission end without parsing the kept surfacings
+    removed["surfacings"] = remove_positions_until(f"{json_root}/positions", glider, mission_end_datetime)
+    removed["deployment_position"] = read_json_remove_glider_by_date(json_root, "deployment_positions.json", glider, mission_end_datetime)
+    removed["last_position"] = read_json_remove_glider_by_date(json_root, "last_positions.json", glider, mission_end_datetime)
 
-    check_latest_read_goto(log_root, mission_end_string, json_root, glider)
+    db_connection = sqlite3.connect(database)
+    try:
+        removed["threats"] = delete_invalid_threats(db_connection, timestamp, glider)
+    finally:
+        db_connection.close()
 
-    read_json_remove_glider_by_date(json_root, "current_positions.json", glider, mission_end_string)
-    read_json_remove_glider_by_date(json_root, "deployment_positions.json", glider, mission_end_string)
-    read_json_remove_glider_by_date(json_root, "last_positions.json", glider, mission_end_string)
+    return removed
 
-    db_connection = sqlite3.connect(database)
+def main():
+    '''Delete invalid data after glider retrieval'''
+    # glider = "uivelo"
+    # mission_end = "2023-11-23 14:30:00"
+    glider = sys.argv[1].lower()
+    mission_end = parse_mission_end(sys.argv[2])
+    database = sys.argv[3] if len(sys.argv) > 3 else "./AIS Map/Map Data/AIS.sqlite"
+    gliders_root = sys.argv[4] if len(sys.argv) > 4 else "./AIS Map/Map Data/Gliders"
 
-    delete_invalid_threats(db_connection, timestamp, glider)
+    removed = mission_end_cleanup(glider, mission_end, database, gliders_root)
 
-    db_connection.close()
+    print(f"{glider} mission end {mission_end:%Y-%m-%dT%H:%M:%SZ}, removed:")
+    for kind, number in removed.items():
+        print(f"    {kind}: {number}")
 
 if __name__ == "__main__":
     main()
 
-# Change parameters in main to reflect end of mission, then run:
-# python "./AIS Map/Map Scripts/mission_end_cleanup.py"
\ No newline at end of file
+# python "./AIS Map/Map Scripts/mission_end_cleanup.py" uivelo "2023-11-23 14:30:00"
+# python "./AIS Map/Map Scripts/mission_end_cleanup.py" uivelo "2023-11-23 14:30:00" "./AIS Map/Map Data/AIS.sqlite" "./AIS Map/Map Data/Gliders"
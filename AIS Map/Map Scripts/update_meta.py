@@ -1,5 +1,6 @@
 from Digitraffic_To_SQLite_functions import (create_connection, update_meta_table, 
                                              get_latest_meta_update_timestamp)
+from Metrics_functions import start_run, end_run
 import sys
 
 # NOTE: Required downloads: 
@@ -8,12 +9,9 @@ import sys
 # Make sure you're in the same directory, 
 # or adjust their paths in Digitraffic_To_SQLite_functions.py
 
-# database = "AIS.sqlite"
-database = sys.argv[1]
-db_connection = create_connection(database)
-
-# Updates metadata for known mmsis and adds new rows for new mmsis since last update
-update_meta_table(db_connection, get_latest_meta_update_timestamp(db_connection))
+def update_meta(db_connection):
+    '''Update metadata for known mmsis and add new rows for new mmsis since last update'''
+    update_meta_table(db_connection, get_latest_meta_update_timestamp(db_connection))
 
 # NOTE: Instead of updating existing metadata, you can also simply append by using
 """ from datetime import datetime, timedelta
@@ -27,6 +25,16 @@ delete_duplicate_rows(db_connection, "meta", ", ".join(list(meta_df.columns)))""
 #       each mmsi separately probably shouldn't be used due to being very slow 
 #       (>0.5s per mmsi)
 
-db_connection.close()
+if __name__ == "__main__":
+    start_run("update_meta")
+
+    # database = "AIS.sqlite"
+    database = sys.argv[1]
+    db_connection = create_connection(database)
+
+    update_meta(db_connection)
+    db_connection.close()
+
+    end_run()
 
 # .../your_env_name_here/bin/python ".../FMI Gliders/AIS Map/Map Scripts/update_meta.py" ".../FMI Gliders/AIS Map/Map Data/AIS.sqlite"
\ No newline at end of file
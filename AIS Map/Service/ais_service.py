@@ -0,0 +1,224 @@
+#############################
+#         Imports           #
+#############################
+
+import os
+import sys
+import json
+import signal
+import threading
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SERVICE_DIR, "..", "Map Scripts"))
+sys.path.insert(0, os.path.join(SERVICE_DIR, "..", "Glider Data Processing"))
+
+# Imported once and kept warm for every job run
+from Digitraffic_To_SQLite_functions import create_connection
+from Metrics_functions import start_run, end_run
+from update_meta import update_meta
+from backfill_meta import backfill_meta
+from update_locations import update_locations
+from update_threats import update_threats
+from parse2 import update_location, OLD_POSITIONS_FILE
+from update_glider_wpts_json import update_glider_waypoints
+from update_gliders import update_gliders, find_gliders
+
+#############################
+#           Tasks           #
+#############################
+
+# Each task takes a thread's database connection (or None) and the job's "args" from the config
+
+def update_meta_task(db_connection, args):
+    update_meta(db_connection)
+
+def backfill_meta_task(db_connection, args):
+    backfill_meta(db_connection, args.get("max_ships", 100))
+
+def update_locations_task(db_connection, args):
+    update_locations(db_connection, args["since_hrs"], args["map_root_dir"], args["map_filename"])
+
+def update_threats_task(db_connection, args):
+    update_threats(db_connection, args["since_hrs"], args["recency_cutoff_mins"],
+                   args["map_root_dir"], args["map_filename"])
+
+def parse_glider_task(db_connection, args):
+    # Like parse2.py, only print errors since "No new logfiles" is the usual case
+    try:
+        update_location(args["dataroot"], args["glider"], args.get("positions_file", OLD_POSITIONS_FILE), args["start_mission"],
+                        args.get("database"))
+    except Exception as e:
+        print(e)
+
+def update_glider_waypoints_task(db_connection, args):
+    update_glider_waypoints(args["dataroot"], args["goto_dir"], args["waypoints_file"], args["glider"])
+
+def update_gliders_task(db_connection, args):
+    # All gliders with a logs directory unless listed in args
+    gliders = args.get("gliders") or find_gliders(args["dataroot"])
+    update_gliders(args["dataroot"], gliders, args["start_mission"], args.get("positions_file", OLD_POSITIONS_FILE),
+                   args["goto_dir"], args["waypoints_file"], args.get("glider_workers"), args.get("database"))
+
+# Task name in config: (function, whether it needs the database)
+TASKS = {"update_meta":             (update_meta_task,             True),
+         "backfill_meta":           (backfill_meta_task,           True),
+         "update_locations":        (update_locations_task,        True),
+         "update_threats":          (update_threats_task,          True),
+         "parse_glider":            (parse_glider_task,            False),
+         "update_glider_waypoints": (update_glider_waypoints_task, False),
+         "update_gliders":          (update_gliders_task,          False)}
+
+#############################
+#        Scheduling         #
+#############################
+
+def next_run_time(schedule, after):
+    '''Next time (after given datetime) matching the schedule
+
+       Schedules are either
+           {"minutes": [0, 30]}                 - Minutes of the hour, like cron
+           {"minutes": [55], "hours": [0, 6]}   - Optionally limited to given hours
+           {"interval_seconds": 300}            - Fixed interval from the previous run'''
+
+    if("interval_seconds" in schedule):
+        return after + timedelta(seconds=schedule["interval_seconds"])
+
+    minutes = sorted(schedule["minutes"])
+    hours = sorted(schedule.get("hours", range(24)))
+
+    candidate = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    # At most a day ahead
+    for _ in range(24*60 + 1):
+        if(candidate.hour in hours and candidate.minute in minutes):
+            return candidate
+        candidate += timedelta(minutes=1)
+
+    raise ValueError(f"Schedule {schedule} never runs")
+
+class Job:
+    '''A configured task, its schedule and its lock group'''
+
+    def __init__(self, config, defaults, lock_groups):
+        self.name = config["name"]
+        self.task, self.needs_database = TASKS[config["task"]]
+        self.schedule = config["schedule"]
+        self.args = dict(defaults, **config.get("args", {}))
+        self.database = self.args.get("database")
+
+        # Held while the job is queued or running, so runs of the same job never pile up
+        self.pending = threading.Lock()
+
+        # Jobs in the same lock group wait for each other instead of running at the same time
+        # (e.g. all jobs writing the database and the map)
+        self.lock_group = config.get("lock_group", self.name)
+        self.lock = lock_groups.setdefault(self.lock_group, threading.Lock())
+
+        self.next_run = next_run_time(self.schedule, datetime.now())
+
+class Service:
+    '''Runs configured jobs on their schedules in one resident process'''
+
+    def __init__(self, config):
+        self.lock_groups = {}
+        defaults = config.get("defaults", {})
+        self.jobs = [Job(job_config, defaults, self.lock_groups) for job_config in config["jobs"]
+                     if job_config.get("enabled", True)]
+        self.executor = ThreadPoolExecutor(max_workers=config.get("workers", 3), thread_name_prefix="job")
+        self.stop_event = threading.Event()
+        self.thread_connections = threading.local()
+
+    def get_connection(self, database):
+        '''Database connection of the current worker thread, opened once and reused'''
+        # NOTE: sqlite3 connections can only be used from the thread that created them
+        connections = getattr(self.thread_connections, "connections", None)
+        if(connections is None):
+            connections = self.thread_connections.connections = {}
+
+        if(database not in connections):
+            connections[database] = create_connection(database)
+
+        return connections[database]
+
+    def run_job(self, job):
+        '''Run a job once its lock group is free, job.pending has to be acquired before calling'''
+        try:
+            with job.lock:
+                print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Starting {job.name}", flush=True)
+                start_run(job.name)
+                try:
+                    db_connection = self.get_connection(job.database) if job.needs_database else None
+                    job.task(db_connection, job.args)
+                except Exception:
+                    # A failing job shouldn't take down the service or the other jobs
+                    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {job.name} failed:", flush=True)
+                    traceback.print_exc()
+                finally:
+                    end_run()
+        finally:
+            job.pending.release()
+
+    def submit(self, job):
+        '''Queue a job unless its previous run is still queued or running'''
+        if(not job.pending.acquire(blocking=False)):
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Skipping {job.name}, previous run still running", flush=True)
+            return None
+        return self.executor.submit(self.run_job, job)
+
+    def run_forever(self):
+        '''Scheduler loop, runs until stop() (SIGTERM/SIGINT)'''
+        for job in self.jobs:
+            print(f"{job.name}: next run at {job.next_run:%Y-%m-%d %H:%M:%S}", flush=True)
+
+        while(not self.stop_event.is_set()):
+            now = datetime.now()
+            for job in self.jobs:
+                if(job.next_run <= now):
+                    self.submit(job)
+                    job.next_run = next_run_time(job.schedule, now)
+
+            next_run = min(job.next_run for job in self.jobs)
+            self.stop_event.wait(max(0, (next_run - datetime.now()).total_seconds()))
+
+        print("Stopping, waiting for running jobs to finish", flush=True)
+        self.executor.shutdown(wait=True)
+
+    def run_once(self, job_names):
+        '''Run given jobs once now and wait for them'''
+        jobs = [job for job in self.jobs if job.name in job_names]
+        futures = [self.submit(job) for job in jobs]
+        for future in futures:
+            if(future is not None):
+                future.result()
+        self.executor.shutdown(wait=True)
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+def main():
+    # config_file = "service_config.json"
+    config_file = sys.argv[1]
+    with open(config_file, 'r') as file:
+        config = json.load(file)
+
+    # The map scripts use paths relative to their own directory (e.g. ../Map Data/Ports)
+    os.chdir(os.path.join(SERVICE_DIR, config.get("working_directory", "../Map Scripts")))
+
+    service = Service(config)
+
+    if(len(sys.argv) > 2):
+        # Run given jobs once, e.g. for testing the config
+        service.run_once(sys.argv[2:])
+        return
+
+    signal.signal(signal.SIGTERM, service.stop)
+    signal.signal(signal.SIGINT, service.stop)
+    service.run_forever()
+
+if __name__ == "__main__":
+    main()
+
+# .../your_env_name_here/bin/python ".../FMI Gliders/AIS Map/Service/ais_service.py" ".../FMI Gliders/AIS Map/Service/service_config.json"
+# .../your_env_name_here/bin/python ".../FMI Gliders/AIS Map/Service/ais_service.py" ".../FMI Gliders/AIS Map/Service/service_config.json" update_threats